@@ -0,0 +1,86 @@
+"""
+Measure answering polls for an unchanged JSON document: building the body
+every time, with `conditional` answering ``304 Not Modified`` and with
+`AutoETagResource` answering ``304 Not Modified`` after building the body.
+
+Run with ``python benchmarks/conditional_get.py``.
+"""
+import json
+from timeit import Timer
+
+from zope.interface import implementer
+
+from txspinneret.conditional import AutoETagResource, conditional
+from txspinneret.interfaces import ISpinneretResource
+from txspinneret.resource import SpinneretResource
+from txspinneret.test.util import InMemoryRequest
+
+
+
+_ITEMS = [dict(id=i, name=u'Item %d' % (i,), tags=[u'a', u'b'])
+          for i in range(500)]
+_VERSION = 42
+
+
+
+def _document():
+    return json.dumps(_ITEMS)
+
+
+
+@implementer(ISpinneretResource)
+class _Plain(object):
+    def render_GET(self, request):
+        return _document()
+
+
+
+@implementer(ISpinneretResource)
+class _Conditional(object):
+    def render_GET(self, request):
+        return conditional(_document, etag=_VERSION)
+
+
+
+def _etag(resource):
+    request = InMemoryRequest([])
+    request.render(resource)
+    return request.responseHeaders.getRawHeaders(b'etag', [None])[0]
+
+
+
+_AUTO = AutoETagResource(SpinneretResource(_Plain()))
+
+CASES = [
+    ('full body', SpinneretResource(_Plain()), None),
+    ('conditional', SpinneretResource(_Conditional()), b'"42"'),
+    ('auto etag', _AUTO, _etag(_AUTO)),
+    ]
+
+
+
+def bench(resource, etag, number):
+    """
+    Render ``number`` requests, with ``If-None-Match: etag`` if ``etag`` is
+    not ``None``.
+
+    :return: Requests per second.
+    """
+    def _request():
+        request = InMemoryRequest([])
+        if etag is not None:
+            request.requestHeaders.setRawHeaders(b'if-none-match', [etag])
+        request.render(resource)
+    return number / min(Timer(_request).repeat(repeat=5, number=number))
+
+
+
+def main(number=1000):
+    print '%-12s %12s' % ('case', 'requests/s')
+    for name, resource, etag in CASES:
+        print '%-12s %12.0f' % (name, bench(resource, etag, number))
+
+
+
+if __name__ == '__main__':
+    main()
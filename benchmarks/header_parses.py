@@ -0,0 +1,89 @@
+"""
+Count the number of times request headers are parsed while routing a single
+request, with and without memoizing parsed headers on the request.
+
+Run with ``python benchmarks/header_parses.py``.
+"""
+import cgi
+from timeit import Timer
+
+from twisted.web.resource import getChildForRequest
+from twisted.web.static import Data
+from twisted.web.test.requesthelper import DummyRequest
+
+from txspinneret import util
+from txspinneret.route import Integer, Router, Text
+
+
+
+def _unmemoizedHeader(requestHeaders, name, parse):
+    """
+    Parse request headers every time, as was done before memoization.
+    """
+    return parse(requestHeaders.getRawHeaders(name, []))
+
+
+
+class _API(object):
+    """
+    Router with many parameterised sibling routes.
+    """
+    router = Router()
+
+    def _handler(self, request, params):
+        return Data(b'', b'text/plain')
+
+    for i in range(20):
+        router.route(Text(b'name'), b'literal%d' % (i,))(_handler)
+        router.route(Integer(b'id'), b'literal%d' % (i,), Text(b'name'))(
+            _handler)
+    router.route(Text(b'name'), Text(b'other'), b'target')(_handler)
+
+
+
+def _route():
+    """
+    Route a request.
+    """
+    request = DummyRequest([b'users', b'42', b'target'])
+    request.requestHeaders.setRawHeaders(
+        b'Content-Type', [b'application/json; charset=utf-8'])
+    getChildForRequest(_API().router.resource(), request)
+
+
+
+def _countParses():
+    """
+    Count the number of ``cgi.parse_header`` calls made routing one request.
+    """
+    calls = [0]
+    parseHeader = cgi.parse_header
+    def _parseHeader(value):
+        calls[0] += 1
+        return parseHeader(value)
+    cgi.parse_header = _parseHeader
+    try:
+        _route()
+    finally:
+        cgi.parse_header = parseHeader
+    return calls[0]
+
+
+
+def main(number=2000):
+    print '%-12s %16s %16s' % ('headers', 'parses/request', 'us/request')
+    memoizedHeader = util._memoizedHeader
+    for name, f in [('unmemoized', _unmemoizedHeader),
+                    ('memoized', memoizedHeader)]:
+        util._memoizedHeader = f
+        try:
+            parses = _countParses()
+            elapsed = min(Timer(_route).repeat(repeat=3, number=number))
+        finally:
+            util._memoizedHeader = memoizedHeader
+        print '%-12s %16d %16.1f' % (name, parses, elapsed / number * 1e6)
+
+
+
+if __name__ == '__main__':
+    main()
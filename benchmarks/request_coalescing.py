@@ -0,0 +1,82 @@
+"""
+Measure answering a burst of identical concurrent requests for a resource
+that is expensive to render, with and without `CoalescingResource`.
+
+Run with ``python benchmarks/request_coalescing.py``.
+"""
+import json
+from timeit import Timer
+
+from twisted.internet.defer import Deferred
+from zope.interface import implementer
+
+from txspinneret.coalesce import CoalescingResource
+from txspinneret.interfaces import ISpinneretResource
+from txspinneret.resource import SpinneretResource
+from txspinneret.test.util import InMemoryRequest
+
+
+
+_ITEMS = [dict(id=i, name=u'Item %d' % (i,)) for i in range(500)]
+
+
+
+@implementer(ISpinneretResource)
+class _Backend(object):
+    """
+    Spinneret resource whose response arrives once the burst is over, as if
+    from a backend.
+    """
+    def __init__(self):
+        self.pending = []
+        self.calls = 0
+
+
+    def locateChild(self, request, segments):
+        return self, []
+
+
+    def render_GET(self, request):
+        self.calls += 1
+        d = Deferred()
+        d.addCallback(lambda _: json.dumps(_ITEMS))
+        self.pending.append(d)
+        return d
+
+
+
+def bench(coalesce, burst, number):
+    """
+    Render ``number`` bursts of ``burst`` identical requests.
+
+    :return: 2-`tuple` of requests per second and backend calls per burst.
+    """
+    backend = _Backend()
+    resource = SpinneretResource(backend)
+    if coalesce:
+        resource = CoalescingResource(resource)
+    def _burst():
+        requests = []
+        for _ in range(burst):
+            request = InMemoryRequest([b'items'])
+            request.uri = b'/items'
+            request.render(resource)
+            requests.append(request)
+        while backend.pending:
+            backend.pending.pop().callback(None)
+        assert all(request.finished for request in requests)
+    seconds = min(Timer(_burst).repeat(repeat=5, number=number))
+    return burst * number / seconds, backend.calls / (5.0 * number)
+
+
+
+def main(burst=100, number=20):
+    print '%-12s %12s %8s' % ('case', 'requests/s', 'calls')
+    for name, coalesce in [('uncoalesced', False), ('coalesced', True)]:
+        print '%-12s %12.0f %8.0f' % (
+            (name,) + bench(coalesce, burst, number))
+
+
+
+if __name__ == '__main__':
+    main()
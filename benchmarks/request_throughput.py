@@ -0,0 +1,101 @@
+"""
+Measure the throughput of routing and rendering requests through
+`SpinneretResource`, for flat and nested routers, for spinneret resources
+rendering their own body and for responses answered by `CachingResource`.
+
+Run with ``python benchmarks/request_throughput.py``.
+"""
+from timeit import Timer
+
+from twisted.web.resource import getChildForRequest
+from twisted.web.static import Data
+from zope.interface import implementer
+
+from txspinneret.cache import CachingResource, ResponseCache
+from txspinneret.interfaces import ISpinneretResource
+from txspinneret.route import Integer, Router, Text
+from txspinneret.test.util import InMemoryRequest
+
+
+
+@implementer(ISpinneretResource)
+class _Rendered(object):
+    """
+    Spinneret resource rendering its body directly.
+    """
+    def render_GET(self, request):
+        return b'ok'
+
+
+
+_RENDERED = _Rendered()
+
+
+
+class _API(object):
+    """
+    Router with some literal routes and a nested subroute.
+    """
+    router = Router()
+
+    def _handler(self, request, params):
+        return Data(b'ok', b'text/plain')
+
+    for i in range(20):
+        router.route(b'literal%d' % (i,), Integer(b'id'))(_handler)
+
+    @router.route(b'rendered', Integer(b'id'))
+    def rendered(self, request, params):
+        return _Rendered()
+
+    @router.route(b'shared', Integer(b'id'))
+    def shared(self, request, params):
+        return _RENDERED
+
+    @router.subroute(b'nested', Text(b'name'))
+    def nested(self, request, params):
+        return _API().router.resource()
+
+
+
+_CACHED = CachingResource(_API().router.resource(), ResponseCache(), ttl=60)
+
+_NESTED = [b'nested', b'a', b'nested', b'b', b'nested', b'c']
+
+CASES = [
+    ('flat', [b'literal7', b'42'], None),
+    ('rendered', [b'rendered', b'42'], None),
+    ('shared', [b'shared', b'42'], None),
+    ('nested x3', _NESTED + [b'literal7', b'42'], None),
+    ('cached', _NESTED + [b'literal7', b'42'], _CACHED),
+    ]
+
+
+
+def bench(segments, root, number):
+    """
+    Route and render ``number`` requests for ``segments``, from ``root`` or
+    a new router.
+
+    :return: Requests per second.
+    """
+    uri = b'/' + b'/'.join(segments)
+    def _request():
+        request = InMemoryRequest(list(segments))
+        request.uri = uri
+        request.render(
+            getChildForRequest(root or _API().router.resource(), request))
+        assert request.written == [b'ok'], request.written
+    return number / min(Timer(_request).repeat(repeat=5, number=number))
+
+
+
+def main(number=5000):
+    print '%-12s %12s' % ('case', 'requests/s')
+    for name, segments, root in CASES:
+        print '%-12s %12.0f' % (name, bench(segments, root, number))
+
+
+
+if __name__ == '__main__':
+    main()
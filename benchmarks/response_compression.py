@@ -0,0 +1,74 @@
+"""
+Measure rendering a JSON document cached by `CachingResource`: without
+compression, compressing it for every request and compressing it once with
+`CompressedCache`.
+
+Run with ``python benchmarks/response_compression.py``.
+"""
+import json
+from timeit import Timer
+
+from zope.interface import implementer
+
+from txspinneret.cache import CachingResource, ResponseCache
+from txspinneret.encoding import CompressedCache, EncodingResource
+from txspinneret.interfaces import ISpinneretResource
+from txspinneret.resource import SpinneretResource
+from txspinneret.test.util import InMemoryRequest
+
+
+
+_DOCUMENT = json.dumps(
+    [dict(id=i, name=u'Item %d' % (i,), tags=[u'a', u'b'])
+     for i in range(500)])
+
+
+
+@implementer(ISpinneretResource)
+class _Document(object):
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'application/json')
+        return _DOCUMENT
+
+
+
+def _cached():
+    return CachingResource(
+        SpinneretResource(_Document()), ResponseCache(), ttl=60)
+
+
+
+CASES = [
+    ('identity', _cached()),
+    ('gzip', EncodingResource(_cached(), cache=CompressedCache(maxBytes=0))),
+    ('gzip cached', EncodingResource(_cached())),
+    ]
+
+
+
+def bench(resource, number):
+    """
+    Render ``number`` requests accepting ``gzip``.
+
+    :return: 2-`tuple` of requests per second and response size in bytes.
+    """
+    def _request():
+        request = InMemoryRequest([])
+        request.uri = b'/document'
+        request.requestHeaders.setRawHeaders(b'accept-encoding', [b'gzip'])
+        request.render(resource)
+        return request
+    size = len(b''.join(_request().written))
+    return number / min(Timer(_request).repeat(repeat=5, number=number)), size
+
+
+
+def main(number=1000):
+    print '%-12s %12s %8s' % ('case', 'requests/s', 'bytes')
+    for name, resource in CASES:
+        print '%-12s %12.0f %8d' % ((name,) + bench(resource, number))
+
+
+
+if __name__ == '__main__':
+    main()
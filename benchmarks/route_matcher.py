@@ -0,0 +1,118 @@
+"""
+Micro-benchmark comparing compiled route matchers against the original
+``functools.partial(_matchRoute, ...)`` implementation.
+
+Run with ``python benchmarks/route_matcher.py``.
+"""
+from collections import OrderedDict
+from functools import partial
+from itertools import izip_longest
+from timeit import Timer
+
+from twisted.web.http_headers import Headers
+
+from txspinneret.route import Integer, Text, route, subroute
+
+
+
+def _legacyMatchRoute(components, request, segments, partialMatching):
+    """
+    The original route matching implementation, parsing the route components
+    on every call.
+    """
+    if len(components) == 1 and isinstance(components[0], bytes):
+        components = components[0]
+        if components[:1] == '/':
+            components = components[1:]
+        components = components.split('/')
+
+    results = OrderedDict()
+    NO_MATCH = None, segments
+    remaining = list(segments)
+
+    if len(segments) == len(components) == 0:
+        return results, remaining
+
+    for us, them in izip_longest(components, segments):
+        if us is None:
+            if partialMatching:
+                break
+            else:
+                return NO_MATCH
+        elif them is None:
+            return NO_MATCH
+
+        if callable(us):
+            name, match = us(request, them)
+            if match is None:
+                return NO_MATCH
+            results[name] = match
+        elif us != them:
+            return NO_MATCH
+        remaining.pop(0)
+
+    return results, remaining
+
+
+
+def legacyRoute(*components):
+    return partial(_legacyMatchRoute, components, partialMatching=False)
+
+
+
+def legacySubroute(*components):
+    return partial(_legacyMatchRoute, components, partialMatching=True)
+
+
+
+class _Request(object):
+    """
+    Minimal request, matchers only look at the headers.
+    """
+    requestHeaders = Headers()
+
+
+
+_longPath = [b'files'] + [b'x'] * 200
+
+CASES = [
+    ('literal', (b'/users/all/active',), False,
+     [b'users', b'all', b'active']),
+    ('literal miss', (b'/users/all/active',), False,
+     [b'users', b'all', b'inactive']),
+    ('mixed', (b'users', Integer(b'id'), b'friends', Text(b'name')), False,
+     [b'users', b'42', b'friends', b'bob']),
+    ('arity miss', (b'users', Integer(b'id')), False,
+     [b'users', b'42', b'friends']),
+    ('long subroute', (b'files',), True, _longPath),
+    ]
+
+
+
+def bench(matcher, segments, number):
+    """
+    Time ``number`` calls of ``matcher``, in microseconds per call.
+    """
+    request = _Request()
+    timer = Timer(lambda: matcher(request, segments))
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+
+def main(number=50000):
+    print '%-16s %12s %12s %8s' % ('case', 'legacy (us)', 'compiled (us)',
+                                   'speedup')
+    for name, components, partialMatching, segments in CASES:
+        if partialMatching:
+            legacy, compiled = legacySubroute, subroute
+        else:
+            legacy, compiled = legacyRoute, route
+        before = bench(legacy(*components), segments, number)
+        after = bench(compiled(*components), segments, number)
+        print '%-16s %12.3f %12.3f %7.1fx' % (
+            name, before, after, before / after)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Router scaling benchmarks.
+
+Synthetic routers, with 10 to 10,000 routes mixing literal, `Text` and
+`Integer` components at nesting depths of 1 to 20, are built and measured for:
+
+    * Construction time, declaring the routes and compiling them;
+    * Memory used by the compiled routes;
+    * Latency of routing and rendering a request that matches a route;
+    * Worst-case ``404 Not Found`` latency, for a path that follows a route
+      all the way to its last segment before failing to match;
+    * Latency of a ``404 Not Found`` for a path that no route could match.
+
+Everything runs in-process against `InMemoryRequest`, results are written as
+JSON so that routing changes can be compared objectively.
+
+Run with ``python benchmarks/route_scaling.py [--output results.json]``, see
+``--help`` for the other options.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+from timeit import Timer
+
+from twisted.web import http
+from twisted.web.resource import getChildForRequest
+from twisted.web.static import Data
+
+from txspinneret.route import Integer, Router, Text
+from txspinneret.test.util import InMemoryRequest
+
+
+
+ROUTES = [10, 100, 1000, 10000]
+DEPTHS = [1, 2, 5, 10, 20]
+
+
+
+def _components(index, depth, prefixes):
+    """
+    Create the route components, and a matching path, for a synthetic route.
+
+    The first component is one of ``prefixes`` literals, shared between
+    routes, the last is a literal unique to the route and the components in
+    between cycle through `Integer`, `Text` and literal components.
+
+    :return: 2-tuple of route components and path segments.
+    """
+    components = [b'prefix%d' % (index % prefixes,)]
+    segments = list(components)
+    for position in range(1, depth - 1):
+        kind = position % 3
+        if kind == 1:
+            components.append(Integer(b'id%d' % (position,)))
+            segments.append(b'%d' % (index,))
+        elif kind == 2:
+            components.append(Text(b'name%d' % (position,)))
+            segments.append(b'name')
+        else:
+            literal = b'part%d' % (position,)
+            components.append(literal)
+            segments.append(literal)
+    if depth > 1:
+        components.append(b'leaf%d' % (index,))
+        segments.append(b'leaf%d' % (index,))
+    else:
+        components = segments = [b'route%d' % (index,)]
+    return components, segments
+
+
+
+def _router(count, depth, generateCode):
+    """
+    Create a synthetic router.
+
+    :return: 2-tuple of the type containing the router and a `list` of the
+        path for each route.
+    """
+    router = Router(generateCode=generateCode)
+    prefixes = max(1, int(count ** 0.5))
+
+    def _handler(self, request, params):
+        return Data(b'', b'text/plain')
+
+    paths = []
+    for index in xrange(count):
+        components, segments = _components(index, depth, prefixes)
+        router.route(*components)(_handler)
+        paths.append(segments)
+
+    class _Routed(object):
+        pass
+    _Routed.router = router
+    return _Routed, paths
+
+
+
+def _allocatedBytes(f):
+    """
+    Measure the size of the garbage-collected objects created, and kept
+    alive, by calling ``f``.
+    """
+    gc.collect()
+    before = set(id(o) for o in gc.get_objects())
+    result = f()
+    gc.collect()
+    new = [o for o in gc.get_objects()
+           if id(o) not in before and o is not before]
+    size = sum(sys.getsizeof(o) for o in new)
+    del result
+    return size
+
+
+
+def _render(routed, segments, responseCode):
+    """
+    Route and render a request for ``segments``.
+    """
+    request = InMemoryRequest(list(segments))
+    request.render(getChildForRequest(routed().router.resource(), request))
+    if (request.responseCode or http.OK) != responseCode:
+        raise RuntimeError(
+            'Expected %d for %r, got %r' % (
+                responseCode, segments, request.responseCode))
+
+
+
+def _latency(f, number, repeat):
+    """
+    Time ``f``, in microseconds per call.
+    """
+    return min(Timer(f).repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+
+def bench(count, depth, generateCode, number, repeat):
+    """
+    Benchmark a single router configuration.
+
+    :rtype: `dict`
+    """
+    start = time.time()
+    routed, paths = _router(count, depth, generateCode)
+    routed.router._routeTable()
+    construction = time.time() - start
+
+    memory = _allocatedBytes(
+        lambda: _router(count, depth, generateCode)[0].router._routeTable())
+
+    samples = paths[::max(1, len(paths) // number)][:number]
+    def _matches():
+        for segments in samples:
+            _render(routed, segments, http.OK)
+
+    lastPath = paths[-1]
+    if depth > 1:
+        # Follow the last route all the way, failing only on its last
+        # segment.
+        worstPath = lastPath[:-1] + [b'missing']
+    else:
+        worstPath = [b'missing']
+
+    result = dict(
+        routes=count,
+        depth=depth,
+        dispatch='generated' if generateCode else 'trie',
+        constructionSeconds=construction,
+        memoryBytes=memory,
+        matchMicroseconds=_latency(
+            _matches, 1, repeat) / len(samples),
+        notFoundMicroseconds=_latency(
+            lambda: _render(routed, worstPath, http.NOT_FOUND),
+            number, repeat),
+        rejectedMicroseconds=_latency(
+            lambda: _render(routed, [b'wp-admin'] * depth, http.NOT_FOUND),
+            number, repeat))
+    return result
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Router scaling benchmarks.')
+    parser.add_argument(
+        '--routes', default=','.join(map(str, ROUTES)),
+        help='Comma-separated numbers of routes (default: %(default)s)')
+    parser.add_argument(
+        '--depths', default=','.join(map(str, DEPTHS)),
+        help='Comma-separated route depths (default: %(default)s)')
+    parser.add_argument(
+        '--generate-code', action='store_true',
+        help='Also benchmark routers using generated dispatch code')
+    parser.add_argument(
+        '--number', type=int, default=200,
+        help='Requests per latency measurement (default: %(default)s)')
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Repetitions of each latency measurement, the best is reported '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--output', default='-',
+        help='Path to write JSON results to (default: standard output)')
+    options = parser.parse_args(argv)
+
+    dispatchers = [False, True] if options.generate_code else [False]
+    results = []
+    for count in [int(n) for n in options.routes.split(',')]:
+        for depth in [int(n) for n in options.depths.split(',')]:
+            for generateCode in dispatchers:
+                result = bench(
+                    count, depth, generateCode, options.number,
+                    options.repeat)
+                results.append(result)
+                sys.stderr.write(
+                    '%(routes)6d routes, depth %(depth)2d, %(dispatch)-9s '
+                    'match %(matchMicroseconds)8.1fus, '
+                    '404 %(notFoundMicroseconds)8.1fus\n' % result)
+
+    document = dict(
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        results=results)
+    if options.output == '-':
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(options.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+
+
+if __name__ == '__main__':
+    main()
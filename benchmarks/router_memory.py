@@ -0,0 +1,110 @@
+"""
+Memory benchmark for binding routers to objects, comparing bound routers that
+share compiled routes against the original behaviour of creating a new
+`Router`, with a copy of the routes, on every attribute access.
+
+Run with ``python benchmarks/router_memory.py``.
+"""
+import gc
+import sys
+import time
+
+from twisted.web.static import Data
+
+from txspinneret.route import Integer, Router, Text
+
+
+
+class _LegacyRouter(Router):
+    """
+    `Router` that creates a new router, with a copy of the routes, for every
+    object it is accessed via.
+    """
+    def _forObject(self, obj):
+        router = type(self)()
+        router._routes = list(self._routes)
+        router._table = self._routeTable()
+        router._self = obj
+        return router
+
+
+    def resource(self):
+        return Router._forObject(self, self._self).resource()
+
+
+
+def _routedType(routerType, routes=20):
+    """
+    Create a type, like the ``UserResource`` example, with a router of type
+    ``routerType``.
+    """
+    router = routerType()
+
+    def _handler(self, request, params):
+        return Data(b'', b'text/plain')
+
+    for i in range(routes):
+        router.route(b'literal%d' % (i,), Integer(b'id'))(_handler)
+        router.subroute(b'nested%d' % (i,), Text(b'name'))(_handler)
+
+    class _UserResource(object):
+        def __init__(self, user):
+            self.user = user
+    _UserResource.router = router
+    return _UserResource
+
+
+
+def _allocatedBytes(f):
+    """
+    Measure the size of the garbage-collected objects created, and kept
+    alive, by calling ``f``.
+
+    :return: 2-tuple of the number of objects and their total size in bytes.
+    """
+    gc.collect()
+    before = set(id(o) for o in gc.get_objects())
+    result = f()
+    gc.collect()
+    new = [o for o in gc.get_objects() if id(o) not in before]
+    size = sum(sys.getsizeof(o) for o in new)
+    del result
+    return len(new), size
+
+
+
+def bench(routerType, count):
+    """
+    Bind ``count`` routers, and create their resources.
+    """
+    userResource = _routedType(routerType)
+    # Compile the routes ahead of time.
+    userResource(None).router.resource()
+
+    def _bind():
+        return [userResource(i).router for i in xrange(count)]
+
+    def _resources():
+        return [userResource(i).router.resource() for i in xrange(count)]
+
+    start = time.time()
+    _bind()
+    elapsed = time.time() - start
+    return (_allocatedBytes(_bind), _allocatedBytes(_resources), elapsed)
+
+
+
+def main(count=100000):
+    print 'Binding %d routers:' % (count,)
+    print '%-8s %12s %14s %16s %10s' % (
+        'router', 'bound (MiB)', 'objects', 'resources (MiB)', 'bind (s)')
+    for name, routerType in [('legacy', _LegacyRouter), ('shared', Router)]:
+        (objects, bound), (_, resources), elapsed = bench(routerType, count)
+        print '%-8s %12.2f %14d %16.2f %10.3f' % (
+            name, bound / 1024.0 / 1024.0, objects,
+            resources / 1024.0 / 1024.0, elapsed)
+
+
+
+if __name__ == '__main__':
+    main()
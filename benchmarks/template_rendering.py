@@ -0,0 +1,71 @@
+"""
+Measure rendering a `twisted.web.template` element, with a mostly static
+template, as is, with a precompiled template and cached.
+
+Run with ``python benchmarks/template_rendering.py``.
+"""
+from timeit import Timer
+
+from twisted.web.template import Element, XMLString, renderer
+
+from txspinneret.resource import _RenderableResource
+from txspinneret.template import cacheable, precompile
+from txspinneret.test.util import InMemoryRequest
+
+
+
+_TEMPLATE = b'''
+<html xmlns:t="http://twistedmatrix.com/ns/twisted.web.template/0.1">
+<head><title>Report</title></head>
+<body>
+<h1 t:render="title" />
+%s
+</body>
+</html>
+''' % (b''.join(
+    b'<div class="row"><span>Static row %d</span><a href="/rows/%d">'
+    b'Details &amp; more</a></div>' % (i, i) for i in range(100)),)
+
+_LOADER = XMLString(_TEMPLATE)
+_PRECOMPILED = precompile(XMLString(_TEMPLATE))
+
+
+
+class _Report(Element):
+    @renderer
+    def title(self, request, tag):
+        return tag(u'Report')
+
+
+
+def bench(renderable, number):
+    """
+    Render ``number`` requests for the renderable returned by ``renderable``.
+
+    :return: Requests per second.
+    """
+    def _request():
+        request = InMemoryRequest([])
+        request.render(_RenderableResource(renderable()))
+        assert request.finished
+    return number / min(Timer(_request).repeat(repeat=5, number=number))
+
+
+
+CASES = [
+    ('renderElement', lambda: _Report(_LOADER)),
+    ('precompiled', lambda: _Report(_PRECOMPILED)),
+    ('cached', lambda: cacheable(_Report(_LOADER), b'report')),
+    ]
+
+
+
+def main(number=500):
+    print '%-14s %12s' % ('case', 'requests/s')
+    for name, renderable in CASES:
+        print '%-14s %12.0f' % (name, bench(renderable, number))
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark generating 100,000 links with `Router.urlFor`, compared against
+hand-written string formatting of the same URLs.
+
+Run with ``python benchmarks/url_generation.py``.
+"""
+import time
+from urllib import quote
+
+from txspinneret.route import Integer, Router, Text
+
+
+
+class _API(object):
+    """
+    Router with a mix of literal and parameterised routes.
+    """
+    router = Router()
+
+    def _handler(self, request, params):
+        pass
+
+    for i in range(20):
+        router.route(b'literal%d' % (i,), Integer(b'id'))(_handler)
+
+    @router.route(b'users', Integer(b'id'), b'friends', Text(b'name'))
+    def friend(self, request, params):
+        pass
+
+
+
+def _formatted(count):
+    """
+    Generate links with string formatting duplicating the route declaration.
+    """
+    return [b'users/%d/friends/%s' % (i, quote(u'bob'.encode('utf-8'), b''))
+            for i in xrange(count)]
+
+
+
+def _generated(count):
+    """
+    Generate links with `Router.urlFor`.
+    """
+    urlFor = _API().router.urlFor
+    return [urlFor('friend', id=i, name=u'bob') for i in xrange(count)]
+
+
+
+def bench(f, count):
+    """
+    Time generating ``count`` links with ``f``, the best of several runs.
+    """
+    best = None
+    for _ in range(5):
+        start = time.time()
+        f(count)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+
+def main(count=100000):
+    assert _formatted(10) == _generated(10)
+    print 'Generating %d links:' % (count,)
+    print '%-10s %10s %14s' % ('method', 'total (s)', 'us/link')
+    for name, f in [('formatted', _formatted), ('urlFor', _generated)]:
+        elapsed = bench(f, count)
+        print '%-10s %10.3f %14.2f' % (name, elapsed, elapsed / count * 1e6)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ from twisted.web.resource import Resource
 from twisted.web.template import Element, TagLoader, tags
 from txspinneret.interfaces import INegotiableResource, ISpinneretResource
 from txspinneret.resource import ContentTypeNegotiator
+from txspinneret.template import cacheable
 from zope.interface import implementer
 
 @implementer(INegotiableResource)
@@ -26,7 +27,7 @@ class FooHTML(object):
     acceptTypes = ['text/html']
 
     def render_GET(self, request):
-        return FooElement()
+        return cacheable(FooElement(), 'foo')
 
 def start():
     data = {'name': 'Bob'}
@@ -0,0 +1,551 @@
+"""
+In-memory caching of rendered responses.
+
+`CachingResource` wraps any `IResource
+<twisted:twisted.web.resource.IResource>`, such as a `SpinneretResource
+<txspinneret.resource.SpinneretResource>` or `ContentTypeNegotiator
+<txspinneret.resource.ContentTypeNegotiator>`, and stores the responses it
+renders for ``GET`` requests in a `ResponseCache`. Identical requests are then
+answered from memory without locating or rendering anything.
+"""
+from collections import OrderedDict
+from urllib import urlencode
+from urlparse import parse_qsl
+
+from twisted.web import http
+from twisted.web.resource import Resource, getChildForRequest
+from twisted.web.server import NOT_DONE_YET
+
+from txspinneret.conditional import notModified
+from txspinneret.util import LRUCache, _renderProxied
+
+
+
+# Response headers that describe a particular response or connection, rather
+# than the representation, and so are never stored.
+_UNCACHED_HEADERS = frozenset([
+    b'age', b'connection', b'content-length', b'date', b'keep-alive',
+    b'transfer-encoding'])
+
+# Rough size of the bookkeeping for each entry, in bytes.
+_ENTRY_OVERHEAD = 256
+
+_MISSING = object()
+
+
+
+def _cacheControl(values):
+    """
+    Parse ``Cache-Control`` header values.
+
+    :type  values: ``iterable`` of `bytes`
+    :param values: Raw header values.
+
+    :rtype: `dict` mapping `bytes` to `bytes`
+    :return: Mapping of lowercase directive names to their arguments, or
+        ``None`` for directives without arguments.
+    """
+    directives = {}
+    for value in values:
+        for directive in value.split(b','):
+            name, _, argument = directive.partition(b'=')
+            name = name.strip().lower()
+            if name:
+                directives[name] = argument.strip().strip(b'"') or None
+    return directives
+
+
+
+def _seconds(value):
+    """
+    Parse a ``Cache-Control`` delta-seconds argument.
+
+    :rtype: `int`
+    :return: Number of seconds, or ``None`` if ``value`` is not valid.
+    """
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+
+def _normalizedQuery(query):
+    """
+    Normalize a query string so that queries with the same arguments, in any
+    order, are the same.
+    """
+    if not query:
+        return b''
+    return urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+
+
+
+def tagResponse(request, *tags):
+    """
+    Tag the response to a request, so that a cached response can be discarded
+    with `ResponseCache.invalidate`.
+
+    Does nothing if the response is not being cached.
+
+    :type  request: `IRequest <twisted:twisted.web.iweb.IRequest>`
+    :param request: Request passed to a resource or handler.
+
+    :param \\*tags: Hashable tags.
+    """
+    recording = getattr(request, '_recording', None)
+    if recording is not None:
+        recording.tags.update(tags)
+
+
+
+class _CachedResponse(object):
+    """
+    Stored response.
+
+    :ivar code: Response code.
+
+    :ivar headers: `list` of 2-`tuple` of header name and `list` of values.
+
+    :ivar body: Response body.
+
+    :ivar tags: `frozenset` of tags.
+
+    :ivar storedAt: Time the response was stored.
+
+    :ivar expires: Time after which the response is stale.
+
+    :ivar staleUntil: Time after which the response may no longer be used.
+
+    :ivar etag: Value of the ``ETag`` header, or ``None``.
+
+    :ivar lastModified: Value of the ``Last-Modified`` header, in seconds
+        since the epoch, or ``None``.
+
+    :ivar revalidating: Is a request rendering a fresh response to replace
+        this stale one?
+    """
+    __slots__ = [
+        'code', 'headers', 'body', 'tags', 'storedAt', 'expires',
+        'staleUntil', 'etag', 'lastModified', 'size', 'revalidating']
+
+    def __init__(self, code, headers, body, tags, storedAt, ttl,
+                 staleWhileRevalidate):
+        self.code = code
+        self.headers = headers
+        self.body = body
+        self.tags = tags
+        self.storedAt = storedAt
+        self.expires = storedAt + ttl
+        self.staleUntil = self.expires + staleWhileRevalidate
+        self.etag = None
+        self.lastModified = None
+        for name, values in headers:
+            name = name.lower()
+            if name == b'etag':
+                self.etag = values[0]
+            elif name == b'last-modified':
+                try:
+                    self.lastModified = http.stringToDatetime(values[0])
+                except ValueError:
+                    pass
+        self.size = _ENTRY_OVERHEAD + len(body) + sum(
+            len(name) + sum(len(value) for value in values)
+            for name, values in headers)
+        self.revalidating = False
+
+
+
+class ResponseCache(object):
+    """
+    Bounded in-memory cache of responses, accounted for by their size in bytes
+    and discarding the least recently used responses first.
+
+    :ivar maxBytes: Maximum total size of the stored responses.
+
+    :ivar maxEntryBytes: Maximum size of a single stored response, larger
+        responses are not stored.
+
+    :ivar size: Total size of the stored responses.
+
+    :ivar hits: Number of lookups that found a fresh response.
+
+    :ivar staleHits: Number of lookups that found a stale response that could
+        still be used while it is revalidated.
+
+    :ivar misses: Number of lookups that did not find a usable response.
+
+    :ivar evictions: Number of responses discarded to make room for others.
+    """
+    def __init__(self, maxBytes=64 * 1024 * 1024, maxEntryBytes=None,
+                 clock=None):
+        """
+        :type  maxBytes: `int`
+        :param maxBytes: Maximum total size of the stored responses.
+
+        :type  maxEntryBytes: `int`
+        :param maxEntryBytes: Maximum size of a single stored response,
+            defaults to an eighth of ``maxBytes``.
+
+        :type  clock: `IReactorTime`
+        :param clock: Clock to expire responses with, defaults to the global
+            reactor.
+        """
+        if maxEntryBytes is None:
+            maxEntryBytes = maxBytes // 8
+        self.maxBytes = maxBytes
+        self.maxEntryBytes = maxEntryBytes
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._tags = {}
+        self.size = 0
+        self.hits = 0
+        self.staleHits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def seconds(self):
+        """
+        Current time according to the cache's clock.
+        """
+        if self._clock is None:
+            from twisted.internet import reactor
+            self._clock = reactor
+        return self._clock.seconds()
+
+
+    def get(self, key):
+        """
+        Look up a response, marking it as the most recently used.
+
+        :rtype: 2-`tuple` of `_CachedResponse` and `bool`
+        :return: Pair of the response, or ``None`` if there is no usable
+            response, and whether the response is fresh.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            now = self.seconds()
+            if now < entry.expires:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry, True
+            elif now < entry.staleUntil:
+                self._entries[key] = entry
+                self.staleHits += 1
+                return entry, False
+            self._discarded(key, entry)
+        self.misses += 1
+        return None, False
+
+
+    def set(self, key, entry):
+        """
+        Store a response, discarding the least recently used responses if
+        there is not enough room for it.
+
+        :type  entry: `_CachedResponse`
+        :param entry: Response to store.
+
+        :rtype: `bool`
+        :return: Was the response stored?
+        """
+        self._remove(key)
+        if entry.size > self.maxEntryBytes:
+            return False
+        self._entries[key] = entry
+        self.size += entry.size
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while self.size > self.maxBytes:
+            oldKey, oldEntry = self._entries.popitem(last=False)
+            self._discarded(oldKey, oldEntry)
+            self.evictions += 1
+        return True
+
+
+    def _remove(self, key):
+        """
+        Remove a response, if it is stored.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._discarded(key, entry)
+
+
+    def _discarded(self, key, entry):
+        """
+        Account for a response that has been removed from the cache.
+        """
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+    def invalidate(self, *tags):
+        """
+        Discard every response tagged with any of ``tags``.
+
+        See `tagResponse`.
+        """
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+
+    def clear(self):
+        """
+        Discard every response.
+        """
+        self._entries.clear()
+        self._tags.clear()
+        self.size = 0
+
+
+
+class _Recording(object):
+    """
+    Response being recorded.
+    """
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.body = []
+        self.size = 0
+        self.tags = set()
+
+
+    def write(self, data):
+        if self.body is not None:
+            self.size += len(data)
+            if self.size > self.maxBytes:
+                self.body = None
+            else:
+                self.body.append(data)
+
+
+
+class _RecordingRequest(object):
+    """
+    Proxy for a request that records the response body written to it, and
+    calls a function when the response is finished.
+    """
+    def __init__(self, request, recording, finished):
+        self.__dict__.update(
+            _request=request, _recording=recording, _finished=finished)
+
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+    def __setattr__(self, name, value):
+        setattr(self._request, name, value)
+
+
+    def render(self, resource):
+        _renderProxied(self, resource)
+
+
+    def write(self, data):
+        self._recording.write(data)
+        self._request.write(data)
+
+
+    def finish(self):
+        self._finished()
+        self._request.finish()
+
+
+
+def _revalidated(result, entry):
+    """
+    Allow a stale response to be revalidated again, once the request
+    revalidating it is finished.
+    """
+    entry.revalidating = False
+
+
+
+class CachingResource(Resource):
+    """
+    Resource wrapper caching the responses rendered for ``GET`` requests.
+
+    Responses are keyed on the request path, the query arguments, in any
+    order, and the response ``Content-Type``, which is remembered for each
+    ``Accept`` header so that negotiated representations are cached
+    separately. Cached responses are used for ``GET`` and ``HEAD`` requests
+    without locating or rendering anything.
+
+    Only complete ``200 OK`` responses are stored. Requests with
+    ``Authorization`` or ``Cookie`` headers, whose responses are likely to be
+    private, are always rendered without using or storing a response.
+    A response is not stored if it sets cookies, varies on a request header
+    other than ``Accept``, or has a ``Cache-Control`` header with
+    a ``no-store``, ``no-cache`` or ``private`` directive.
+
+    Responses are stored for the number of seconds given by the
+    ``s-maxage``, or ``max-age``, ``Cache-Control`` directive, allowing
+    handlers to control the lifetime of their responses, or ``ttl`` if there
+    is neither. Once stale, a response can still be used for as many seconds
+    as the ``stale-while-revalidate`` directive, or ``staleWhileRevalidate``,
+    gives: the first request for it renders a fresh response, while other
+    requests are answered with the stale one until that is done.
+
+    Responses can be tagged, with `tagResponse`, so that they can be discarded
+    with `ResponseCache.invalidate`.
+
+    Conditional requests matching the ``ETag`` or ``Last-Modified`` header of
+    a stored response are answered with ``304 Not Modified``, see
+    `txspinneret.conditional`.
+    """
+    isLeaf = True
+
+    def __init__(self, resource, cache, ttl=0, staleWhileRevalidate=0,
+                 maxVariants=1024):
+        """
+        :type  resource: `IResource`
+        :param resource: Resource to wrap.
+
+        :type  cache: `ResponseCache`
+        :param cache: Cache to store responses in, which may be shared with
+            other `CachingResource`\\s.
+
+        :type  ttl: `float`
+        :param ttl: Default number of seconds to store responses for, ``0``
+            to only store responses with ``Cache-Control`` directives stating
+            their lifetime.
+
+        :type  staleWhileRevalidate: `float`
+        :param staleWhileRevalidate: Default number of seconds a stale
+            response can be used for while it is revalidated.
+
+        :type  maxVariants: `int`
+        :param maxVariants: Maximum number of ``Content-Type``\\s to remember
+            for ``Accept`` headers.
+        """
+        Resource.__init__(self)
+        self._resource = resource
+        self._cache = cache
+        self._ttl = ttl
+        self._staleWhileRevalidate = staleWhileRevalidate
+        self._variants = LRUCache(maxVariants)
+
+
+    def _render(self, request):
+        """
+        Locate and render the wrapped resource.
+        """
+        return getChildForRequest(self._resource, request).render(request)
+
+
+    def _store(self, request, recording, key, accept):
+        """
+        Store a recorded response, if it is cacheable.
+        """
+        body = recording.body
+        headers = request.responseHeaders
+        if (body is None or
+                getattr(request, 'code', http.OK) != http.OK or
+                headers.hasHeader(b'set-cookie')):
+            return
+        directives = _cacheControl(
+            headers.getRawHeaders(b'cache-control', []))
+        if (b'no-store' in directives or
+                b'no-cache' in directives or
+                b'private' in directives):
+            return
+        for value in headers.getRawHeaders(b'vary', []):
+            for name in value.split(b','):
+                if name.strip().lower() not in (b'', b'accept'):
+                    return
+
+        ttl = _seconds(directives.get(b's-maxage'))
+        if ttl is None:
+            ttl = _seconds(directives.get(b'max-age'))
+        if ttl is None:
+            ttl = self._ttl
+        if ttl <= 0:
+            return
+        staleWhileRevalidate = _seconds(
+            directives.get(b'stale-while-revalidate'))
+        if staleWhileRevalidate is None:
+            staleWhileRevalidate = self._staleWhileRevalidate
+
+        contentType = headers.getRawHeaders(b'content-type', [None])[0]
+        entry = _CachedResponse(
+            code=http.OK,
+            headers=[(name, values)
+                     for name, values in headers.getAllRawHeaders()
+                     if name.lower() not in _UNCACHED_HEADERS],
+            body=b''.join(body),
+            tags=frozenset(recording.tags),
+            storedAt=self._cache.seconds(),
+            ttl=ttl,
+            staleWhileRevalidate=staleWhileRevalidate)
+        if self._cache.set(key + (contentType,), entry):
+            self._variants.set(key + (accept,), contentType)
+
+
+    def _replay(self, request, entry):
+        """
+        Answer a request with a stored response, or ``304 Not Modified`` if
+        the client's copy of it is current.
+        """
+        request.setResponseCode(entry.code)
+        headers = request.responseHeaders
+        for name, values in entry.headers:
+            headers.setRawHeaders(name, values)
+        headers.setRawHeaders(
+            b'age', [b'%d' % (self._cache.seconds() - entry.storedAt,)])
+        if notModified(request, entry.etag, entry.lastModified):
+            request.setResponseCode(http.NOT_MODIFIED)
+            return b''
+        return entry.body
+
+
+    def render(self, request):
+        requestHeaders = request.requestHeaders
+        if (request.method not in (b'GET', b'HEAD') or
+                requestHeaders.hasHeader(b'authorization') or
+                requestHeaders.hasHeader(b'cookie')):
+            return self._render(request)
+
+        path, _, query = request.uri.partition(b'?')
+        key = path, _normalizedQuery(query)
+        accept = tuple(requestHeaders.getRawHeaders(b'accept', ()))
+        contentType = self._variants.get(key + (accept,), _MISSING)
+        entry = None
+        if contentType is not _MISSING:
+            entry, fresh = self._cache.get(key + (contentType,))
+            if entry is not None:
+                if (fresh or
+                        entry.revalidating or
+                        request.method != b'GET'):
+                    return self._replay(request, entry)
+                entry.revalidating = True
+                request.notifyFinish().addBoth(
+                    _revalidated, entry)
+
+        if request.method != b'GET':
+            return self._render(request)
+
+        recording = _Recording(self._cache.maxEntryBytes)
+        finished = lambda: self._store(request, recording, key, accept)
+        recordingRequest = _RecordingRequest(request, recording, finished)
+        body = self._render(recordingRequest)
+        if body is not NOT_DONE_YET:
+            recording.write(body)
+            finished()
+        return body
+
+
+
+__all__ = ['CachingResource', 'ResponseCache', 'tagResponse']
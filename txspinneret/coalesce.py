@@ -0,0 +1,451 @@
+"""
+Coalescing of identical concurrent requests.
+
+`CoalescingResource` wraps any `IResource
+<twisted:twisted.web.resource.IResource>`, such as a router's resource, so
+that identical ``GET`` and ``HEAD`` requests arriving while one is already
+being rendered share its response instead of each locating and rendering the
+resource again.
+"""
+from twisted.internet import task
+from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IPushProducer
+from twisted.python.failure import Failure
+from twisted.web import http
+from twisted.web.http_headers import Headers
+from twisted.web.resource import Resource, getChildForRequest
+from twisted.web.server import NOT_DONE_YET
+from zope.interface import implementer
+
+from txspinneret.cache import _normalizedQuery
+from txspinneret.util import _renderProxied
+
+
+
+class _Flight(object):
+    """
+    Response being rendered once on behalf of every request waiting for it.
+
+    Everything written is recorded, and written to every waiting request, so
+    that requests that start waiting part way through the response are
+    written the response so far before the rest of it. Once every waiting
+    request has gone away, such as when clients disconnect, the rendering is
+    abandoned.
+
+    Once a producer is registered, to stream the response, nothing more is
+    recorded and no more requests start waiting. The producer is paused while
+    the transport's buffers of any of the waiting requests are full.
+    """
+    def __init__(self, key, flights, cooperate):
+        self._key = key
+        self._flights = flights
+        self._cooperate = cooperate
+        self._waiters = []
+        self._paused = []
+        self._body = []
+        self._finishedDeferreds = []
+        self._producer = None
+        self._streaming = True
+        self._task = None
+        self.code = http.OK
+        self.codeMessage = None
+        self.responseHeaders = Headers()
+        self.started = False
+        self.done = False
+
+
+    def _close(self):
+        """
+        Stop new requests from waiting for this response.
+        """
+        if self._flights.get(self._key) is self:
+            del self._flights[self._key]
+
+
+    def _land(self):
+        """
+        Stop new requests from waiting for this response, and ignore anything
+        else written to it.
+        """
+        self.done = True
+        self._close()
+
+
+    def _startWaiter(self, request):
+        """
+        Start the response to a waiting request.
+        """
+        request.setResponseCode(self.code, self.codeMessage)
+        for name, values in self.responseHeaders.getAllRawHeaders():
+            request.responseHeaders.setRawHeaders(name, values)
+
+
+    def _start(self):
+        if not self.started:
+            self.started = True
+            for request in list(self._waiters):
+                self._startWaiter(request)
+
+
+    def join(self, request):
+        """
+        Wait for the response.
+        """
+        if self.started:
+            self._startWaiter(request)
+            for data in self._body:
+                request.write(data)
+        self._waiters.append(request)
+        request.notifyFinish().addErrback(self._waiterLost, request)
+
+
+    def _waiterLost(self, reason, request):
+        """
+        A waiting request has gone away, abandon rendering the response if it
+        was the last one.
+        """
+        self._forget(request)
+        if not self._waiters and not self.done:
+            self._land()
+            self._producer = None
+            finishedDeferreds, self._finishedDeferreds = (
+                self._finishedDeferreds, None)
+            for d in finishedDeferreds:
+                d.errback(reason)
+
+
+    def _forget(self, request):
+        """
+        Stop writing to a waiting request, and stop it holding up the
+        producer.
+        """
+        if request in self._waiters:
+            self._waiters.remove(request)
+        if self._waiters:
+            self._waiterResumed(request)
+        elif request in self._paused:
+            self._paused.remove(request)
+
+
+    def _waiterPaused(self, request):
+        """
+        The transport's buffers of a waiting request are full, pause the
+        producer.
+        """
+        if request not in self._waiters or request in self._paused:
+            return
+        self._paused.append(request)
+        if len(self._paused) == 1 and self._producer is not None:
+            if self._streaming:
+                self._producer.pauseProducing()
+            else:
+                self._task.pause()
+
+
+    def _waiterResumed(self, request):
+        """
+        The transport's buffers of a waiting request have been emptied,
+        resume the producer once no waiting request is holding it up.
+        """
+        if request not in self._paused:
+            return
+        self._paused.remove(request)
+        if not self._paused and self._producer is not None:
+            if self._streaming:
+                self._producer.resumeProducing()
+            else:
+                self._task.resume()
+
+
+    def write(self, data):
+        if self.done:
+            return
+        self._start()
+        if self._body is not None:
+            self._body.append(data)
+        for request in list(self._waiters):
+            request.write(data)
+
+
+    def finish(self):
+        if self.done:
+            return
+        self._start()
+        self._land()
+        for request in list(self._waiters):
+            request.finish()
+        finishedDeferreds, self._finishedDeferreds = (
+            self._finishedDeferreds, None)
+        for d in finishedDeferreds:
+            d.callback(None)
+
+
+    def notifyFinish(self):
+        d = Deferred()
+        if self._finishedDeferreds is not None:
+            self._finishedDeferreds.append(d)
+        return d
+
+
+    def processingFailed(self, reason):
+        """
+        Fail every waiting request, or close their connections if the
+        response has been started.
+        """
+        if self.done:
+            return
+        self._land()
+        for request in list(self._waiters):
+            if self.started:
+                request.loseConnection()
+            else:
+                request.processingFailed(reason)
+
+
+    def loseConnection(self):
+        if self.done:
+            return
+        self._land()
+        for request in list(self._waiters):
+            request.loseConnection()
+
+
+    def registerProducer(self, producer, streaming):
+        """
+        Register a producer, pull producers are driven cooperatively until
+        they are unregistered.
+
+        The response is being streamed, so rather than holding on to all of
+        it, for requests that might start waiting later, no more requests
+        start waiting.
+        """
+        self._close()
+        self._body = None
+        self._producer = producer
+        self._streaming = streaming
+        for request in list(self._waiters):
+            request.registerProducer(_WaiterProducer(self, request), True)
+        if not streaming:
+            self._task = self._cooperate(self._pull(producer))
+
+
+    def unregisterProducer(self):
+        if self._paused and not self._streaming:
+            # Let the task see the producer is gone.
+            self._task.resume()
+        self._paused = []
+        self._producer = None
+        for request in list(self._waiters):
+            request.unregisterProducer()
+
+
+    def _pull(self, producer):
+        while self._producer is producer:
+            producer.resumeProducing()
+            yield None
+
+
+
+@implementer(IPushProducer)
+class _WaiterProducer(object):
+    """
+    Producer registered with a request waiting for a `_Flight`, passing on
+    requests to pause and resume to the flight's producer.
+    """
+    def __init__(self, flight, request):
+        self._flight = flight
+        self._request = request
+
+
+    def pauseProducing(self):
+        self._flight._waiterPaused(self._request)
+
+
+    def resumeProducing(self):
+        self._flight._waiterResumed(self._request)
+
+
+    def stopProducing(self):
+        self._flight._forget(self._request)
+
+
+
+class _SharedRequest(object):
+    """
+    Proxy for the first of the requests waiting for a `_Flight`, that renders
+    the response for all of them.
+
+    The request is used as is for everything but the response, which is
+    written to the flight.
+    """
+    def __init__(self, request, flight):
+        self.__dict__.update(_request=request, _flight=flight)
+
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+    def __setattr__(self, name, value):
+        if name == 'code':
+            self._flight.code = value
+        else:
+            setattr(self._request, name, value)
+
+
+    @property
+    def code(self):
+        return self._flight.code
+
+
+    @property
+    def responseHeaders(self):
+        return self._flight.responseHeaders
+
+
+    def setResponseCode(self, code, message=None):
+        self._flight.code = code
+        self._flight.codeMessage = message
+
+
+    def render(self, resource):
+        _renderProxied(self, resource)
+
+
+    def setHeader(self, name, value):
+        self._flight.responseHeaders.setRawHeaders(name, [value])
+
+
+    def redirect(self, url):
+        self.setResponseCode(http.FOUND)
+        self.setHeader(b'location', url)
+
+
+    def write(self, data):
+        self._flight.write(data)
+
+
+    def finish(self):
+        self._flight.finish()
+
+
+    def notifyFinish(self):
+        return self._flight.notifyFinish()
+
+
+    def processingFailed(self, reason):
+        self._flight.processingFailed(reason)
+
+
+    def loseConnection(self):
+        self._flight.loseConnection()
+
+
+    def registerProducer(self, producer, streaming):
+        self._flight.registerProducer(producer, streaming)
+
+
+    def unregisterProducer(self):
+        self._flight.unregisterProducer()
+
+
+
+class CoalescingResource(Resource):
+    """
+    Resource wrapper rendering identical concurrent ``GET`` and ``HEAD``
+    requests once.
+
+    Requests are identical if they have the same method, path, query
+    arguments, in any order, and the same values for the ``varyOn`` request
+    headers, which determine the negotiated representation. A request
+    identical to one that is still being rendered waits for that response,
+    which is written to every waiting request as it is produced.
+
+    A client disconnecting only stops its own request from waiting, the
+    response is only abandoned, cancelling any `Deferred` or stopping any
+    producer rendering it, once every waiting client has disconnected.
+
+    Requests with ``Authorization`` or ``Cookie`` headers are always rendered
+    on their own, since their responses are likely to be private.
+
+    :ivar coalesced: Number of requests that waited for the response to an
+        identical request.
+    """
+    isLeaf = True
+
+    def __init__(self, resource, varyOn=(b'accept', b'accept-encoding'),
+                 cooperator=None):
+        """
+        :type  resource: `IResource`
+        :param resource: Resource to wrap.
+
+        :type  varyOn: ``sequence`` of `bytes`
+        :param varyOn: Names of request headers that must be the same for
+            requests to be identical.
+
+        :type  cooperator: `Cooperator`
+        :param cooperator: Cooperator to drive pull producers with, defaults
+            to the global cooperator.
+        """
+        Resource.__init__(self)
+        self._resource = resource
+        self._varyOn = tuple(varyOn)
+        if cooperator is None:
+            self._cooperate = task.cooperate
+        else:
+            self._cooperate = cooperator.cooperate
+        self._flights = {}
+        self.coalesced = 0
+
+
+    def _key(self, request):
+        """
+        Key identifying identical requests, or ``None`` if the request should
+        be rendered on its own.
+        """
+        headers = request.requestHeaders
+        if (request.method not in (b'GET', b'HEAD') or
+                headers.hasHeader(b'authorization') or
+                headers.hasHeader(b'cookie')):
+            return None
+        path, _, query = request.uri.partition(b'?')
+        return (request.method, path, _normalizedQuery(query)) + tuple(
+            tuple(headers.getRawHeaders(name, ())) for name in self._varyOn)
+
+
+    def render(self, request):
+        key = self._key(request)
+        if key is None:
+            return getChildForRequest(self._resource, request).render(request)
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            flight.join(request)
+            return NOT_DONE_YET
+
+        flight = self._flights[key] = _Flight(
+            key, self._flights, self._cooperate)
+        flight.join(request)
+        # However the first request comes to be finished, the flight must not
+        # outlive it.
+        request.notifyFinish().addBoth(lambda ignored: flight._close())
+        shared = _SharedRequest(request, flight)
+        try:
+            body = getChildForRequest(self._resource, shared).render(shared)
+        except:
+            flight.processingFailed(Failure())
+            return NOT_DONE_YET
+        if body is not NOT_DONE_YET and not flight.started:
+            # Rendered immediately, nothing can have joined the flight.
+            flight._land()
+            flight._startWaiter(request)
+            return body
+        elif body is not NOT_DONE_YET:
+            flight.write(body)
+            flight.finish()
+        return NOT_DONE_YET
+
+
+
+__all__ = ['CoalescingResource']
@@ -0,0 +1,304 @@
+"""
+Conditional ``GET`` requests.
+
+A route handler, or any ``locateChild`` or ``render_GET`` implementation,
+declares cheap validators for its response by returning `conditional`, such as
+a version number for an ``ETag`` or a modification time for
+``Last-Modified``. Requests whose ``If-None-Match`` or ``If-Modified-Since``
+headers match the validators are answered with ``304 Not Modified`` before the
+response body is built.
+
+`AutoETagResource` wraps any `IResource
+<twisted:twisted.web.resource.IResource>` and gives its responses an ``ETag``
+derived from a hash of the response body.
+"""
+import hashlib
+import re
+
+from twisted.web import http
+from twisted.web.resource import Resource, getChildForRequest
+from twisted.web.server import NOT_DONE_YET
+from zope.interface import implementer
+
+from txspinneret.interfaces import ISpinneretResource
+from txspinneret.util import _renderProxied
+
+
+
+_ENTITY_TAG = re.compile(br'(?:W/)?"[^"]*"|\*')
+
+
+
+def formatETag(etag, weak=False):
+    """
+    Format an entity tag for an ``ETag`` header.
+
+    :param etag: Opaque tag, as `bytes`, `unicode` or an `int` such as
+        a version number; quoted if it is not already.
+
+    :type  weak: `bool`
+    :param weak: Is this a weak entity tag?
+
+    :rtype: `bytes`
+    """
+    if isinstance(etag, unicode):
+        etag = etag.encode('utf-8')
+    elif not isinstance(etag, bytes):
+        etag = b'%s' % (etag,)
+    if not etag.startswith((b'"', b'W/"')):
+        etag = b'"%s"' % (etag,)
+    if weak and not etag.startswith(b'W/'):
+        etag = b'W/' + etag
+    return etag
+
+
+
+def _opaqueTag(etag):
+    """
+    Strip the weakness indicator from an entity tag, for weak comparison.
+    """
+    if etag.startswith(b'W/'):
+        return etag[2:]
+    return etag
+
+
+
+def notModified(request, etag=None, lastModified=None):
+    """
+    Determine whether a ``GET`` or ``HEAD`` request's conditional headers
+    match the validators of the response, meaning the client's copy of the
+    response is current.
+
+    ``If-None-Match`` takes precedence over ``If-Modified-Since``, which is
+    only considered when there is no ``If-None-Match`` header.
+
+    :type  request: `IRequest <twisted:twisted.web.iweb.IRequest>`
+    :param request: Request to check.
+
+    :type  etag: `bytes`
+    :param etag: Formatted entity tag of the response, see `formatETag`, or
+        ``None``.
+
+    :type  lastModified: `float`
+    :param lastModified: Time the response was last modified, in seconds
+        since the epoch, or ``None``.
+
+    :rtype: `bool`
+    """
+    if request.method not in (b'GET', b'HEAD'):
+        return False
+    headers = request.requestHeaders
+    ifNoneMatch = headers.getRawHeaders(b'if-none-match')
+    if ifNoneMatch is not None:
+        if etag is None:
+            return False
+        opaque = _opaqueTag(etag)
+        for value in ifNoneMatch:
+            for tag in _ENTITY_TAG.findall(value):
+                if tag == b'*' or _opaqueTag(tag) == opaque:
+                    return True
+        return False
+    ifModifiedSince = headers.getRawHeaders(b'if-modified-since')
+    if ifModifiedSince is not None and lastModified is not None:
+        try:
+            since = http.stringToDatetime(
+                ifModifiedSince[0].split(b';', 1)[0])
+        except ValueError:
+            return False
+        return int(lastModified) <= since
+    return False
+
+
+
+def _setValidators(request, etag, lastModified):
+    """
+    Set the ``ETag`` and ``Last-Modified`` headers of a response.
+    """
+    if etag is not None:
+        request.setHeader(b'ETag', etag)
+    if lastModified is not None:
+        request.setHeader(
+            b'Last-Modified', http.datetimeToString(lastModified))
+
+
+
+@implementer(ISpinneretResource)
+class _Conditional(object):
+    """
+    Spinneret resource answering a ``GET`` or ``HEAD`` request with ``304 Not
+    Modified`` if the client's copy is current, or rendering a body otherwise.
+    """
+    def __init__(self, body, etag, lastModified):
+        self._body = body
+        self.etag = etag
+        self.lastModified = lastModified
+
+
+    def locateChild(self, request, segments):
+        return self, []
+
+
+    def render_GET(self, request):
+        _setValidators(request, self.etag, self.lastModified)
+        if notModified(request, self.etag, self.lastModified):
+            request.setResponseCode(http.NOT_MODIFIED)
+            return b''
+        body = self._body
+        if callable(body):
+            body = body()
+        return body
+
+
+    render_HEAD = render_GET
+
+
+
+def conditional(body, etag=None, lastModified=None, weak=False):
+    """
+    Declare validators for a response, so that a conditional ``GET`` or
+    ``HEAD`` request for a response the client already has is answered with
+    ``304 Not Modified`` without building the body.
+
+    May be returned from ``locateChild``, a route handler or a ``render_*``
+    method of an `ISpinneretResource`. The ``ETag`` and ``Last-Modified``
+    headers are set whether the body is built or not. Only ``GET`` and
+    ``HEAD`` requests are answered, requests with other methods are not
+    allowed.
+
+    :param body: Any result that may be returned from ``locateChild`` or
+        ``render_GET``, or a ``callable`` taking no arguments returning one,
+        which is only called if the body is needed.
+
+    :param etag: Opaque tag identifying this version of the response, such as
+        a version number, see `formatETag`.
+
+    :type  lastModified: `float`
+    :param lastModified: Time the response was last modified, in seconds
+        since the epoch.
+
+    :type  weak: `bool`
+    :param weak: Is ``etag`` a weak entity tag, meaning responses with the
+        same tag are equivalent but not necessarily byte-for-byte identical?
+
+    :rtype: `ISpinneretResource`
+    """
+    if etag is not None:
+        etag = formatETag(etag, weak)
+    return _Conditional(body, etag, lastModified)
+
+
+
+class _BufferingRequest(object):
+    """
+    Proxy for a request that buffers the response body written to it, until
+    the request is finished or more than ``maxBytes`` has been written.
+    """
+    def __init__(self, request, maxBytes):
+        self.__dict__.update(
+            _request=request, _maxBytes=maxBytes, _buffer=[], _size=0)
+
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+    def __setattr__(self, name, value):
+        setattr(self._request, name, value)
+
+
+    def _flush(self):
+        """
+        Stop buffering, writing anything that was buffered.
+        """
+        buffer = self._buffer
+        self.__dict__['_buffer'] = None
+        if buffer:
+            self._request.write(b''.join(buffer))
+
+
+    def render(self, resource):
+        _renderProxied(self, resource)
+
+
+    def write(self, data):
+        if self._buffer is None:
+            self._request.write(data)
+            return
+        self._buffer.append(data)
+        self.__dict__['_size'] = self._size + len(data)
+        if self._size > self._maxBytes:
+            self._flush()
+
+
+    def finish(self):
+        if self._buffer is not None:
+            body = b''.join(self._buffer)
+            self.__dict__['_buffer'] = None
+            if not _tagged(self._request, body):
+                self._request.write(body)
+        self._request.finish()
+
+
+
+def _tagged(request, body):
+    """
+    Give a complete ``200 OK`` response an ``ETag`` derived from its body,
+    unless it already has one.
+
+    :rtype: `bool`
+    :return: Was the request answered with ``304 Not Modified``, meaning the
+        body must not be written?
+    """
+    headers = request.responseHeaders
+    if (getattr(request, 'code', http.OK) != http.OK or
+            headers.hasHeader(b'etag')):
+        return False
+    etag = formatETag(hashlib.sha1(body).hexdigest())
+    request.setHeader(b'ETag', etag)
+    if notModified(request, etag):
+        request.setResponseCode(http.NOT_MODIFIED)
+        return True
+    return False
+
+
+
+class AutoETagResource(Resource):
+    """
+    Resource wrapper giving ``200 OK`` responses to ``GET`` and ``HEAD``
+    requests, that do not already have one, an ``ETag`` derived from a hash
+    of the response body, and answering conditional requests with ``304 Not
+    Modified``.
+
+    The response body, even a streamed one, is buffered until it is complete,
+    which only saves sending the body, not building it. Responses larger than
+    ``maxBytes`` are sent without an ``ETag`` once they outgrow the buffer.
+    Prefer `conditional` where cheaper validators are available.
+    """
+    isLeaf = True
+
+    def __init__(self, resource, maxBytes=1024 * 1024):
+        """
+        :type  resource: `IResource`
+        :param resource: Resource to wrap.
+
+        :type  maxBytes: `int`
+        :param maxBytes: Maximum size of a response body to buffer.
+        """
+        Resource.__init__(self)
+        self._resource = resource
+        self._maxBytes = maxBytes
+
+
+    def render(self, request):
+        resource = getChildForRequest(self._resource, request)
+        if request.method not in (b'GET', b'HEAD'):
+            return resource.render(request)
+        body = resource.render(_BufferingRequest(request, self._maxBytes))
+        if body is not NOT_DONE_YET and _tagged(request, body):
+            return b''
+        return body
+
+
+
+__all__ = [
+    'AutoETagResource', 'conditional', 'formatETag', 'notModified']
@@ -0,0 +1,361 @@
+"""
+Compression of response bodies.
+
+`EncodingResource` wraps any `IResource
+<twisted:twisted.web.resource.IResource>`, such as a router's resource, and
+compresses its responses with the ``gzip`` or ``deflate`` content coding
+negotiated from the ``Accept-Encoding`` header. Compressed forms of complete
+response bodies are kept in a `CompressedCache`, so that the same payload,
+such as a cached or static response, is never compressed twice.
+"""
+import zlib
+from collections import OrderedDict
+
+from twisted.web import http
+from twisted.web.resource import Resource, getChildForRequest
+from twisted.web.server import NOT_DONE_YET
+
+from txspinneret.util import (
+    _memoizedHeader, _parseAccept, _qValue, _renderProxied)
+
+
+
+_COMPRESSORS = {
+    b'gzip': lambda level: zlib.compressobj(
+        level, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+    b'deflate': lambda level: zlib.compressobj(
+        level, zlib.DEFLATED, zlib.MAX_WBITS),
+    }
+
+_ALIASES = {b'x-gzip': b'gzip'}
+
+# Media types that are already compressed.
+_INCOMPRESSIBLE_TYPES = (
+    b'audio/', b'image/gif', b'image/jpeg', b'image/png', b'image/webp',
+    b'video/', b'application/gzip', b'application/x-gzip',
+    b'application/zip', b'font/woff')
+
+_NO_BODY_CODES = frozenset([http.NO_CONTENT, http.NOT_MODIFIED])
+
+
+
+def negotiateEncoding(request, encodings):
+    """
+    Negotiate a content coding from a request's ``Accept-Encoding`` header.
+
+    :type  request: `IRequest <twisted:twisted.web.iweb.IRequest>`
+    :param request: Request to negotiate for.
+
+    :type  encodings: ``sequence`` of `bytes`
+    :param encodings: Supported content codings, in order of preference.
+
+    :rtype: `bytes`
+    :return: Most acceptable content coding, or ``None`` to not encode the
+        response.
+    """
+    accept = _memoizedHeader(
+        request.requestHeaders, b'Accept-Encoding', _parseAccept)
+    rejected = set()
+    acceptable = []
+    for coding, params in accept.items():
+        coding = coding.lower()
+        coding = _ALIASES.get(coding, coding)
+        if _qValue(params) <= 0:
+            rejected.add(coding)
+        else:
+            acceptable.append(coding)
+    for coding in acceptable:
+        if coding == b'*':
+            for encoding in encodings:
+                if encoding not in rejected:
+                    return encoding
+        elif coding in encodings and coding not in rejected:
+            return coding
+    return None
+
+
+
+class CompressedCache(object):
+    """
+    Bounded cache of compressed response bodies, kept alongside the
+    uncompressed bodies, discarding the least recently used bodies first.
+
+    Bodies are looked up by their length and checksum, and compared with the
+    uncompressed body to rule out collisions, which is cheap when the body is
+    the very same object as the one stored, such as a response stored by
+    `txspinneret.cache.CachingResource` or a static resource.
+
+    :ivar maxBytes: Maximum total size of the compressed and uncompressed
+        bodies.
+
+    :ivar size: Total size of the compressed and uncompressed bodies.
+
+    :ivar hits: Number of bodies that had already been compressed.
+
+    :ivar misses: Number of bodies that had to be compressed.
+    """
+    def __init__(self, maxBytes=16 * 1024 * 1024):
+        """
+        :type  maxBytes: `int`
+        :param maxBytes: Maximum total size of the compressed and uncompressed
+            bodies.
+        """
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def compress(self, body, encoding, compressLevel):
+        """
+        Compress a body, or look up its compressed form if it has already been
+        compressed with the same encoding and level.
+
+        :type  body: `bytes`
+        :param body: Uncompressed body.
+
+        :type  encoding: `bytes`
+        :param encoding: Content coding to compress with.
+
+        :type  compressLevel: `int`
+        :param compressLevel: ``zlib`` compression level.
+
+        :rtype: `bytes`
+        """
+        key = encoding, compressLevel, len(body), zlib.crc32(body)
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._entries[key] = entry
+            original, compressed = entry
+            if original is body or original == body:
+                self.hits += 1
+                return compressed
+        self.misses += 1
+        compressor = _COMPRESSORS[encoding](compressLevel)
+        compressed = compressor.compress(body) + compressor.flush()
+        size = len(body) + len(compressed)
+        if size <= self.maxBytes:
+            self._remove(key)
+            self._entries[key] = body, compressed
+            self.size += size
+            while self.size > self.maxBytes:
+                self._remove(next(iter(self._entries)))
+        return compressed
+
+
+    def _remove(self, key):
+        """
+        Remove a compressed body, if it is stored.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            original, compressed = entry
+            self.size -= len(original) + len(compressed)
+
+
+    def clear(self):
+        """
+        Discard every compressed body.
+        """
+        self._entries.clear()
+        self.size = 0
+
+
+
+def _addVary(headers):
+    """
+    Indicate that a response varies on ``Accept-Encoding``.
+    """
+    for value in headers.getRawHeaders(b'vary', []):
+        for name in value.split(b','):
+            if name.strip().lower() in (b'*', b'accept-encoding'):
+                return
+    headers.addRawHeader(b'Vary', b'Accept-Encoding')
+
+
+
+def _shouldEncode(request):
+    """
+    Should the response to a request be encoded?
+    """
+    headers = request.responseHeaders
+    if (getattr(request, 'code', http.OK) in _NO_BODY_CODES or
+            headers.hasHeader(b'content-encoding')):
+        return False
+    contentType = headers.getRawHeaders(b'content-type', [b''])[0].lower()
+    return not contentType.startswith(_INCOMPRESSIBLE_TYPES)
+
+
+
+class _EncodingRequest(object):
+    """
+    Proxy for a request that encodes the response body written to it.
+
+    Writes are buffered until there is more than one, and enough to be worth
+    compressing. If the request is finished before then the complete body is
+    encoded with `CompressedCache.compress`, otherwise the body is compressed
+    as it is written.
+    """
+    def __init__(self, request, encoding, resource):
+        self.__dict__.update(
+            _request=request, _encoding=encoding, _resource=resource,
+            _buffer=[], _size=0, _compressor=None)
+
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+    def __setattr__(self, name, value):
+        setattr(self._request, name, value)
+
+
+    def _start(self, encode):
+        """
+        Start the response, setting the headers describing its encoding.
+        """
+        headers = self._request.responseHeaders
+        _addVary(headers)
+        if not encode:
+            return
+        headers.setRawHeaders(b'content-encoding', [self._encoding])
+        headers.removeHeader(b'content-length')
+        etag = headers.getRawHeaders(b'etag', [None])[0]
+        if etag is not None and not etag.startswith(b'W/'):
+            # The encoded representation is not byte-for-byte identical, but
+            # is semantically equivalent.
+            headers.setRawHeaders(b'etag', [b'W/' + etag])
+
+
+    def encodeBody(self, body):
+        """
+        Encode a complete response body.
+
+        :rtype: `bytes`
+        """
+        encode = (self._encoding is not None and
+                  len(body) >= self._resource.minimumSize and
+                  _shouldEncode(self._request))
+        self._start(encode)
+        if encode:
+            body = self._resource.cache.compress(
+                body, self._encoding, self._resource.compressLevel)
+        return body
+
+
+    def render(self, resource):
+        _renderProxied(self, resource)
+
+
+    def write(self, data):
+        if self._buffer is not None:
+            self._buffer.append(data)
+            self.__dict__['_size'] = self._size + len(data)
+            if (len(self._buffer) < 2 or
+                    self._size < self._resource.minimumSize):
+                return
+            data = b''.join(self._buffer)
+            self.__dict__['_buffer'] = None
+            encode = (self._encoding is not None and
+                      _shouldEncode(self._request))
+            self._start(encode)
+            if encode:
+                self.__dict__['_compressor'] = _COMPRESSORS[self._encoding](
+                    self._resource.compressLevel)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        if data:
+            self._request.write(data)
+
+
+    def finish(self):
+        if self._buffer is not None:
+            body = self.encodeBody(b''.join(self._buffer))
+            self.__dict__['_buffer'] = None
+            if body:
+                self._request.write(body)
+        elif self._compressor is not None:
+            self._request.write(self._compressor.flush())
+        self._request.finish()
+
+
+
+class EncodingResource(Resource):
+    """
+    Resource wrapper compressing response bodies with the content coding
+    negotiated from the ``Accept-Encoding`` header.
+
+    Every response indicates that it varies on ``Accept-Encoding``. Bodies
+    smaller than ``minimumSize``, responses that already have
+    a ``Content-Encoding`` and media types that are already compressed, such
+    as most images, are not encoded. Strong ``ETag``\\s of encoded responses
+    are made weak, since the encoded body is not byte-for-byte identical to
+    the original.
+
+    Complete bodies, those returned from ``render`` or written all at once,
+    are compressed with `CompressedCache.compress`, so that the same payload
+    is only ever compressed once. Larger, streamed, bodies are compressed as
+    they are written.
+
+    To compress responses stored by `txspinneret.cache.CachingResource` this
+    should wrap the `CachingResource <txspinneret.cache.CachingResource>`,
+    rather than the other way around.
+    """
+    isLeaf = True
+
+    def __init__(self, resource, encodings=(b'gzip', b'deflate'),
+                 compressLevel=6, minimumSize=1024, cache=None):
+        """
+        :type  resource: `IResource`
+        :param resource: Resource to wrap.
+
+        :type  encodings: ``sequence`` of `bytes`
+        :param encodings: Content codings to use, in order of preference, of
+            ``gzip`` and ``deflate``.
+
+        :type  compressLevel: `int`
+        :param compressLevel: ``zlib`` compression level.
+
+        :type  minimumSize: `int`
+        :param minimumSize: Size of the smallest body worth compressing.
+
+        :type  cache: `CompressedCache`
+        :param cache: Cache of compressed bodies, which may be shared with
+            other `EncodingResource`\\s, or ``None`` to create one.
+        """
+        Resource.__init__(self)
+        for encoding in encodings:
+            if encoding not in _COMPRESSORS:
+                raise ValueError('Unsupported encoding %r' % (encoding,))
+        if cache is None:
+            cache = CompressedCache()
+        self._resource = resource
+        self.encodings = tuple(encodings)
+        self.compressLevel = compressLevel
+        self.minimumSize = minimumSize
+        self.cache = cache
+
+
+    def render(self, request):
+        resource = getChildForRequest(self._resource, request)
+        encoding = negotiateEncoding(request, self.encodings)
+        encodingRequest = _EncodingRequest(request, encoding, self)
+        body = resource.render(encodingRequest)
+        if body is NOT_DONE_YET:
+            return body
+        if encodingRequest._size:
+            # Part of the body was written before the rest was returned.
+            encodingRequest.write(body)
+            encodingRequest.finish()
+            return NOT_DONE_YET
+        return encodingRequest.encodeBody(body)
+
+
+
+__all__ = [
+    'CompressedCache', 'EncodingResource', 'negotiateEncoding']
@@ -1,3 +1,4 @@
+from twisted.web.iweb import IRenderable
 from zope.interface import Attribute, Interface
 
 
@@ -50,3 +51,25 @@ class INegotiableResource(Interface):
         `list` of `bytes` indicating the content types this resource is capable
         of accepting.
         """)
+
+
+
+class ICacheableRenderable(IRenderable):
+    """
+    `IRenderable <twisted:twisted.web.iweb.IRenderable>` whose flattened form
+    can be cached and reused.
+
+    See `txspinneret.template.cacheable`.
+    """
+    cacheKey = Attribute(
+        """
+        Hashable key identifying the flattened renderable, renderables with
+        the same key share the same flattened form.
+        """)
+
+
+    cacheTTL = Attribute(
+        """
+        Seconds to keep the flattened renderable for, or ``None`` to keep it
+        until it is discarded to make room for others.
+        """)
@@ -0,0 +1,109 @@
+"""
+Batched, coalesced loading of objects by key.
+
+`Loader` collects the keys requested during a single reactor turn, no matter
+which request they originate from, and loads them with one call to a batch
+loading function. Concurrent loads of the same key share a single lookup.
+"""
+from twisted.internet.defer import Deferred, maybeDeferred
+
+
+
+class Loader(object):
+    """
+    Load objects by key, in batches.
+
+    Every key passed to `Loader.load` before the end of the current reactor
+    turn is loaded by a single call to the batch loading function. A key that
+    is already waiting to be loaded, or is in the process of being loaded, is
+    not loaded again and its result is shared instead. Results are not kept
+    once they have been delivered, so a later load of the same key performs
+    a new lookup.
+    """
+    def __init__(self, batchLoad, clock=None, maxBatchSize=None):
+        """
+        :type  batchLoad: ``callable``
+        :param batchLoad: Callable taking a `list` of keys and returning, or
+            returning a `Deferred` that fires with, a `list` of the loaded
+            objects in the same order as the keys; ``None`` indicates a key
+            that has no object.
+
+        :type  clock: `IReactorTime`
+        :param clock: Clock to schedule batches with, defaults to the global
+            reactor.
+
+        :type  maxBatchSize: `int`
+        :param maxBatchSize: Maximum number of keys to pass to ``batchLoad`` in
+            one call, or ``None`` for no limit.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._batchLoad = batchLoad
+        self._clock = clock
+        self._maxBatchSize = maxBatchSize
+        self._pending = []
+        self._waiting = {}
+        self._call = None
+        self.batches = 0
+        self.loads = 0
+
+
+    def load(self, key):
+        """
+        Load the object for ``key``.
+
+        :param key: Hashable key to load.
+
+        :rtype: `Deferred`
+        :return: Deferred that fires with the loaded object, or ``None``.
+        """
+        self.loads += 1
+        d = Deferred()
+        waiting = self._waiting.get(key)
+        if waiting is None:
+            waiting = self._waiting[key] = []
+            self._pending.append(key)
+            if self._call is None:
+                self._call = self._clock.callLater(0, self._dispatch)
+        waiting.append(d)
+        return d
+
+
+    def _dispatch(self):
+        """
+        Load all of the pending keys, in batches of at most ``maxBatchSize``.
+        """
+        self._call = None
+        keys, self._pending = self._pending, []
+        size = self._maxBatchSize or len(keys)
+        for i in xrange(0, len(keys), size):
+            self._loadBatch(keys[i:i + size])
+
+
+    def _loadBatch(self, keys):
+        """
+        Load a single batch of keys and deliver the results to everything
+        waiting on them.
+        """
+        def _loaded(values):
+            if len(values) != len(keys):
+                raise ValueError(
+                    'Batch load of %d keys returned %d values' % (
+                        len(keys), len(values)))
+            for key, value in zip(keys, values):
+                for d in self._waiting.pop(key):
+                    d.callback(value)
+
+        def _failed(f):
+            for key in keys:
+                for d in self._waiting.pop(key, []):
+                    d.errback(f)
+
+        self.batches += 1
+        d = maybeDeferred(self._batchLoad, list(keys))
+        d.addCallback(_loaded)
+        d.addErrback(_failed)
+
+
+
+__all__ = ['Loader']
@@ -7,8 +7,11 @@ existing ``IResource`` implementations.
 `ContentTypeNegotiator` will negotiate a resource based on the ``Accept``
 header.
 """
-from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.internet.defer import CancelledError, Deferred, fail
+from twisted.internet.interfaces import IPullProducer, IPushProducer
+from twisted.python import log
 from twisted.python.compat import nativeString
+from twisted.python.failure import Failure
 from twisted.python.urlpath import URLPath
 from twisted.web import http
 from twisted.web.error import UnsupportedMethod
@@ -16,11 +19,12 @@ from twisted.web.iweb import IRenderable
 from twisted.web.resource import (
     IResource, NoResource, Resource, _computeAllowedMethods)
 from twisted.web.server import NOT_DONE_YET
-from twisted.web.template import renderElement
 from twisted.web.util import DeferredResource, Redirect
+from zope.interface import implementer
 
 from txspinneret.interfaces import ISpinneretResource
-from txspinneret.util import _parseAccept
+from txspinneret.template import _renderTemplate, flattenedCache
+from txspinneret.util import _memoizedHeader, _parseAccept
 
 
 
@@ -53,6 +57,29 @@ class NotAcceptable(Resource):
 
 
 
+class MethodNotAllowed(Resource):
+    """
+    Leaf resource that renders an empty body for ``405 Method Not Allowed``.
+    """
+    isLeaf = True
+
+    def __init__(self, allowedMethods):
+        """
+        :type  allowedMethods: ``sequence`` of `bytes`
+        :param allowedMethods: HTTP methods that are allowed, for the
+            ``Allow`` header.
+        """
+        Resource.__init__(self)
+        self.allowedMethods = allowedMethods
+
+
+    def render(self, request):
+        request.setResponseCode(http.NOT_ALLOWED)
+        request.setHeader(b'Allow', b', '.join(self.allowedMethods))
+        return b''
+
+
+
 class NotFound(NoResource):
     """
     Leaf resource that renders a page for ``404 Not Found``.
@@ -62,6 +89,29 @@ class NotFound(NoResource):
 
 
 
+class _PrerenderedNotFound(NotFound):
+    """
+    `NotFound` leaf whose page is rendered once, when it is created, making it
+    suitable for sharing between requests.
+    """
+    isLeaf = True
+
+    def __init__(self):
+        NotFound.__init__(self)
+        body = self.template % dict(
+            code=self.code, brief=self.brief, detail=self.detail)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self._body = body
+
+
+    def render(self, request):
+        request.setResponseCode(self.code)
+        request.setHeader(b'content-type', b'text/html; charset=utf-8')
+        return self._body
+
+
+
 class _RenderableResource(Resource):
     """
     Adapter from `IRenderable` to `IResource`.
@@ -76,14 +126,396 @@ class _RenderableResource(Resource):
 
     def render(self, request):
         request.setResponseCode(http.OK)
-        return renderElement(request, self._renderable, self._doctype)
+        return _renderTemplate(
+            request, self._renderable, self._doctype, flattenedCache)
+
+
+
+@implementer(IPushProducer)
+class _IteratorProducer(object):
+    """
+    Producer writing the items of an iterator to a request, until the iterator
+    is exhausted.
+
+    Items that are a `Deferred` are waited on, and their results written,
+    before the next item is produced. If producing fails before anything has
+    been written the request processing fails, otherwise the failure is
+    logged and the connection is closed to indicate the response is
+    incomplete.
+    """
+    def __init__(self, request, iterator):
+        self._request = request
+        self._iterator = iterator
+        self._paused = False
+        self._producing = False
+        self._stopped = False
+        self._waiting = None
+        self._written = False
+
+
+    def pauseProducing(self):
+        self._paused = True
+
+
+    def resumeProducing(self):
+        self._paused = False
+        if not self._producing and self._waiting is None:
+            self._produce()
+
+
+    def stopProducing(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._waiting is not None:
+            self._waiting.cancel()
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+    def _write(self, data):
+        self._written = True
+        self._request.write(data)
+
+
+    def _produce(self):
+        """
+        Write items for as long as the producer is not paused, stopped or
+        waiting on an item.
+        """
+        self._producing = True
+        try:
+            while not self._paused and not self._stopped:
+                item = next(self._iterator, _MISSING)
+                if item is _MISSING:
+                    self._stopped = True
+                    self._request.unregisterProducer()
+                    self._request.finish()
+                elif isinstance(item, Deferred):
+                    self._waiting = item
+                    item.addBoth(self._itemArrived)
+                    if self._waiting is not None:
+                        break
+                else:
+                    self._write(item)
+        except:
+            self._fail(Failure())
+        finally:
+            self._producing = False
+
+
+    def _itemArrived(self, result):
+        """
+        Write the result of an item that was waited on.
+        """
+        self._waiting = None
+        if self._stopped:
+            return
+        if isinstance(result, Failure):
+            self._fail(result)
+            return
+        try:
+            self._write(result)
+        except:
+            self._fail(Failure())
+            return
+        if not self._producing:
+            self._produce()
+
+
+    def _fail(self, reason):
+        """
+        Stop producing because of a failure.
+        """
+        self.stopProducing()
+        self._request.unregisterProducer()
+        if self._written:
+            log.err(reason, 'Failed to produce the rest of a response body')
+            self._request.loseConnection()
+        else:
+            self._request.processingFailed(reason)
+
+
+
+@implementer(IPushProducer)
+class _ProducerProxy(object):
+    """
+    Proxy for an `IPushProducer` or `IPullProducer`, that stops the producer
+    at most once.
+    """
+    def __init__(self, producer):
+        self._producer = producer
+        self._stopped = False
+
+
+    def pauseProducing(self):
+        self._producer.pauseProducing()
+
+
+    def resumeProducing(self):
+        if not self._stopped:
+            self._producer.resumeProducing()
+
+
+    def stopProducing(self):
+        if not self._stopped:
+            self._stopped = True
+            self._producer.stopProducing()
+
+
+
+class _StreamingResource(Resource):
+    """
+    Adapter from an iterator, `IPushProducer` or `IPullProducer` to
+    `IResource`, streaming the response body.
+
+    The items of an iterator are written to the request as they are produced,
+    while producers are expected to write to, and finish, the request
+    themselves. Either way the producer is registered with the request, so
+    that it is paused while the transport's buffers are full, and is stopped
+    if the request finishes prematurely, such as when the client disconnects.
+    `IPushProducer` providers are started by calling ``resumeProducing``.
+    """
+    isLeaf = True
+
+    def __init__(self, body):
+        Resource.__init__(self)
+        self._body = body
+
+
+    def render(self, request):
+        body = self._body
+        streaming = IPushProducer.providedBy(body)
+        if streaming or IPullProducer.providedBy(body):
+            producer = _ProducerProxy(body)
+        else:
+            producer = _IteratorProducer(request, iter(body))
+            streaming = True
+        request.notifyFinish().addErrback(
+            lambda _: producer.stopProducing())
+        request.registerProducer(producer, streaming)
+        if streaming:
+            producer.resumeProducing()
+        return NOT_DONE_YET
+
+
+
+_MISSING = object()
+
+
+
+def _cancelWhenFinished(request, d):
+    """
+    Cancel a `Deferred` if the request finishes before it fires, such as when
+    the client disconnects.
+
+    :rtype: ``callable``
+    :return: Errback for ``d`` that fails the request processing, unless the
+        request has already finished and there is nobody to tell.
+    """
+    finished = []
+
+    def _requestFinished(result):
+        finished.append(True)
+        d.cancel()
+
+    def _failed(reason):
+        if not finished:
+            return request.processingFailed(reason)
+        if not reason.check(CancelledError):
+            log.err(reason, 'Failed after the request finished')
+
+    request.notifyFinish().addBoth(_requestFinished)
+    return _failed
+
+
+
+class _DeferredResource(DeferredResource):
+    """
+    `DeferredResource <twisted:twisted.web.util.DeferredResource>` that
+    cancels its `Deferred` if the request finishes before the child has been
+    located.
+
+    Cancelling the `Deferred` also cancels any `Deferred` it is waiting on,
+    such as the one returned by ``locateChild`` for a nested spinneret
+    resource, so every step of locating the child is cancelled.
+    """
+    def render(self, request):
+        failed = _cancelWhenFinished(request, self.d)
+        self.d.addCallback(self._cbChild, request).addErrback(failed)
+        return NOT_DONE_YET
+
+
+
+def _defaultLocateChild(request, segments):
+    """
+    ``locateChild`` for `ISpinneretResource` implementations without one.
+    """
+    return NotFound(), []
+
+
+
+def _isIterator(result):
+    """
+    Is ``result`` an iterator, such as a generator, to stream as a response
+    body?
+
+    Only iterators are streamed, other iterables such as containers are not.
+    `Deferred` implements the iterator protocol, for ``yield from``, but is
+    never streamed.
+    """
+    if isinstance(result, Deferred):
+        return False
+    return hasattr(result, '__iter__') and (
+        hasattr(result, 'next') or hasattr(result, '__next__'))
+
+
+
+class _AdaptationCache(object):
+    """
+    Cache of the adaption to `IResource` to use for each type of result, and
+    of the `SpinneretResource` wrappers for spinneret resources.
+
+    Adapter lookups depend only on what a result provides, which is the same
+    for every instance of a type unless an instance directly provides
+    interfaces of its own, so the adaption is worked out once per type and
+    instances with their own declarations are never cached. Adapters
+    registered after a type has been seen are not noticed until the cache is
+    cleared.
+
+    Spinneret resources that declare themselves stable, by having a true
+    ``stable`` attribute, meaning the same long-lived instance is returned for
+    many requests, reuse the same wrapper. Other spinneret resources, which
+    are often created for a single request, are always wrapped anew so that
+    they are not kept alive. At most ``maxWrappers`` wrappers, and therefore
+    stable spinneret resources, are kept.
+
+    :ivar hits: Number of results adapted with a cached adaption.
+
+    :ivar misses: Number of results whose adaption had to be looked up.
+
+    :ivar wrapperHits: Number of stable spinneret resources that reused
+        a wrapper.
+
+    :ivar wrapperMisses: Number of stable spinneret resources that had to be
+        wrapped.
+    """
+    def __init__(self, maxTypes=1024, maxWrappers=128):
+        """
+        :type  maxTypes: `int`
+        :param maxTypes: Maximum number of types to cache adaptions for.
+
+        :type  maxWrappers: `int`
+        :param maxWrappers: Maximum number of wrappers to keep, or ``0`` to
+            never reuse wrappers.
+        """
+        self.maxTypes = maxTypes
+        self.maxWrappers = maxWrappers
+        self._adaptions = {}
+        self._wrappers = {}
+        self.hits = 0
+        self.misses = 0
+        self.wrapperHits = 0
+        self.wrapperMisses = 0
+
+
+    def clear(self):
+        """
+        Discard all cached adaptions and wrappers.
+        """
+        self._adaptions.clear()
+        self._wrappers.clear()
+
+
+    def _lookup(self, result):
+        """
+        Find the adaption to use for ``result``.
+
+        :return: The interface to adapt ``result`` to, `_StreamingResource`
+            for a streamed body, `URLPath` for a redirect or ``None`` to use
+            ``result`` as is.
+        """
+        for interface in [ISpinneretResource, IRenderable, IResource]:
+            if interface(result, None) is not None:
+                return interface
+        if (IPushProducer.providedBy(result) or
+                IPullProducer.providedBy(result) or
+                _isIterator(result)):
+            return _StreamingResource
+        if isinstance(result, URLPath):
+            return URLPath
+        return None
+
+
+    def _wrap(self, spinneretResource):
+        """
+        Wrap a spinneret resource in `SpinneretResource`, reusing an existing
+        wrapper if there is one and the resource is stable.
+        """
+        if not getattr(spinneretResource, 'stable', False):
+            return SpinneretResource(spinneretResource)
+        key = id(spinneretResource)
+        wrapper = self._wrappers.get(key)
+        if (wrapper is not None and
+                wrapper._wrappedResource is spinneretResource):
+            self.wrapperHits += 1
+            return wrapper
+        self.wrapperMisses += 1
+        wrapper = SpinneretResource(spinneretResource)
+        if self.maxWrappers:
+            if len(self._wrappers) >= self.maxWrappers:
+                self._wrappers.clear()
+            self._wrappers[key] = wrapper
+        return wrapper
+
+
+    def adapt(self, result):
+        """
+        Adapt a result to `IResource`.
+
+        See `SpinneretResource._adaptToResource`.
+        """
+        if result is None:
+            return NotFound()
+
+        kind = result.__class__
+        if '__provides__' in getattr(result, '__dict__', ()):
+            adaption = self._lookup(result)
+        else:
+            adaption = self._adaptions.get(kind, _MISSING)
+            if adaption is _MISSING:
+                self.misses += 1
+                adaption = self._lookup(result)
+                if len(self._adaptions) >= self.maxTypes:
+                    self._adaptions.clear()
+                self._adaptions[kind] = adaption
+            else:
+                self.hits += 1
+
+        if adaption is IResource:
+            return IResource(result)
+        elif adaption is ISpinneretResource:
+            return self._wrap(ISpinneretResource(result))
+        elif adaption is IRenderable:
+            return _RenderableResource(IRenderable(result))
+        elif adaption is _StreamingResource:
+            return _StreamingResource(result)
+        elif adaption is URLPath:
+            return Redirect(str(result))
+        return result
 
 
 
 class SpinneretResource(Resource):
     """
     Adapter from `ISpinneretResource` to `IResource`.
+
+    :cvar adaptationCache: `_AdaptationCache` used to adapt results to
+        `IResource`, its counters show how effective it is.
     """
+    adaptationCache = _AdaptationCache()
+
     def __init__(self, wrappedResource):
         """
         :type  wrappedResource: `ISpinneretResource`
@@ -99,52 +531,89 @@ class SpinneretResource(Resource):
 
         Several adaptions are tried they are, in order: ``None``,
         `IRenderable <twisted:twisted.web.iweb.IRenderable>`, `IResource
-        <twisted:twisted.web.resource.IResource>`, and `URLPath
-        <twisted:twisted.python.urlpath.URLPath>`. Anything else is returned as
-        is.
+        <twisted:twisted.web.resource.IResource>`, producers and iterators, and
+        `URLPath <twisted:twisted.python.urlpath.URLPath>`. Anything else is
+        returned as is.
 
-        A `URLPath <twisted:twisted.python.urlpath.URLPath>` is treated as
-        a redirect.
+        Producers and iterators, such as generators, are streamed as the
+        response body, see `_StreamingResource`. A `URLPath
+        <twisted:twisted.python.urlpath.URLPath>` is treated as a redirect.
+
+        The adaption used for each type of result is cached in
+        `SpinneretResource.adaptationCache`.
         """
-        if result is None:
-            return NotFound()
+        return self.adaptationCache.adapt(result)
 
-        spinneretResource = ISpinneretResource(result, None)
-        if spinneretResource is not None:
-            return SpinneretResource(spinneretResource)
 
-        renderable = IRenderable(result, None)
-        if renderable is not None:
-            return _RenderableResource(renderable)
+    def _locateChild(self, request, segments):
+        """
+        Locate the wrapped resource's child, and continue locating children of
+        any `SpinneretResource` that is found for as long as there are segments
+        remaining.
+
+        This resolves a tree of spinneret resources, such as nested routers, in
+        a single pass over the path. Each step updates the request's
+        ``prepath`` and ``postpath`` the same way Twisted's traversal would.
+        Traversal falls back to Twisted at the first resource that is not
+        a `SpinneretResource`.
+
+        Children are located synchronously for as long as ``locateChild``
+        returns its result immediately, a `Deferred` is only involved once
+        ``locateChild`` returns one. That `Deferred` is cancelled, by
+        `_DeferredResource`, if the request finishes before the child has been
+        located.
+
+        :type  segments: `list` of `bytes`
+        :param segments: Path segments, starting with the current one, to
+            locate a child for.
+
+        :rtype: `IResource <twisted:twisted.web.resource.IResource>` or
+            `Deferred` firing with one
+        """
+        locateChild = getattr(
+            self._wrappedResource, 'locateChild', _defaultLocateChild)
+        try:
+            result = locateChild(request, segments)
+            if isinstance(result, Deferred):
+                return result.addCallback(self._locatedChild, request)
+            return self._locatedChild(result, request)
+        except:
+            return fail()
 
-        resource = IResource(result, None)
-        if resource is not None:
-            return resource
 
-        if isinstance(result, URLPath):
-            return Redirect(str(result))
+    def _locatedChild(self, result, request):
+        """
+        Adapt the result of ``locateChild`` to a resource, and continue
+        locating its children if it is a `SpinneretResource`.
+        """
+        result, segments = result
+        request.postpath[:] = segments
+        if isinstance(result, Deferred):
+            return result.addCallback(self._adaptedChild, request)
+        return self._adaptedChild(result, request)
 
-        return result
+
+    def _adaptedChild(self, result, request):
+        """
+        Adapt a located child to a resource, and continue locating its
+        children if it is a `SpinneretResource`.
+        """
+        resource = self._adaptToResource(result)
+        if isinstance(resource, SpinneretResource) and request.postpath:
+            segments = list(request.postpath)
+            request.prepath.append(request.postpath.pop(0))
+            return resource._locateChild(request, segments)
+        return resource
 
 
     def getChildWithDefault(self, path, request):
-        def _setSegments(result):
-            result, segments = result
-            request.postpath[:] = segments
+        result = self._locateChild(
+            request, request.prepath[-1:] + request.postpath)
+        if not isinstance(result, Deferred):
+            # Twisted Web continues traversing the rest of the path, if there
+            # is any, from whatever resource this is.
             return result
-
-        def _locateChild(request, segments):
-            def _defaultLocateChild(request, segments):
-                return NotFound(), []
-            locateChild = getattr(
-                self._wrappedResource, 'locateChild', _defaultLocateChild)
-            return locateChild(request, segments)
-
-        d = maybeDeferred(
-            _locateChild, request, request.prepath[-1:] + request.postpath)
-        d.addCallback(_setSegments)
-        d.addCallback(self._adaptToResource)
-        return DeferredResource(d)
+        return _DeferredResource(result)
 
 
     def _handleRenderResult(self, request, result):
@@ -152,14 +621,20 @@ class SpinneretResource(Resource):
         Handle the result from `IResource.render`.
 
         If the result is a `Deferred` then return `NOT_DONE_YET` and add
-        a callback to write the result to the request when it arrives.
+        a callback to write the result to the request when it arrives, the
+        `Deferred` is cancelled if the request finishes before then. Otherwise
+        the result is rendered immediately.
         """
-        def _requestFinished(result, cancel):
-            cancel()
-            return result
-
         if not isinstance(result, Deferred):
-            result = succeed(result)
+            try:
+                resource = self._adaptToResource(result)
+                render = getattr(resource, 'render', None)
+                if render is None:
+                    return resource
+                return render(request)
+            except:
+                request.processingFailed(Failure())
+                return NOT_DONE_YET
 
         def _whenDone(result):
             render = getattr(result, 'render', lambda request: result)
@@ -168,10 +643,10 @@ class SpinneretResource(Resource):
                 request.write(renderResult)
                 request.finish()
             return result
-        request.notifyFinish().addBoth(_requestFinished, result.cancel)
+        failed = _cancelWhenFinished(request, result)
         result.addCallback(self._adaptToResource)
         result.addCallback(_whenDone)
-        result.addErrback(request.processingFailed)
+        result.addErrback(failed)
         return NOT_DONE_YET
 
 
@@ -226,7 +701,8 @@ class ContentTypeNegotiator(Resource):
         :rtype: 2-`tuple` of `twisted.web.iweb.IResource` and `bytes`
         :return: Pair of a resource and the content type.
         """
-        accept = _parseAccept(request.requestHeaders.getRawHeaders('Accept'))
+        accept = _memoizedHeader(
+            request.requestHeaders, b'Accept', _parseAccept)
         for contentType in accept.keys():
             handler = self._acceptHandlers.get(contentType.lower())
             if handler is not None:
@@ -252,4 +728,5 @@ class ContentTypeNegotiator(Resource):
 
 
 __all__ = [
-    'SpinneretResource', 'ContentTypeNegotiator', 'NotAcceptable', 'NotFound']
+    'SpinneretResource', 'ContentTypeNegotiator', 'MethodNotAllowed',
+    'NotAcceptable', 'NotFound']
@@ -15,16 +15,71 @@ a URL path, additional segments are used in child resource location as normal.)
 `Router` is an `IResource` that allows decorating methods as route or subroute
 handlers.
 """
+import imp
+import marshal
+import os
+import re
+import uuid
 from collections import OrderedDict
-from functools import partial, wraps
-from itertools import izip_longest
+from functools import wraps
+from hashlib import sha1
+from urllib import quote
 
+from twisted.internet.defer import Deferred, FirstError, gatherResults
+from twisted.python import log
 from zope.interface import implementer
 
 from txspinneret import query
 from txspinneret.resource import (
-    ISpinneretResource, NotFound, SpinneretResource)
-from txspinneret.util import contentEncoding
+    ISpinneretResource, MethodNotAllowed, NotFound, SpinneretResource,
+    _PrerenderedNotFound)
+from txspinneret.util import LRUCache, contentEncoding
+
+
+
+_MISSING = object()
+
+
+
+def _matcherKey(factory, *args):
+    """
+    Create a key identifying equivalent matchers, those created by the same
+    factory with the same arguments.
+
+    :return: Hashable key, or ``None`` if the arguments are unhashable and
+        the matcher is only equivalent to itself.
+    """
+    key = (factory,) + args
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+
+def _componentKey(component):
+    """
+    Key identifying a route component, equivalent matchers, see
+    `_matcherKey`, have the same key and share edges in a `_RouteTrie`.
+    """
+    key = getattr(component, 'key', None)
+    if key is None:
+        return id(component)
+    return key
+
+
+
+def _textSegment(encoding):
+    """
+    Create an inverse, for URL generation, of a text parameter matcher.
+    """
+    encoding = encoding or 'utf-8'
+    def _toSegment(value):
+        if isinstance(value, bytes):
+            return value
+        return unicode(value).encode(encoding)
+    return _toSegment
 
 
 
@@ -47,6 +102,11 @@ def Text(name, encoding=None):
         return name, query.Text(
             value,
             encoding=contentEncoding(request.requestHeaders, encoding))
+    _match.pure = True
+    _match.matchesAll = True
+    _match.name = name
+    _match.key = _matcherKey(Text, name, encoding)
+    _match.toSegment = _textSegment(encoding)
     return _match
 
 
@@ -55,10 +115,45 @@ Any = Text
 
 
 
-def Integer(name, base=10, encoding=None):
+def _inRange(value, minimum, maximum):
+    """
+    Is ``value`` within the inclusive range, either bound may be ``None``?
+    """
+    return ((minimum is None or value >= minimum) and
+            (maximum is None or value <= maximum))
+
+
+
+# Formats for the integer bases that URL segments can be generated for.
+_INTEGER_FORMATS = {8: b'%o', 10: b'%d', 16: b'%x'}
+
+
+
+def _integerSegment(format, minimum, maximum):
+    """
+    Create an inverse, for URL generation, of an integer parameter matcher.
+
+    The inverse raises `ValueError` for a value that is not an integer, or is
+    out of range, since no URL it generated would be matched.
+    """
+    def _toSegment(value):
+        if isinstance(value, bool) or not isinstance(value, (int, long)):
+            raise ValueError('Not an integer: %r' % (value,))
+        if not _inRange(value, minimum, maximum):
+            raise ValueError('Integer out of range: %r' % (value,))
+        return format % (value,)
+    return _toSegment
+
+
+
+def Integer(name, base=10, encoding=None, minimum=None, maximum=None):
     """
     Match an integer route parameter.
 
+    Decimal values are validated as ASCII digits, with an optional sign,
+    before any decoding is done so that non-matching segments are cheaply
+    rejected.
+
     :type  name: `bytes`
     :param name: Route parameter name.
 
@@ -69,86 +164,400 @@ def Integer(name, base=10, encoding=None):
     :param encoding: Default encoding to assume if the ``Content-Type``
         header is lacking one.
 
+    :type  minimum: `int`
+    :param minimum: Smallest value to match, or ``None`` for no lower bound.
+
+    :type  maximum: `int`
+    :param maximum: Largest value to match, or ``None`` for no upper bound.
+
+    :return: ``callable`` suitable for use with `route` or `subroute`.
+    """
+    def _match(request, value):
+        if base == 10 and isinstance(value, bytes):
+            digits = value[1:] if value[:1] in b'+-' else value
+            if not digits.isdigit():
+                return name, None
+            result = int(value)
+        else:
+            result = query.Integer(
+                value,
+                base=base,
+                encoding=contentEncoding(request.requestHeaders, encoding))
+            if result is None:
+                return name, None
+        if not _inRange(result, minimum, maximum):
+            return name, None
+        return name, result
+    _match.pure = True
+    _match.name = name
+    _match.key = _matcherKey(Integer, name, base, encoding, minimum, maximum)
+    format = _INTEGER_FORMATS.get(base)
+    if format is not None:
+        _match.toSegment = _integerSegment(format, minimum, maximum)
+    return _match
+
+
+
+_UUID_PATTERN = re.compile(
+    r'\A[0-9a-fA-F]{8}-?(?:[0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}\Z')
+
+
+
+def UUID(name):
+    """
+    Match a UUID route parameter, in hexadecimal with or without hyphens.
+
+    :type  name: `bytes`
+    :param name: Route parameter name.
+
+    :return: ``callable`` suitable for use with `route` or `subroute`, the
+        parameter value is a `uuid.UUID`.
+    """
+    def _match(request, value):
+        if _UUID_PATTERN.match(value) is None:
+            return name, None
+        return name, uuid.UUID(value)
+    _match.pure = True
+    _match.name = name
+    _match.key = _matcherKey(UUID, name)
+    _match.toSegment = str
+    return _match
+
+
+
+def Choice(name, choices):
+    """
+    Match a route parameter with one of a fixed set of values.
+
+    `Enum` is a synonym for `Choice`.
+
+    Segments are compared, without decoding, against the choices.
+
+    :type  name: `bytes`
+    :param name: Route parameter name.
+
+    :type  choices: ``iterable`` of `bytes` or `dict` mapping `bytes` to
+        values
+    :param choices: Segment values to match, or a mapping of segment values to
+        parameter values.
+
     :return: ``callable`` suitable for use with `route` or `subroute`.
     """
+    if isinstance(choices, dict):
+        mapping = dict(choices)
+        def _match(request, value):
+            return name, mapping.get(value)
+        key = _matcherKey(Choice, name, tuple(sorted(
+            (segment, type(choice), choice)
+            for segment, choice in mapping.iteritems())))
+        try:
+            segments = dict(
+                (choice, segment) for segment, choice in mapping.iteritems())
+        except TypeError:
+            # Unhashable values are found by searching the mapping instead.
+            segments = None
+        def _toSegment(value):
+            if segments is not None:
+                return segments[value]
+            for segment, choice in mapping.iteritems():
+                if choice == value:
+                    return segment
+            raise KeyError(value)
+    else:
+        values = frozenset(choices)
+        def _match(request, value):
+            if value in values:
+                return name, value
+            return name, None
+        _toSegment = bytes
+        key = _matcherKey(Choice, name, values)
+    _match.pure = True
+    _match.name = name
+    _match.key = key
+    _match.toSegment = _toSegment
+    return _match
+
+
+
+Enum = Choice
+
+
+
+def Regex(name, pattern, encoding=None):
+    """
+    Match a route parameter against a regular expression.
+
+    The pattern, even a precompiled one, must match the entire segment; it is
+    compiled once and matched against the segment before any decoding is done.
+
+    :type  name: `bytes`
+    :param name: Route parameter name.
+
+    :type  pattern: `bytes` or compiled regular expression
+    :param pattern: Regular expression to match segments against.
+
+    :type  encoding: `bytes`
+    :param encoding: Default encoding to assume if the ``Content-Type``
+        header is lacking one.
+
+    :return: ``callable`` suitable for use with `route` or `subroute`, the
+        parameter value is the matching segment as `unicode`.
+    """
+    flags = 0
+    if hasattr(pattern, 'match'):
+        pattern, flags = pattern.pattern, pattern.flags
+    pattern = re.compile(b'(?:%s)\\Z' % (pattern,), flags)
     def _match(request, value):
-        return name, query.Integer(
+        if pattern.match(value) is None:
+            return name, None
+        return name, query.Text(
             value,
-            base=base,
             encoding=contentEncoding(request.requestHeaders, encoding))
+    _match.pure = True
+    _match.name = name
+    _match.key = _matcherKey(
+        Regex, name, pattern.pattern, pattern.flags, encoding)
+    _match.toSegment = _textSegment(encoding)
     return _match
 
 
 
-def _matchRoute(components, request, segments, partialMatching):
+def Rest(name, encoding=None):
     """
-    Match a request path against our path components.
+    Match all of the remaining path segments.
 
-    The path components are always matched relative to their parent is in the
-    resource hierarchy, in other words it is only possible to match URIs nested
-    more deeply than the parent resource.
+    `Path` is a synonym for `Rest`.
 
-    :type  components: ``iterable`` of `bytes` or `callable`
-    :param components: Iterable of path components, to match against the
-        request, either static strings or dynamic parameters. As a convenience,
-        a single `bytes` component containing ``/`` may be given instead of
-        manually separating the components. If no components are given the null
-        route is matched, this is the case where ``segments`` is empty.
+    This must be the last component of a route, it matches zero or more
+    segments, making it possible to dispatch arbitrarily deep paths in a
+    single step.
 
-    :type  segments: ``sequence`` of `bytes`
-    :param segments: Sequence of path segments, from the request, to match
-        against.
+    :type  name: `bytes`
+    :param name: Route parameter name.
+
+    :type  encoding: `bytes`
+    :param encoding: Default encoding to assume if the ``Content-Type``
+        header is lacking one.
+
+    :return: ``callable`` suitable for use as the last component with `route`
+        or `subroute`, the parameter value is a `list` of `unicode`.
+    """
+    def _match(request, values):
+        encoding_ = contentEncoding(request.requestHeaders, encoding)
+        return name, [query.Text(value, encoding=encoding_)
+                      for value in values]
+    _match.pure = True
+    _match.matchesAll = True
+    _match.rest = True
+    _match.name = name
+    _match.key = _matcherKey(Rest, name, encoding)
+    _match.toSegment = _textSegment(encoding)
+    return _match
 
-    :type  partialMatching: `bool`
-    :param partialMatching: Allow partial matching against the request path?
 
-    :rtype: 2-`tuple` of `dict` keyed on `bytes` and `list` of `bytes`
-    :return: Pair of parameter results, mapping parameter names to processed
-        values, and a list of the remaining request path segments. If there is
-        no route match the result will be ``None`` and the original request path
-        segments.
+
+Path = Rest
+
+
+
+def Load(matcher, loader):
+    """
+    Match a route parameter with another matcher and load an object for the
+    matched value.
+
+    Loading is done by a `Loader <txspinneret.loader.Loader>`, which batches
+    and coalesces the lookups of all requests being routed at the same time.
+    The route handler is only invoked once the object has been loaded, and
+    receives it as the parameter value; if no object is loaded, ie. the result
+    is ``None``, the route does not match and a ``404 Not Found`` results.
+
+    :type  matcher: ``callable``
+    :param matcher: Matcher, such as `Integer`, that produces the key to load.
+
+    :type  loader: `Loader <txspinneret.loader.Loader>`
+    :param loader: Loader to load objects with.
+
+    :return: ``callable`` suitable for use with `route` or `subroute`.
+    """
+    def _match(request, value):
+        name, result = matcher(request, value)
+        if result is None:
+            return name, None
+        return name, loader.load(result)
+    _match.name = getattr(matcher, 'name', None)
+    _match.key = None
+    if getattr(matcher, 'key', None) is not None:
+        _match.key = _matcherKey(Load, matcher.key, loader)
+    _match.toSegment = getattr(matcher, 'toSegment', None)
+    return _match
+
+
+
+def _splitComponents(components):
+    """
+    Normalise route components.
+
+    As a convenience, a single `bytes` component containing ``/`` is split into
+    separate components.
+
+    :type  components: ``sequence`` of `bytes` or `callable`
+    :param components: Route components.
+
+    :rtype: ``sequence`` of `bytes` or `callable`
+    :return: Route components.
     """
     if len(components) == 1 and isinstance(components[0], bytes):
         components = components[0]
         if components[:1] == '/':
             components = components[1:]
         components = components.split('/')
+    return components
 
-    results = OrderedDict()
-    NO_MATCH = None, segments
-    remaining = list(segments)
 
-    # Handle the null route.
-    if len(segments) == len(components) == 0:
-        return results, remaining
 
-    for us, them in izip_longest(components, segments):
-        if us is None:
-            if partialMatching:
-                # We've matched all of our components, there might be more
-                # segments for something else to process.
-                break
-            else:
-                return NO_MATCH
-        elif them is None:
-            # We've run out of path segments to match, so this route can't be
-            # the matching one.
-            return NO_MATCH
-
-        if callable(us):
-            name, match = us(request, them)
+def _normaliseMethods(methods):
+    """
+    Normalise the HTTP methods a route matches.
+
+    :type  methods: `bytes` or ``iterable`` of `bytes`
+    :param methods: A single method, or methods.
+
+    :rtype: `frozenset` of `bytes`
+    :return: Methods, including ``HEAD`` if ``GET`` is included; or ``None``
+        if ``methods`` is ``None``.
+    """
+    if methods is None:
+        return None
+    if isinstance(methods, bytes):
+        methods = [methods]
+    methods = frozenset(method.upper() for method in methods)
+    if b'GET' in methods:
+        methods |= frozenset([b'HEAD'])
+    return methods
+
+
+
+def _routeOptions(kwargs):
+    """
+    Extract the keyword arguments supported by `route` and `subroute`.
+
+    :rtype: `dict`
+    """
+    methods = kwargs.pop('methods', None)
+    if kwargs:
+        raise TypeError(
+            'Unexpected keyword arguments: %s' % (', '.join(sorted(kwargs)),))
+    return dict(methods=methods)
+
+
+
+class _RouteMatcher(object):
+    """
+    Compiled route matcher, as produced by `route` and `subroute`.
+
+    Route components are normalised and separated into literal and parameter
+    components when the route is declared, matching a request path does no
+    parsing and only allocates the parameter results it returns.
+
+    :ivar components: `tuple` of route components.
+
+    :ivar partialMatching: Allow partial matching against the request path?
+
+    :ivar arity: Number of route components, not counting a final `Rest`
+        component.
+
+    :ivar rest: Final `Rest` component, or ``None``.
+
+    :ivar open: Can more segments than ``arity`` be matched?
+
+    :ivar methods: `frozenset` of the HTTP methods the route matches, or
+        ``None`` if it matches any method.
+    """
+    def __init__(self, components, partialMatching, methods=None):
+        """
+        :type  components: ``iterable`` of `bytes` or `callable`
+        :param components: Iterable of path components, to match against the
+            request, either static strings or dynamic parameters. As
+            a convenience, a single `bytes` component containing ``/`` may be
+            given instead of manually separating the components. If no
+            components are given the null route is matched, this is the case
+            where ``segments`` is empty.
+
+        :type  partialMatching: `bool`
+        :param partialMatching: Allow partial matching against the request
+            path?
+
+        :type  methods: `bytes` or ``iterable`` of `bytes`
+        :param methods: HTTP method, or methods, to match, ``HEAD`` is implied
+            by ``GET``; or ``None`` to match any method.
+        """
+        self.components = tuple(_splitComponents(components))
+        self.partialMatching = partialMatching
+        self.methods = _normaliseMethods(methods)
+        self.arity = len(self.components)
+        self.rest = None
+        for i, component in enumerate(self.components):
+            if getattr(component, 'rest', False):
+                if i != self.arity - 1:
+                    raise ValueError(
+                        'Only the last route component may match the rest of '
+                        'the path')
+                self.rest = component
+                self.arity -= 1
+        self.open = partialMatching or self.rest is not None
+        fixed = self.components[:self.arity]
+        self._literals = tuple(
+            (i, c) for i, c in enumerate(fixed) if not callable(c))
+        self._parameters = tuple(
+            (i, c) for i, c in enumerate(fixed) if callable(c))
+
+
+    def __call__(self, request, segments):
+        """
+        Match a request path against our path components.
+
+        The path components are always matched relative to their parent is in
+        the resource hierarchy, in other words it is only possible to match
+        URIs nested more deeply than the parent resource.
+
+        :type  segments: ``sequence`` of `bytes`
+        :param segments: Sequence of path segments, from the request, to match
+            against.
+
+        :rtype: 2-`tuple` of `dict` keyed on `bytes` and `list` of `bytes`
+        :return: Pair of parameter results, mapping parameter names to
+            processed values, and a list of the remaining request path
+            segments. If there is no route match the result will be ``None``
+            and the original request path segments.
+        """
+        arity = self.arity
+        count = len(segments)
+        if count < arity or (count > arity and not self.open):
+            return None, segments
+        if self.methods is not None and request.method not in self.methods:
+            return None, segments
+
+        for i, literal in self._literals:
+            if segments[i] != literal:
+                return None, segments
+
+        results = OrderedDict()
+        for i, matcher in self._parameters:
+            name, match = matcher(request, segments[i])
             if match is None:
-                return NO_MATCH
+                return None, segments
             results[name] = match
-        elif us != them:
-            return NO_MATCH
-        remaining.pop(0)
-
-    return results, remaining
+        if self.rest is not None:
+            name, match = self.rest(request, segments[arity:])
+            if match is None:
+                return None, segments
+            results[name] = match
+            return results, []
+        return results, list(segments[arity:])
 
 
 
-def route(*components):
+def route(*components, **kwargs):
     """
     Match a request path exactly.
 
@@ -163,17 +572,25 @@ def route(*components):
         manually separating the components. If no components are given the null
         route is matched, this is the case where ``segments`` is empty.
 
-    :rtype: 2-`tuple` of `dict` keyed on `bytes` and `list` of `bytes`
-    :return: Pair of parameter results, mapping parameter names to processed
-        values, and a list of the remaining request path segments. If there is
-        no route match the result will be ``None`` and the original request
-        path segments.
+    :type  methods: `bytes` or ``iterable`` of `bytes`
+    :param methods: HTTP method, or methods, the route matches, ``HEAD`` is
+        implied by ``GET``; or ``None``, the default, to match any method.
+        Requests for a path that is only matched by routes for other methods
+        result in ``405 Method Not Allowed``.
+
+    :rtype: `callable`
+    :return: Compiled matcher that, given a request and a sequence of request
+        path segments, produces a pair of parameter results, mapping parameter
+        names to processed values, and a list of the remaining request path
+        segments. If there is no route match the result will be ``None`` and
+        the original request path segments.
     """
-    return partial(_matchRoute, components, partialMatching=False)
+    return _RouteMatcher(
+        components, partialMatching=False, **_routeOptions(kwargs))
 
 
 
-def subroute(*components):
+def subroute(*components, **kwargs):
     """
     Partially match a request path exactly.
 
@@ -192,13 +609,989 @@ def subroute(*components):
         manually separating the components. If no components are given the null
         route is matched, this is the case where ``segments`` is empty.
 
-    :rtype: 2-`tuple` of `dict` keyed on `bytes` and `list` of `bytes`
-    :return: Pair of parameter results, mapping parameter names to processed
-        values, and a list of the remaining request path segments. If there is
-        no route match the result will be ``None`` and the original request
-        path segments.
+    :type  methods: `bytes` or ``iterable`` of `bytes`
+    :param methods: HTTP method, or methods, the route matches, ``HEAD`` is
+        implied by ``GET``; or ``None``, the default, to match any method.
+        Requests for a path that is only matched by routes for other methods
+        result in ``405 Method Not Allowed``.
+
+    :rtype: `callable`
+    :return: Compiled matcher that, given a request and a sequence of request
+        path segments, produces a pair of parameter results, mapping parameter
+        names to processed values, and a list of the remaining request path
+        segments. If there is no route match the result will be ``None`` and
+        the original request path segments.
+    """
+    return _RouteMatcher(
+        components, partialMatching=True, **_routeOptions(kwargs))
+
+
+
+class _RouteNode(object):
+    """
+    Node in a `_RouteTrie`.
+
+    :ivar literals: Mapping of literal segments to child nodes.
+
+    :ivar matchers: List of 2-tuples of a matcher callable and a child node,
+        ordered by the lowest route index reachable through the child.
+
+    :ivar exact: Lowest index of a route, ending at this node, that matches
+        only if there are no further segments; or ``None``.
+
+    :ivar partial: Lowest index of a route, ending at this node, that matches
+        regardless of further segments; or ``None``.
+
+    :ivar rests: List of 2-tuples of a `Rest` matcher and the index of the
+        route, ending at this node, that it matches the remaining segments
+        for; ordered by route index.
+
+    :ivar minIndex: Lowest index of any route ending at or below this node.
+    """
+    __slots__ = ['literals', 'matchers', 'exact', 'partial', 'rests',
+                 'minIndex']
+
+    def __init__(self):
+        self.literals = {}
+        self.matchers = []
+        self.exact = None
+        self.partial = None
+        self.rests = []
+        self.minIndex = None
+
+
+    def _child(self, component, edges):
+        """
+        Get or create the child node for a route component.
+
+        :type  edges: `dict`
+        :param edges: Mapping of node identities and component keys, see
+            `_componentKey`, to the child nodes of matcher edges, used to find
+            existing edges while building a trie.
+        """
+        if callable(component):
+            key = id(self), _componentKey(component)
+            node = edges.get(key)
+            if node is None:
+                node = edges[key] = _RouteNode()
+                self.matchers.append((component, node))
+            return node
+        node = self.literals.get(component)
+        if node is None:
+            node = self.literals[component] = _RouteNode()
+        return node
+
+
+    def _finalize(self):
+        """
+        Compute the lowest reachable route index for this node, and its
+        children, and order the matcher edges by it.
+        """
+        indices = [i for i in (self.exact, self.partial) if i is not None]
+        indices.extend(index for matcher, index in self.rests)
+        for node in self.literals.itervalues():
+            indices.append(node._finalize())
+        for matcher, node in self.matchers:
+            indices.append(node._finalize())
+        self.matchers.sort(key=lambda edge: edge[1].minIndex)
+        self.minIndex = min(indices)
+        return self.minIndex
+
+
+
+class _RouteTrie(object):
+    """
+    Compiled dispatcher for a collection of routes.
+
+    Literal route components become dictionary lookups while callable
+    components are ordered edges, tried in order of the routes that declared
+    them. Routes that share a literal prefix are only matched against that
+    prefix once, and whole subtrees that cannot beat an existing match are
+    never visited. The first declared matching route always wins, exactly as
+    if every route was tried in turn.
+    """
+    def __init__(self, routes):
+        """
+        :type  routes: `list` of 3-`tuple` containing `bytes`, `callable`,
+            `callable`
+        :param routes: List of 3-tuple containing the route handler name, the
+            route handler function and the `_RouteMatcher`, as produced by
+            `route` or `subroute`.
+        """
+        self.routes = tuple(routes)
+        self._root = _RouteNode()
+        edges = {}
+        for index, (name, meth, matcher) in enumerate(self.routes):
+            node = self._root
+            for component in matcher.components[:matcher.arity]:
+                node = node._child(component, edges)
+            if matcher.rest is not None:
+                node.rests.append((matcher.rest, index))
+            elif matcher.partialMatching:
+                if node.partial is None:
+                    node.partial = index
+            elif node.exact is None:
+                node.exact = index
+        if self.routes:
+            self._root._finalize()
+
+
+    def _search(self, node, request, segments, depth, params, best):
+        """
+        Find the lowest indexed route, beneath ``node``, that is a better match
+        than ``best``.
+
+        :return: 3-tuple of route index, parameter pairs and depth of the
+            match; or ``best`` if there is no better match.
+        """
+        if node.partial is not None and (
+                best is None or node.partial < best[0]):
+            best = node.partial, params, depth
+        for matcher, index in node.rests:
+            if best is not None and index >= best[0]:
+                break
+            name, match = matcher(request, segments[depth:])
+            if match is not None:
+                best = index, params + ((name, match),), len(segments)
+                break
+        if depth == len(segments):
+            if node.exact is not None and (
+                    best is None or node.exact < best[0]):
+                best = node.exact, params, depth
+            return best
+
+        segment = segments[depth]
+        child = node.literals.get(segment)
+        if child is not None and (best is None or child.minIndex < best[0]):
+            best = self._search(
+                child, request, segments, depth + 1, params, best)
+        for matcher, child in node.matchers:
+            if best is not None and child.minIndex >= best[0]:
+                # Matchers are ordered by their lowest route index, nothing
+                # that follows can beat the match we already have.
+                break
+            name, match = matcher(request, segment)
+            if match is not None:
+                best = self._search(
+                    child, request, segments, depth + 1,
+                    params + ((name, match),), best)
+        return best
+
+
+    def match(self, request, segments):
+        """
+        Match a request path against the routes.
+
+        :type  segments: ``sequence`` of `bytes`
+        :param segments: Sequence of path segments, from the request, to match
+            against.
+
+        :rtype: 3-`tuple` of `int`, `OrderedDict` and `list` of `bytes`
+        :return: Index of the matching route, the parameter results and the
+            remaining request path segments; or ``None`` if there is no match.
+        """
+        if not self.routes:
+            return None
+        best = self._search(self._root, request, segments, 0, (), None)
+        if best is None:
+            return None
+        index, params, depth = best
+        return index, OrderedDict(params), list(segments[depth:])
+
+
+    def allowedMethods(self, request, segments):
+        """
+        Find the HTTP methods for which some route matches a request path that
+        did not match for the request's method.
+
+        :rtype: `tuple` of `bytes`
+        :return: Allowed methods, or ``None`` if the path matches no route for
+            any method.
+        """
+        return None
+
+
+
+# Version of the generated dispatcher source, part of the on-disk cache key.
+_GENERATOR_VERSION = 1
+
+# Literal fan-out beyond which a node dispatches to its children via a dict.
+_MAX_INLINE_LITERALS = 8
+
+# Nesting depth beyond which a subtree is generated as a separate function.
+_MAX_INLINE_DEPTH = 24
+
+
+
+def _routeConstants(routes):
+    """
+    Collect the matchers and non-text literals of some routes, in order of
+    their first appearance; only the first of equivalent matchers is
+    collected.
+
+    :rtype: 2-`tuple` of `list`
+    :return: Matchers and literals referenced by generated dispatcher source.
+    """
+    matchers, literals = [], []
+    seen = set()
+    for name, meth, matcher in routes:
+        for component in matcher.components:
+            if callable(component):
+                key = _componentKey(component)
+                if key not in seen:
+                    seen.add(key)
+                    matchers.append(component)
+            elif not isinstance(component, (bytes, unicode)):
+                if component not in literals:
+                    literals.append(component)
+    return matchers, literals
+
+
+
+class _DispatcherSource(object):
+    """
+    Generate Python source for a function that dispatches the routes in
+    a `_RouteTrie`.
+
+    The generated ``dispatch`` function behaves exactly like
+    `_RouteTrie.match`, the trie search is unrolled into nested ``if``
+    statements on literal segments with inline calls to parameter matchers.
+    Matchers and literals that cannot be written as source are referenced, by
+    index, via the ``_m`` and ``_l`` globals.
+    """
+    def __init__(self, trie):
+        self._trie = trie
+        self._matchers, self._literals = _routeConstants(trie.routes)
+        self._matcherIndices = dict(
+            (_componentKey(matcher), i)
+            for i, matcher in enumerate(self._matchers))
+        self._functions = []
+        self._counter = 0
+
+
+    def _name(self, prefix):
+        """
+        Generate a unique name.
+        """
+        self._counter += 1
+        return '%s%d' % (prefix, self._counter)
+
+
+    def _literal(self, value):
+        """
+        Source expression for a literal component.
+        """
+        if isinstance(value, (bytes, unicode)):
+            return repr(value)
+        return '_l[%d]' % (self._literals.index(value),)
+
+
+    def _matcher(self, value):
+        """
+        Source expression for a matcher component.
+        """
+        return '_m[%d]' % (self._matcherIndices[_componentKey(value)],)
+
+
+    def _function(self, node, depth):
+        """
+        Generate a function for the subtree rooted at ``node``.
+
+        :return: Name of the function.
+        """
+        name = self._name('_n')
+        lines = [
+            'def %s(request, segments, n, b, p, d, q):' % (name,),
+            '    if %d >= b:' % (node.minIndex,),
+            '        return b, p, d']
+        self._node(lines, node, depth, [], 1)
+        lines.append('    return b, p, d')
+        self._functions.append('\n'.join(lines))
+        return name
+
+
+    def _node(self, lines, node, depth, params, indent):
+        """
+        Generate the body for matching ``node``.
+
+        :param params: `list` of 2-tuples of local variable names for
+            parameter names and values bound so far in this function.
+        """
+        pad = '    ' * indent
+        if params:
+            paramsExpr = 'q + (%s,)' % (
+                ', '.join('(%s, %s)' % pair for pair in params),)
+        else:
+            paramsExpr = 'q'
+
+        if node.partial is not None:
+            lines.append('%sif %d < b:' % (pad, node.partial))
+            lines.append('%s    b, p, d = %d, %s, %d' % (
+                pad, node.partial, paramsExpr, depth))
+        for matcher, index in node.rests:
+            key, value = self._name('k'), self._name('v')
+            lines.append('%sif %d < b:' % (pad, index))
+            lines.append('%s    %s, %s = %s(request, segments[%d:])' % (
+                pad, key, value, self._matcher(matcher), depth))
+            lines.append('%s    if %s is not None:' % (pad, value))
+            lines.append('%s        b, p, d = %d, %s + ((%s, %s),), n' % (
+                pad, index, paramsExpr, key, value))
+        if node.exact is not None:
+            lines.append('%sif n == %d and %d < b:' % (
+                pad, depth, node.exact))
+            lines.append('%s    b, p, d = %d, %s, %d' % (
+                pad, node.exact, paramsExpr, depth))
+        if not node.literals and not node.matchers:
+            return
+
+        segment = 's%d' % (depth,)
+        lines.append('%s%s = segments[%d] if n > %d else None' % (
+            pad, segment, depth, depth))
+
+        literals = sorted(
+            node.literals.iteritems(), key=lambda item: item[1].minIndex)
+        if len(literals) > _MAX_INLINE_LITERALS:
+            table = self._name('_t')
+            self._functions.append('%s = {%s}' % (
+                table,
+                ', '.join('%s: %s' % (
+                    self._literal(literal),
+                    self._function(child, depth + 1))
+                          for literal, child in literals)))
+            f = self._name('f')
+            lines.append('%s%s = %s.get(%s)' % (pad, f, table, segment))
+            lines.append('%sif %s is not None:' % (pad, f))
+            lines.append(
+                '%s    b, p, d = %s(request, segments, n, b, p, d, %s)' % (
+                    pad, f, paramsExpr))
+        else:
+            keyword = 'if'
+            for literal, child in literals:
+                lines.append('%s%s %s == %s and %d < b:' % (
+                    pad, keyword, segment, self._literal(literal),
+                    child.minIndex))
+                self._child(lines, child, depth + 1, params, indent + 1)
+                keyword = 'elif'
+
+        for matcher, child in node.matchers:
+            key, value = self._name('k'), self._name('v')
+            lines.append('%sif %s is not None and %d < b:' % (
+                pad, segment, child.minIndex))
+            lines.append('%s    %s, %s = %s(request, %s)' % (
+                pad, key, value, self._matcher(matcher), segment))
+            lines.append('%s    if %s is not None:' % (pad, value))
+            self._child(
+                lines, child, depth + 1, params + [(key, value)], indent + 2)
+
+
+    def _child(self, lines, node, depth, params, indent):
+        """
+        Generate the code for a child node, either inline or as a call to
+        a separate function if the code is already deeply nested.
+        """
+        if indent < _MAX_INLINE_DEPTH:
+            self._node(lines, node, depth, params, indent)
+            return
+        if params:
+            paramsExpr = 'q + (%s,)' % (
+                ', '.join('(%s, %s)' % pair for pair in params),)
+        else:
+            paramsExpr = 'q'
+        lines.append(
+            '%sb, p, d = %s(request, segments, n, b, p, d, %s)' % (
+                '    ' * indent, self._function(node, depth), paramsExpr))
+
+
+    def generate(self):
+        """
+        Generate the dispatcher source.
+
+        :rtype: `bytes`
+        :return: Python source defining ``dispatch``.
+        """
+        if not self._trie.routes:
+            return 'def dispatch(request, segments):\n    return None\n'
+        count = len(self._trie.routes)
+        root = self._function(self._trie._root, 0)
+        self._functions.append('\n'.join([
+            'def dispatch(request, segments):',
+            '    b, p, d = %s(request, segments, len(segments), %d, (), 0, ())'
+            % (root, count),
+            '    if b == %d:' % (count,),
+            '        return None',
+            '    return b, OrderedDict(p), list(segments[d:])']))
+        return '\n\n'.join(self._functions) + '\n'
+
+
+
+def _routeFingerprint(routes):
+    """
+    Compute a key that uniquely identifies the structure of some routes, and
+    therefore the dispatcher source generated for them.
+    """
+    matchers, literals = _routeConstants(routes)
+    matcherIndices = dict(
+        (_componentKey(matcher), i) for i, matcher in enumerate(matchers))
+    structure = []
+    for name, meth, matcher in routes:
+        components = []
+        for component in matcher.components:
+            if callable(component):
+                components.append(
+                    ('r' if component is matcher.rest else 'm',
+                     matcherIndices[_componentKey(component)]))
+            elif isinstance(component, (bytes, unicode)):
+                components.append(('s', component))
+            else:
+                components.append(('l', literals.index(component)))
+        structure.append((matcher.partialMatching, components))
+    return sha1(repr(
+        (_GENERATOR_VERSION, imp.get_magic(), structure))).hexdigest()
+
+
+
+class _GeneratedDispatcher(object):
+    """
+    Route dispatcher using generated Python source.
+
+    A drop-in replacement for `_RouteTrie` that trades some one-off
+    generation and compilation time for faster route matching, most useful
+    for very large routers.
+
+    :ivar routes: `tuple` of routes.
+    """
+    def __init__(self, trie, cacheDirectory=None):
+        """
+        :type  trie: `_RouteTrie`
+        :param trie: Compiled routes to generate a dispatcher for.
+
+        :type  cacheDirectory: `bytes`
+        :param cacheDirectory: Path to a directory in which to cache the
+            compiled dispatcher code, or ``None`` to disable caching.
+        """
+        self.routes = trie.routes
+        matchers, literals = _routeConstants(self.routes)
+        namespace = {'_m': matchers, '_l': literals,
+                     'OrderedDict': OrderedDict}
+        exec self._code(trie, cacheDirectory) in namespace
+        self.match = namespace['dispatch']
+
+
+    def _code(self, trie, cacheDirectory):
+        """
+        Load the compiled dispatcher code from the cache, or generate and
+        compile it.
+
+        Failing to write the cache is logged, the compiled code is still used.
+        """
+        if cacheDirectory is None:
+            return compile(
+                _DispatcherSource(trie).generate(), '<txspinneret>', 'exec')
+
+        path = os.path.join(
+            cacheDirectory,
+            'txspinneret-dispatch-%s.bin' % (_routeFingerprint(self.routes),))
+        try:
+            with open(path, 'rb') as f:
+                return marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+
+        code = compile(_DispatcherSource(trie).generate(), path, 'exec')
+        temporaryPath = '%s.%d' % (path, os.getpid())
+        try:
+            with open(temporaryPath, 'wb') as f:
+                marshal.dump(code, f)
+            os.rename(temporaryPath, path)
+        except (IOError, OSError):
+            log.err(None, 'Failed to cache generated dispatcher code')
+        return code
+
+
+    def allowedMethods(self, request, segments):
+        """
+        See `_RouteTrie.allowedMethods`.
+        """
+        return None
+
+
+
+def _couldMatch(matcher, request, segments):
+    """
+    Could a route matcher match a request path, for any HTTP method?
+
+    Parameter matchers that do not declare themselves pure, by having a true
+    ``pure`` attribute, are never called and are assumed to match; they may
+    have side effects, such as loading objects.
+    """
+    arity = matcher.arity
+    count = len(segments)
+    if count < arity or (count > arity and not matcher.open):
+        return False
+    for i, literal in matcher._literals:
+        if segments[i] != literal:
+            return False
+    for i, parameter in matcher._parameters:
+        if getattr(parameter, 'pure', False):
+            if parameter(request, segments[i])[1] is None:
+                return False
+    rest = matcher.rest
+    if rest is not None and getattr(rest, 'pure', False):
+        if rest(request, segments[arity:])[1] is None:
+            return False
+    return True
+
+
+
+class _MethodRouteTable(object):
+    """
+    Route table for routes restricted to particular HTTP methods.
+
+    A separate table is compiled for every HTTP method that routes are
+    declared for, containing only the routes that match that method, and
+    another for the routes that match any method. Matching a request path is
+    a single lookup of the table for the request method, requests for other
+    methods never reach the route matchers of method-restricted routes.
+
+    :ivar routes: `tuple` of routes.
+
+    :ivar methods: `frozenset` of the HTTP methods routes are declared for.
+    """
+    def __init__(self, routes, compileRoutes):
+        """
+        :type  routes: ``sequence`` of routes
+        :param routes: Routes, in priority order.
+
+        :type  compileRoutes: ``callable``
+        :param compileRoutes: Callable taking a `list` of routes and returning
+            a compiled route table for them, such as `_RouteTrie`.
+        """
+        self.routes = tuple(routes)
+        self.methods = frozenset()
+        for name, meth, matcher in self.routes:
+            if matcher.methods is not None:
+                self.methods |= matcher.methods
+
+        def _table(method):
+            indices = tuple(
+                i for i, (name, meth, matcher) in enumerate(self.routes)
+                if matcher.methods is None or method in matcher.methods)
+            return compileRoutes([self.routes[i] for i in indices]), indices
+        self._tables = dict(
+            (method, _table(method)) for method in self.methods)
+        self._default = _table(None)
+
+        shapes = OrderedDict()
+        for name, meth, matcher in self.routes:
+            if matcher.methods is not None:
+                key = matcher.components, matcher.open
+                shapes.setdefault(key, (matcher, set()))[1].update(
+                    matcher.methods)
+        self._allowed = tuple(
+            (matcher, frozenset(methods))
+            for matcher, methods in shapes.itervalues())
+
+
+    def match(self, request, segments):
+        """
+        See `_RouteTrie.match`.
+        """
+        table, indices = self._tables.get(request.method, self._default)
+        result = table.match(request, segments)
+        if result is None:
+            return None
+        index, params, remaining = result
+        return indices[index], params, remaining
+
+
+    def allowedMethods(self, request, segments):
+        """
+        See `_RouteTrie.allowedMethods`.
+
+        The allowed methods of routes with the same components are combined
+        when the table is compiled, and only pure parameter matchers are
+        called to decide whether a route could match the path.
+        """
+        allowed = set()
+        for matcher, methods in self._allowed:
+            if _couldMatch(matcher, request, segments):
+                allowed.update(methods)
+        allowed.discard(request.method)
+        return tuple(sorted(allowed)) or None
+
+
+
+class _CachingRouteTable(object):
+    """
+    Route table that caches match results in an `LRUCache`.
+
+    Results are keyed on the request path segments, the ``Content-Type``
+    charset if there are parameter matchers and the request method if there
+    are method-restricted routes, and are only cached if every
+    matcher declares itself pure, by having a true ``pure`` attribute, meaning
+    its result depends on nothing but the segment value and the charset.
+
+    :ivar routes: `tuple` of routes.
+    """
+    def __init__(self, table, cache):
+        """
+        :type  table: `_RouteTrie` or `_GeneratedDispatcher`
+        :param table: Compiled routes.
+
+        :type  cache: `LRUCache`
+        :param cache: Cache to store match results in.
+        """
+        self.routes = table.routes
+        self._table = table
+        self._cache = cache
+        matchers, literals = _routeConstants(self.routes)
+        self._cacheable = all(getattr(m, 'pure', False) for m in matchers)
+        self._charsetKeyed = bool(matchers)
+        self._methodKeyed = bool(getattr(table, 'methods', None))
+        self.allowedMethods = table.allowedMethods
+
+
+    def match(self, request, segments):
+        """
+        See `_RouteTrie.match`.
+        """
+        if not self._cacheable:
+            return self._table.match(request, segments)
+        key = tuple(segments)
+        if self._charsetKeyed:
+            key = key, contentEncoding(request.requestHeaders)
+        if self._methodKeyed:
+            key = key, request.method
+        result = self._cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = self._table.match(request, segments)
+            self._cache.set(key, result)
+        if result is None:
+            return None
+        # Copy the results, handlers are free to modify them, including the
+        # lists of segments matched by `Rest`.
+        index, params, remaining = result
+        params = OrderedDict(
+            (name, list(value) if isinstance(value, list) else value)
+            for name, value in params.iteritems())
+        return index, params, list(remaining)
+
+
+
+def _covers(first, second):
+    """
+    Can it be proven that the route matcher ``first`` matches every path that
+    the route matcher ``second`` matches?
+    """
+    if first.rest is not None and not getattr(first.rest, 'matchesAll', False):
+        return False
+    if first.methods is not None and (
+            second.methods is None or not second.methods <= first.methods):
+        return False
+    if first.open:
+        if second.arity < first.arity:
+            return False
+    elif second.open or second.arity != first.arity:
+        return False
+    for ours, theirs in zip(first.components[:first.arity],
+                            second.components[:second.arity]):
+        if ours is theirs or (callable(ours) and callable(theirs) and
+                              _componentKey(ours) == _componentKey(theirs)):
+            continue
+        if callable(ours):
+            if not getattr(ours, 'matchesAll', False):
+                return False
+        elif callable(theirs) or ours != theirs:
+            return False
+    return True
+
+
+
+def _disjoint(first, second):
+    """
+    Can it be proven that no path is matched by both route matchers?
+    """
+    if (first.methods is not None and second.methods is not None and
+            not first.methods & second.methods):
+        return True
+    for ours, theirs in zip(first.components[:first.arity],
+                            second.components[:second.arity]):
+        if not callable(ours) and not callable(theirs) and ours != theirs:
+            return True
+    if first.open and second.open:
+        return False
+    if first.open:
+        return second.arity < first.arity
+    if second.open:
+        return first.arity < second.arity
+    return first.arity != second.arity
+
+
+
+def findShadowedRoutes(router):
+    """
+    Find routes that can never match because a route declared before them
+    matches every path they do.
+
+    A parameter matcher is assumed to match any segment if it has a true
+    ``matchesAll`` attribute, as `Text` does.
+
+    :type  router: `Router`
+    :param router: Router to analyze, either accessed through its class or
+        bound to an instance.
+
+    :rtype: `list` of 2-`tuple` of 2-`tuple` of `bytes` and `tuple`
+    :return: Pairs of the shadowed route and the route shadowing it, each
+        route is described by its handler name and its route components.
+    """
+    if isinstance(router, _BoundRouter):
+        router = router._router
+    routes = router._routes
+    shadowed = []
+    for i, (name, meth, matcher) in enumerate(routes):
+        for earlierName, earlierMeth, earlier in routes[:i]:
+            if _covers(earlier, matcher):
+                shadowed.append(
+                    ((name, matcher.components),
+                     (earlierName, earlier.components)))
+                break
+    return shadowed
+
+
+
+def _prioritiseRoutes(routes, hits):
+    """
+    Order routes so that the routes with the most hits are tried first,
+    without changing which route matches any path.
+
+    A route only moves ahead of another route if it can be proven that no path
+    is matched by both, so the relative order of routes that may match the
+    same path is preserved.
+
+    :type  routes: ``sequence`` of routes
+    :param routes: Routes in declaration order.
+
+    :type  hits: `list` of `int`
+    :param hits: Number of hits for each route.
+
+    :rtype: `list` of `int`
+    :return: Indices of the routes in priority order.
+    """
+    order = []
+    for i, (name, meth, matcher) in enumerate(routes):
+        position = len(order)
+        while position > 0:
+            j = order[position - 1]
+            if hits[j] >= hits[i] or not _disjoint(routes[j][2], matcher):
+                break
+            position -= 1
+        order.insert(position, i)
+    return order
+
+
+
+class RouteStatistics(object):
+    """
+    Route usage statistics, indexed by the declaration order of the routes.
+
+    :ivar lookups: Number of route lookups.
+
+    :ivar hits: `list` of the number of lookups that each route matched.
+
+    :ivar attempts: `list` of the number of calls to each route's parameter
+        matchers.
+
+    :ivar matcherCalls: Total number of calls to parameter matchers.
     """
-    return partial(_matchRoute, components, partialMatching=True)
+    def __init__(self, count):
+        self.lookups = 0
+        self.hits = [0] * count
+        self.attempts = [0] * count
+        self.matcherCalls = 0
+
+
+    def _countingRoutes(self, routes, order):
+        """
+        Replace the parameter matchers of some routes with ones that count
+        their calls.
+
+        :param routes: Routes in declaration order.
+
+        :param order: Indices of the routes in priority order.
+
+        :return: Routes, in priority order, with counting matchers.
+        """
+        users, matchers = {}, {}
+        for i, (name, meth, matcher) in enumerate(routes):
+            for component in matcher.components:
+                if callable(component):
+                    key = _componentKey(component)
+                    matchers.setdefault(key, component)
+                    users.setdefault(key, set()).add(i)
+        counting = {}
+        for key, indices in users.iteritems():
+            counting[key] = self._countingMatcher(
+                matchers[key], sorted(indices))
+
+        result = []
+        for i in order:
+            name, meth, matcher = routes[i]
+            components = [counting[_componentKey(c)] if callable(c) else c
+                          for c in matcher.components]
+            result.append(
+                (name, meth,
+                 _RouteMatcher(
+                     components, matcher.partialMatching, matcher.methods)))
+        return result
+
+
+    def _countingMatcher(self, matcher, indices):
+        """
+        Wrap a matcher to count calls to it on behalf of each route in
+        ``indices``.
+        """
+        attempts = self.attempts
+        def _match(request, value):
+            self.matcherCalls += 1
+            for i in indices:
+                attempts[i] += 1
+            return matcher(request, value)
+        _match.pure = getattr(matcher, 'pure', False)
+        _match.matchesAll = getattr(matcher, 'matchesAll', False)
+        _match.rest = getattr(matcher, 'rest', False)
+        return _match
+
+
+
+class _ProfilingRouteTable(object):
+    """
+    Route table that records `RouteStatistics`.
+
+    :ivar routes: `tuple` of routes.
+    """
+    def __init__(self, table, statistics, order, lookupCallback=None):
+        """
+        :type  table: `_RouteTrie`, `_GeneratedDispatcher` or
+            `_CachingRouteTable`
+        :param table: Compiled routes, in priority order.
+
+        :type  statistics: `RouteStatistics`
+        :param statistics: Statistics to record.
+
+        :type  order: `list` of `int`
+        :param order: Declaration indices of the routes in ``table``.
+
+        :param lookupCallback: Callable invoked after every lookup, or
+            ``None``.
+        """
+        self.routes = table.routes
+        self.allowedMethods = table.allowedMethods
+        self._table = table
+        self._statistics = statistics
+        self._order = order
+        self._lookupCallback = lookupCallback
+
+
+    def match(self, request, segments):
+        """
+        See `_RouteTrie.match`.
+        """
+        result = self._table.match(request, segments)
+        statistics = self._statistics
+        statistics.lookups += 1
+        if result is not None:
+            statistics.hits[self._order[result[0]]] += 1
+        if self._lookupCallback is not None:
+            self._lookupCallback()
+        return result
+
+
+
+class _RouteFilter(object):
+    """
+    Filter that cheaply rejects paths that no route can match.
+
+    The set of literal first components and the longest path that any route
+    can match are computed from the routes. A path whose first segment is not
+    one of those literals, or that is too long, cannot match any route and is
+    rejected without searching the routes. The filter is disabled by routes
+    whose first component is a parameter matcher or that match any path.
+    """
+    __slots__ = ['_first', '_maxLength']
+
+    def __init__(self, routes):
+        """
+        :type  routes: ``sequence`` of routes
+        :param routes: Routes to filter paths for.
+        """
+        first = set()
+        maxLength = 0
+        for name, meth, matcher in routes:
+            if matcher.open:
+                maxLength = None
+            elif maxLength is not None:
+                maxLength = max(maxLength, matcher.arity)
+            if first is None or (matcher.arity == 0 and not matcher.open):
+                continue
+            component = matcher.components[0] if matcher.arity else None
+            if isinstance(component, (bytes, unicode)):
+                first.add(component)
+            else:
+                first = None
+        self._first = None if first is None else frozenset(first)
+        self._maxLength = maxLength
+
+
+    def rejects(self, segment, length):
+        """
+        Can it be proven that no route matches a path?
+
+        :type  segment: `bytes`
+        :param segment: First segment of the path.
+
+        :type  length: `int`
+        :param length: Number of segments in the path, at least one.
+
+        :rtype: `bool`
+        """
+        if self._maxLength is not None and length > self._maxLength:
+            return True
+        return self._first is not None and segment not in self._first
+
+
+
+# Shared, pre-rendered, page for paths that no route matches.
+_NOT_FOUND = _PrerenderedNotFound()
+
+
+
+def _resolveParameters(matches):
+    """
+    Wait for all of the `Deferred` route parameters to fire.
+
+    :type  matches: `OrderedDict`
+    :param matches: Route parameters, some of which are `Deferred`.
+
+    :rtype: `Deferred`
+    :return: Deferred that fires with the route parameters with their
+        resolved values, or ``None`` if any of them resolved to ``None``.
+    """
+    def _resolved(values):
+        for (name, _), value in zip(deferreds, values):
+            if value is None:
+                return None
+            matches[name] = value
+        return matches
+
+    def _failed(f):
+        f.trap(FirstError)
+        return f.value.subFailure
+
+    deferreds = [(name, value) for name, value in matches.iteritems()
+                 if isinstance(value, Deferred)]
+    d = gatherResults([value for _, value in deferreds], consumeErrors=True)
+    d.addCallbacks(_resolved, _failed)
+    return d
 
 
 
@@ -208,37 +1601,70 @@ class _RouterResource(object):
     Resource that provides URL routing to `IResource
     <twisted:twisted.web.resource.IResource>`.
     """
-    def __init__(self, obj, routes):
+    __slots__ = ['_obj', '_table', '_filter']
+
+    def __init__(self, obj, table, routeFilter):
         """
         :param obj: Parent object containing the route handler.
 
-        :type  routes: `list` of 3-`tuple` containing `bytes`, `callable`,
-            `callable`
-        :param routes: List of 3-tuple containing the route handler name, the
-            route handler function and the matcher function.
+        :type  table: `_RouteTrie`, `_GeneratedDispatcher` or
+            `_CachingRouteTable`
+        :param table: Compiled routes.
+
+        :type  routeFilter: `_RouteFilter`
+        :param routeFilter: Filter of paths that cannot match any route.
         """
         self._obj = obj
-        self._routes = routes
+        self._table = table
+        self._filter = routeFilter
 
 
     def _matchRoute(self, request, segments):
         """
         Find a route handler that matches the request path and invoke it.
+
+        If any of the route parameters are `Deferred`, such as those produced
+        by `Load`, the route handler is invoked once they have all fired and
+        the result is a `Deferred`.
         """
-        for name, meth, route in self._routes:
-            matches, remaining = route(request, segments)
-            if matches is not None:
-                return meth(self._obj, request, matches), remaining
-        return None, segments
+        if segments and self._filter.rejects(segments[0], len(segments)):
+            return _NOT_FOUND, []
+        result = self._table.match(request, segments)
+        if result is None:
+            allowedMethods = self._table.allowedMethods(request, segments)
+            if allowedMethods is not None:
+                return MethodNotAllowed(allowedMethods), []
+            return _NOT_FOUND, []
+        index, matches, remaining = result
+        name, meth, route = self._table.routes[index]
+        for value in matches.itervalues():
+            if isinstance(value, Deferred):
+                break
+        else:
+            return meth(self._obj, request, matches), remaining
+
+        def _resolved(matches):
+            if matches is None:
+                return _NOT_FOUND, []
+            return meth(self._obj, request, matches), remaining
+        d = _resolveParameters(matches)
+        d.addCallback(_resolved)
+        return d
 
 
     def render(self, request):
         # This only exists to handle the null route case, ie. there are no
         # segments so this resource's render method is invoked.
-        result, segments = self._matchRoute(request, [])
-        if result is None:
-            result = NotFound()
-        return result.render(request)
+        def _render(result):
+            result, segments = result
+            if result is None:
+                result = NotFound()
+            return result
+
+        result = self._matchRoute(request, [])
+        if isinstance(result, Deferred):
+            return result.addCallback(_render)
+        return _render(result).render(request)
 
 
     # ISpinneretResource
@@ -248,6 +1674,110 @@ class _RouterResource(object):
 
 
 
+# Characters, besides unreserved characters, allowed unquoted in a path
+# segment (RFC 3986.)
+_SEGMENT_SAFE = b"!$&'()*+,;=:@~"
+
+_SEGMENT_UNSAFE = re.compile(b"[^-A-Za-z0-9_.!$&'()*+,;=:@~]")
+
+
+
+def _quoteSegment(segment):
+    """
+    Quote a path segment for inclusion in a URL.
+
+    The dot segments ``.`` and ``..`` are percent-encoded too, so that they
+    are not removed, or resolved against the preceding segment, by clients.
+    """
+    if isinstance(segment, unicode):
+        segment = segment.encode('utf-8')
+    elif not isinstance(segment, bytes):
+        segment = bytes(segment)
+    if _SEGMENT_UNSAFE.search(segment) is None:
+        if segment == b'.' or segment == b'..':
+            return b'%2E' * len(segment)
+        return segment
+    return quote(segment, _SEGMENT_SAFE)
+
+
+
+def _inverse(component):
+    """
+    Get the parameter name and inverse conversion of a parameter matcher.
+
+    :raise ValueError: If the matcher has no inverse.
+    """
+    name = getattr(component, 'name', None)
+    toSegment = getattr(component, 'toSegment', None)
+    if name is None or toSegment is None:
+        raise ValueError(
+            'Route parameter %r cannot be reversed' % (component,))
+    return name, toSegment
+
+
+
+class _URLTemplate(object):
+    """
+    Precompiled template for generating the URL path matched by a route.
+
+    Literal route components are quoted once, when the template is compiled,
+    leaving only the conversion and quoting of the parameter values to be done
+    for each URL.
+
+    :ivar names: `frozenset` of the route's parameter names.
+    """
+    __slots__ = ['names', '_format', '_parameters', '_rest']
+
+    def __init__(self, matcher):
+        """
+        :type  matcher: `_RouteMatcher`
+        :param matcher: Route to compile a template for.
+
+        :raise ValueError: If any of the route parameters cannot be reversed.
+        """
+        parts = []
+        self._parameters = []
+        for component in matcher.components[:matcher.arity]:
+            if callable(component):
+                parts.append(b'%s')
+                self._parameters.append(_inverse(component))
+            else:
+                parts.append(_quoteSegment(component).replace(b'%', b'%%'))
+        self._format = b'/'.join(parts)
+        self._parameters = tuple(self._parameters)
+        self._rest = None
+        names = [name for name, toSegment in self._parameters]
+        if matcher.rest is not None:
+            self._rest = _inverse(matcher.rest)
+            names.append(self._rest[0])
+        self.names = frozenset(names)
+
+
+    def expand(self, params):
+        """
+        Generate the URL path for some route parameters.
+
+        :type  params: `dict`
+        :param params: Route parameter values, keyed by parameter name.
+
+        :rtype: `bytes`
+        """
+        path = self._format % tuple(
+            [_quoteSegment(toSegment(params[name]))
+             for name, toSegment in self._parameters])
+        if self._rest is None:
+            return path
+        name, toSegment = self._rest
+        rest = b'/'.join(
+            [_quoteSegment(toSegment(value)) for value in params[name]])
+        if not path:
+            return rest
+        if not rest:
+            return path
+        return path + b'/' + rest
+
+
+
 class Router(object):
     """
     URL routing.
@@ -267,22 +1797,139 @@ class Router(object):
     Route handlers can return any value supported by
     `ISpinneretResource.locateChild`.
 
-    Calling `Router.resource` will produce an `IResource
-    <twisted:twisted.web.resource.IResource>`.
+    Accessing a router via an instance binds it to that instance, calling
+    ``resource`` on the bound router will produce an `IResource
+    <twisted:twisted.web.resource.IResource>`. Routes are compiled once and
+    shared by every bound router.
+
+    Very large routers may opt in to having a specialised dispatch function
+    generated, and compiled, for their routes with ``generateCode``.
+
+    Routes can be profiled, with ``profile``, recording how often each route
+    matches and how often its parameter matchers are called in
+    `Router.statistics`. Calling `Router.prioritiseRoutes` tries the most
+    frequently matched routes first, wherever it can be proven that doing so
+    does not change which route matches any path; ``adaptive`` does this
+    periodically.
+
+    :ivar matchCache: `LRUCache` of route match results, its ``hits`` and
+        ``misses`` counters are useful for sizing it; or ``None`` if match
+        results are not cached.
+
+    :ivar statistics: `RouteStatistics` for the routes, or ``None`` if routes
+        are not being profiled.
+
+    :ivar adaptInterval: Number of lookups between route reprioritisation, for
+        adaptive routers.
     """
-    def __init__(self):
+    adaptInterval = 10000
+
+    def __init__(self, generateCode=False, cacheDirectory=None, cacheSize=0,
+                 profile=False, adaptive=False):
+        """
+        :type  generateCode: `bool`
+        :param generateCode: Generate Python source for a function that
+            dispatches the routes instead of searching the compiled routes?
+
+        :type  cacheDirectory: `bytes`
+        :param cacheDirectory: Path to a directory in which to cache generated
+            dispatch code, between processes, when ``generateCode`` is true;
+            or ``None`` to disable caching.
+
+        :type  cacheSize: `int`
+        :param cacheSize: Maximum number of route match results to cache, for
+            routes whose matchers are all pure; or ``0`` to disable caching.
+
+        :type  profile: `bool`
+        :param profile: Record `RouteStatistics`?
+
+        :type  adaptive: `bool`
+        :param adaptive: Periodically prioritise the most frequently matched
+            routes, implies ``profile``?
+        """
         self._routes = []
+        self._table = None
+        self._filter = None
+        self._generateCode = generateCode
+        self._cacheDirectory = cacheDirectory
+        self.matchCache = LRUCache(cacheSize) if cacheSize else None
+        self._profile = profile or adaptive
+        self._adaptive = adaptive
+        self._order = None
+        self.statistics = None
+        self._urlTemplates = None
+
+
+    def _routeTable(self):
+        """
+        Get the compiled routes, compiling them if necessary.
+        """
+        if self._table is None:
+            order = self._order
+            if order is None:
+                order = range(len(self._routes))
+            if self._profile:
+                if self.statistics is None:
+                    self.statistics = RouteStatistics(len(self._routes))
+                routes = self.statistics._countingRoutes(self._routes, order)
+            else:
+                routes = [self._routes[i] for i in order]
+            if any(matcher.methods is not None
+                   for name, meth, matcher in routes):
+                table = _MethodRouteTable(routes, self._compileRoutes)
+            else:
+                table = self._compileRoutes(routes)
+            if self.matchCache is not None:
+                self.matchCache.clear()
+                table = _CachingRouteTable(table, self.matchCache)
+            self._filter = _RouteFilter(routes)
+            if self.statistics is not None:
+                table = _ProfilingRouteTable(
+                    table, self.statistics, order,
+                    self._adapt if self._adaptive else None)
+            self._table = table
+        return self._table
+
+
+    def _compileRoutes(self, routes):
+        """
+        Compile some routes into a route table.
+        """
+        table = _RouteTrie(routes)
+        if self._generateCode:
+            table = _GeneratedDispatcher(table, self._cacheDirectory)
+        return table
+
+
+    def _adapt(self):
+        """
+        Prioritise the routes every `Router.adaptInterval` lookups.
+        """
+        if self.statistics.lookups % self.adaptInterval == 0:
+            self.prioritiseRoutes()
+
+
+    def prioritiseRoutes(self):
+        """
+        Try the most frequently matched routes first, according to
+        `Router.statistics`, wherever it can be proven that doing so does not
+        change which route matches any path.
+        """
+        if self.statistics is None:
+            return
+        order = _prioritiseRoutes(self._routes, self.statistics.hits)
+        if order != (self._order or range(len(self._routes))):
+            self._order = order
+            self._table = None
 
 
     def _forObject(self, obj):
         """
-        Create a new `Router` instance, with it's own set of routes, for
-        ``obj``.
+        Bind this router to ``obj``.
+
+        The compiled routes are shared by every object the router is bound to.
         """
-        router = type(self)()
-        router._routes = list(self._routes)
-        router._self = obj
-        return router
+        return _BoundRouter(self, obj)
 
 
     def __get__(self, obj, type=None):
@@ -296,17 +1943,58 @@ class Router(object):
         Add a route handler and matcher to the collection of possible routes.
         """
         self._routes.append((f.func_name, f, matcher))
+        self._table = None
+        self._urlTemplates = None
+        self._order = None
+        self.statistics = None
 
 
-    def resource(self):
+    def urlFor(self, handlerName, **params):
         """
-        Create an `IResource <twisted:twisted.web.resource.IResource>` that
-        will perform URL routing.
-        """
-        return SpinneretResource(_RouterResource(self._self, self._routes))
+        Generate the URL path for a route handler.
+
+        The first route, declared for the handler, whose parameter names are
+        exactly those given is used. Parameter values are converted to path
+        segments by the inverse of the route's parameter matchers, for example
+        `Integer` formats an integer, and quoted. Routes are compiled into URL
+        templates once, making it cheap to generate many URLs.
+
+        The path is relative to the router's resource, the URL of a route in
+        a nested router is the path of the parent route followed by the path
+        generated by the nested router.
+
+        :type  handlerName: `str`
+        :param handlerName: Name of the route handler.
 
+        :param params: Route parameter values; a `Load` parameter is
+            given the key to load, rather than the loaded object.
 
-    def route(self, *components):
+        :raise ValueError: If there is no route, for the handler, that can be
+            reversed with the given parameters; or a parameter value cannot be
+            converted, such as a value for an `Integer` parameter that is not
+            an integer.
+
+        :rtype: `bytes`
+        :return: URL path, without a leading ``/``.
+        """
+        if self._urlTemplates is None:
+            self._urlTemplates = templates = {}
+            for name, meth, matcher in self._routes:
+                try:
+                    template = _URLTemplate(matcher)
+                except ValueError:
+                    continue
+                templates.setdefault(name, []).append(template)
+        names = params.viewkeys()
+        for template in self._urlTemplates.get(handlerName, ()):
+            if template.names == names:
+                return template.expand(params)
+        raise ValueError(
+            'No route for %r with parameters %r' % (
+                handlerName, sorted(params)))
+
+
+    def route(self, *components, **kwargs):
         """
         See `txspinneret.route.route`.
 
@@ -314,12 +2002,12 @@ class Router(object):
         with a single handler.
         """
         def _factory(f):
-            self._addRoute(f, route(*components))
+            self._addRoute(f, route(*components, **kwargs))
             return f
         return _factory
 
 
-    def subroute(self, *components):
+    def subroute(self, *components, **kwargs):
         """
         See `txspinneret.route.subroute`.
 
@@ -327,12 +2015,78 @@ class Router(object):
         with a single handler.
         """
         def _factory(f):
-            self._addRoute(f, subroute(*components))
+            self._addRoute(f, subroute(*components, **kwargs))
             return f
         return _factory
 
 
 
+class _RouterSpinneretResource(SpinneretResource):
+    """
+    `SpinneretResource` for a `_RouterResource`.
+
+    Paths rejected by the router's `_RouteFilter` result in a pre-rendered
+    ``404 Not Found`` straight away, without searching the routes or creating
+    any `Deferred`.
+    """
+    def getChildWithDefault(self, path, request):
+        if self._wrappedResource._filter.rejects(
+                path, len(request.postpath) + 1):
+            return _NOT_FOUND
+        return SpinneretResource.getChildWithDefault(self, path, request)
+
+
+
+class _BoundRouter(object):
+    """
+    `Router` bound to the object containing its route handlers.
+
+    Many of these are created, typically one for every resource in every
+    request, so they are kept as small as possible.
+    """
+    __slots__ = ['_router', '_self']
+
+    def __init__(self, router, obj):
+        self._router = router
+        self._self = obj
+
+
+    @property
+    def matchCache(self):
+        """
+        See `Router.matchCache`.
+        """
+        return self._router.matchCache
+
+
+    @property
+    def statistics(self):
+        """
+        See `Router.statistics`.
+        """
+        return self._router.statistics
+
+
+    @property
+    def urlFor(self):
+        """
+        See `Router.urlFor`.
+        """
+        return self._router.urlFor
+
+
+    def resource(self):
+        """
+        Create an `IResource <twisted:twisted.web.resource.IResource>` that
+        will perform URL routing.
+        """
+        router = self._router
+        table = router._routeTable()
+        return _RouterSpinneretResource(
+            _RouterResource(self._self, table, router._filter))
+
+
+
 def routedResource(f, routerAttribute='router'):
     """
     Decorate a router-producing callable to instead produce a resource.
@@ -377,5 +2131,7 @@ def routedResource(f, routerAttribute='router'):
 
 
 __all__ = [
-    'Router', 'Any', 'Text', 'Integer', 'route', 'subroute',
-    'routedResource']
+    'Router', 'Any', 'Text', 'Integer', 'UUID', 'Choice', 'Enum', 'Regex',
+    'Rest', 'Path', 'Load',
+    'route', 'subroute', 'routedResource', 'RouteStatistics',
+    'findShadowedRoutes']
@@ -0,0 +1,374 @@
+"""
+Faster rendering of `IRenderable <twisted:twisted.web.iweb.IRenderable>`
+results.
+
+Renderables marked with `cacheable` are flattened once and, until their time
+to live expires, served from `flattenedCache` after that. Templates loaded
+with `precompile` have their static parts flattened once, only the parts
+that can differ between requests, such as render methods and slots, are
+flattened on every request.
+"""
+from twisted.internet.defer import FirstError, gatherResults
+from twisted.python.failure import Failure
+from twisted.web.iweb import IRenderable, ITemplateLoader
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.template import (
+    CDATA, CharRef, Comment, Element, Tag, flattenString, renderElement)
+from zope.interface import implementer
+
+from txspinneret.interfaces import ICacheableRenderable
+from txspinneret.util import LRUCache
+
+
+
+class FlattenedCache(object):
+    """
+    Bounded cache of flattened renderables, discarding the least recently used
+    entries and those whose time to live has expired.
+
+    :ivar hits: Number of lookups that found an entry.
+
+    :ivar misses: Number of lookups that did not find an entry, or found an
+        expired one.
+    """
+    def __init__(self, maxSize=256, clock=None):
+        """
+        :type  maxSize: `int`
+        :param maxSize: Maximum number of entries to keep.
+
+        :type  clock: `IReactorTime`
+        :param clock: Clock to expire entries with, defaults to the global
+            reactor.
+        """
+        self._items = LRUCache(maxSize)
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+
+
+    def _now(self):
+        if self._clock is None:
+            from twisted.internet import reactor
+            self._clock = reactor
+        return self._clock.seconds()
+
+
+    def get(self, key):
+        """
+        Look up a flattened renderable.
+
+        :rtype: `bytes`
+        :return: Flattened renderable, or ``None`` if there is no entry or it
+            has expired.
+        """
+        item = self._items.get(key)
+        if item is not None:
+            value, expires = item
+            if expires is None or expires > self._now():
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a flattened renderable.
+
+        :type  ttl: `float`
+        :param ttl: Seconds to keep the entry for, or ``None`` to keep it until
+            it is discarded to make room for others.
+        """
+        expires = None
+        if ttl is not None:
+            expires = self._now() + ttl
+        self._items.set(key, (value, expires))
+
+
+    def clear(self):
+        """
+        Discard all entries.
+        """
+        self._items.clear()
+
+
+
+flattenedCache = FlattenedCache()
+
+
+
+@implementer(ICacheableRenderable)
+class _CacheableRenderable(object):
+    """
+    `IRenderable` marked as cacheable.
+    """
+    def __init__(self, renderable, cacheKey, cacheTTL):
+        self._renderable = renderable
+        self.cacheKey = cacheKey
+        self.cacheTTL = cacheTTL
+
+
+    def lookupRenderMethod(self, name):
+        return self._renderable.lookupRenderMethod(name)
+
+
+    def render(self, request):
+        return self._renderable.render(request)
+
+
+
+def cacheable(renderable, key, ttl=None):
+    """
+    Mark a renderable as cacheable, its flattened form will be reused for
+    every renderable with the same key.
+
+    The renderable must flatten to the same result no matter which request it
+    is rendered for, and anything it does to the request, such as setting
+    headers, only happens when it is actually flattened.
+
+    :type  renderable: `IRenderable`
+    :param renderable: Renderable to cache.
+
+    :param key: Hashable key identifying the flattened renderable.
+
+    :type  ttl: `float`
+    :param ttl: Seconds to keep the flattened renderable for, or ``None`` to
+        keep it until it is discarded to make room for others.
+
+    :rtype: `ICacheableRenderable`
+    """
+    return _CacheableRenderable(renderable, key, ttl)
+
+
+
+_MARKER = u'\x00txspinneret\x00'
+
+
+
+def _isStatic(node):
+    """
+    Does flattening ``node`` always produce the same result?
+    """
+    if isinstance(node, (bytes, unicode, CharRef, Comment, CDATA)):
+        return True
+    elif isinstance(node, Tag):
+        return (not node.render and
+                not node.slotData and
+                all(_isStatic(v) for v in node.attributes.values()) and
+                all(_isStatic(c) for c in node.children))
+    elif isinstance(node, (list, tuple)):
+        return all(_isStatic(c) for c in node)
+    return False
+
+
+
+def _flattenStatic(node):
+    """
+    Flatten a static node.
+    """
+    results = []
+    flattenString(None, node).addBoth(results.append)
+    result, = results
+    if isinstance(result, Failure):
+        result.raiseException()
+    return result
+
+
+
+def _compile(node, parts):
+    """
+    Compile a template node into a `list` of flattened static parts, as
+    `bytes`, and dynamic nodes.
+    """
+    if _isStatic(node):
+        parts.append(_flattenStatic(node))
+    elif isinstance(node, (list, tuple)):
+        for child in node:
+            _compile(child, parts)
+    elif (isinstance(node, Tag) and
+          not node.render and
+          not node.slotData and
+          all(_isStatic(v) for v in node.attributes.values())):
+        shell = node.clone(deep=False)
+        shell.children = [_MARKER]
+        start, end = _flattenStatic(shell).split(_MARKER.encode('utf-8'))
+        parts.append(start)
+        for child in node.children:
+            _compile(child, parts)
+        parts.append(end)
+    else:
+        parts.append(node)
+
+
+
+@implementer(ITemplateLoader)
+class _PrecompiledLoader(object):
+    """
+    Template loader with the static parts of its template flattened in
+    advance.
+    """
+    def __init__(self, loader):
+        self._loader = loader
+        self._parts = None
+
+
+    def load(self):
+        return self._loader.load()
+
+
+    @property
+    def parts(self):
+        """
+        `list` of flattened static parts, as `bytes`, and dynamic nodes.
+        """
+        if self._parts is None:
+            parts = []
+            _compile(self.load(), parts)
+            self._parts = []
+            for part in parts:
+                if (isinstance(part, bytes) and
+                        self._parts and
+                        isinstance(self._parts[-1], bytes)):
+                    self._parts[-1] += part
+                else:
+                    self._parts.append(part)
+        return self._parts
+
+
+
+def precompile(loader):
+    """
+    Precompile a template so that its static parts are only flattened once.
+
+    Only the parts of the template that can differ between requests, tags with
+    render methods or slot data and anything that is not a tag or text, are
+    flattened when an `Element` using the loader is rendered. This only
+    applies to elements that do not override `Element.render`.
+
+    :type  loader: `ITemplateLoader`
+    :param loader: Template loader to precompile.
+
+    :rtype: `ITemplateLoader`
+    """
+    return _PrecompiledLoader(loader)
+
+
+
+@implementer(IRenderable)
+class _Fragment(object):
+    """
+    Part of a template, rendered with the render methods of an element.
+    """
+    def __init__(self, element, node):
+        self._element = element
+        self._node = node
+
+
+    def lookupRenderMethod(self, name):
+        return self._element.lookupRenderMethod(name)
+
+
+    def render(self, request):
+        return self._node
+
+
+
+def _precompiledParts(renderable):
+    """
+    Get the precompiled template parts for a renderable.
+
+    :return: `list` of parts, or ``None`` if the renderable's template is not
+        precompiled.
+    """
+    loader = getattr(renderable, 'loader', None)
+    if (isinstance(loader, _PrecompiledLoader) and
+            type(renderable).render.__func__ is Element.render.__func__):
+        return loader.parts
+    return None
+
+
+
+def _unwrapFirstError(f):
+    f.trap(FirstError)
+    return f.value.subFailure
+
+
+
+def _flatten(request, renderable):
+    """
+    Flatten a renderable, using its precompiled template if it has one.
+
+    :rtype: `Deferred` firing with `bytes`
+    """
+    if isinstance(renderable, _CacheableRenderable):
+        renderable = renderable._renderable
+    parts = _precompiledParts(renderable)
+    if parts is None:
+        return flattenString(request, renderable)
+    d = gatherResults(
+        [flattenString(request, _Fragment(renderable, part))
+         for part in parts
+         if not isinstance(part, bytes)],
+        consumeErrors=True)
+    d.addErrback(_unwrapFirstError)
+
+    def _join(results):
+        results = iter(results)
+        return b''.join(
+            part if isinstance(part, bytes) else next(results)
+            for part in parts)
+    return d.addCallback(_join)
+
+
+
+def _renderTemplate(request, renderable, doctype, cache):
+    """
+    Render a renderable, using the cache and precompiled templates where
+    possible.
+
+    Renderables that are neither cacheable nor precompiled are rendered with
+    `renderElement <twisted:twisted.web.template.renderElement>`, otherwise
+    the renderable is flattened in its entirety before anything is written,
+    and if flattening fails the request processing fails.
+
+    See `IResource.render <twisted:twisted.web.resource.IResource.render>`.
+    """
+    key = None
+    if ICacheableRenderable.providedBy(renderable):
+        key = renderable.cacheKey, doctype
+        body = cache.get(key)
+        if body is not None:
+            return body
+    elif _precompiledParts(renderable) is None:
+        return renderElement(request, renderable, doctype)
+
+    def _flattened(body):
+        if doctype is not None:
+            body = doctype + b'\n' + body
+        if key is not None:
+            cache.set(key, body, renderable.cacheTTL)
+        return body
+
+    synchronous = [True]
+    flattened = []
+
+    def _render(result):
+        if isinstance(result, Failure):
+            request.processingFailed(result)
+        elif synchronous[0]:
+            flattened.append(result)
+        else:
+            request.write(result)
+            request.finish()
+
+    d = _flatten(request, renderable)
+    d.addCallback(_flattened)
+    d.addBoth(_render)
+    synchronous[0] = False
+    if flattened:
+        return flattened[0]
+    return NOT_DONE_YET
+
+
+
+__all__ = ['FlattenedCache', 'cacheable', 'flattenedCache', 'precompile']
@@ -0,0 +1,415 @@
+from testtools import TestCase
+from testtools.matchers import Equals, Is, Not
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.web import http
+from zope.interface import implementer
+
+from txspinneret.cache import (
+    CachingResource, ResponseCache, _CachedResponse, tagResponse)
+from txspinneret.interfaces import INegotiableResource, ISpinneretResource
+from txspinneret.resource import ContentTypeNegotiator, SpinneretResource
+from txspinneret.test.util import DeferredChild, Handler, renderRequest
+
+
+
+class _Handler(Handler):
+    """
+    `Handler` tagging its responses.
+    """
+    def __init__(self, tags=(), **kw):
+        Handler.__init__(self, **kw)
+        self.tags = tags
+
+
+    def render_GET(self, request):
+        tagResponse(request, *self.tags)
+        return Handler.render_GET(self, request)
+
+
+    render_HEAD = render_POST = render_GET
+
+
+
+@implementer(INegotiableResource, ISpinneretResource)
+class _Negotiable(_Handler):
+    """
+    Negotiable resource counting the number of times it is rendered.
+    """
+    def __init__(self, contentType):
+        _Handler.__init__(self, body=contentType)
+        self.contentType = contentType
+        self.acceptTypes = [contentType]
+
+
+
+def entry(body=b'', tags=(), storedAt=0, ttl=10, staleWhileRevalidate=0):
+    """
+    Create a `_CachedResponse`.
+    """
+    return _CachedResponse(
+        code=http.OK,
+        headers=[],
+        body=body,
+        tags=frozenset(tags),
+        storedAt=storedAt,
+        ttl=ttl,
+        staleWhileRevalidate=staleWhileRevalidate)
+
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Tests for `txspinneret.cache.ResponseCache`.
+    """
+    def setUp(self):
+        super(ResponseCacheTests, self).setUp()
+        self.clock = Clock()
+
+
+    def test_get(self):
+        """
+        Fresh responses that have been stored can be looked up.
+        """
+        cache = ResponseCache(clock=self.clock)
+        response = entry()
+        self.assertThat(cache.get(u'foo'), Equals((None, False)))
+        cache.set(u'foo', response)
+        self.assertThat(cache.get(u'foo'), Equals((response, True)))
+        self.assertThat((cache.hits, cache.misses), Equals((1, 1)))
+
+
+    def test_stale(self):
+        """
+        Responses are stale once they expire, and discarded once they have
+        been stale for longer than they may be used for.
+        """
+        cache = ResponseCache(clock=self.clock)
+        response = entry(ttl=10, staleWhileRevalidate=5)
+        cache.set(u'foo', response)
+        self.clock.advance(10)
+        self.assertThat(cache.get(u'foo'), Equals((response, False)))
+        self.clock.advance(5)
+        self.assertThat(cache.get(u'foo'), Equals((None, False)))
+        self.assertThat(
+            (cache.hits, cache.staleHits, cache.misses, cache.size),
+            Equals((0, 1, 1, 0)))
+
+
+    def test_maxBytes(self):
+        """
+        The least recently used responses are discarded to keep the total
+        size of the responses within ``maxBytes``.
+        """
+        size = entry(b'x' * 100).size
+        cache = ResponseCache(
+            maxBytes=size * 2, maxEntryBytes=size, clock=self.clock)
+        cache.set(u'a', entry(b'x' * 100))
+        cache.set(u'b', entry(b'x' * 100))
+        cache.get(u'a')
+        cache.set(u'c', entry(b'x' * 100))
+        self.assertThat(cache.get(u'b'), Equals((None, False)))
+        self.assertThat(cache.get(u'a')[0], Not(Is(None)))
+        self.assertThat(cache.size, Equals(size * 2))
+        self.assertThat(cache.evictions, Equals(1))
+
+
+    def test_maxEntryBytes(self):
+        """
+        Responses larger than ``maxEntryBytes`` are not stored.
+        """
+        cache = ResponseCache(maxEntryBytes=1000, clock=self.clock)
+        self.assertThat(cache.set(u'a', entry(b'x' * 1000)), Equals(False))
+        self.assertThat(len(cache), Equals(0))
+
+
+    def test_invalidate(self):
+        """
+        Invalidating tags discards every response with any of the tags.
+        """
+        cache = ResponseCache(clock=self.clock)
+        cache.set(u'a', entry(tags=[u'x']))
+        cache.set(u'b', entry(tags=[u'x', u'y']))
+        cache.set(u'c', entry(tags=[u'y']))
+        cache.set(u'd', entry(tags=[u'z']))
+        cache.invalidate(u'x', u'y')
+        self.assertThat(len(cache), Equals(1))
+        self.assertThat(cache.get(u'd')[0], Not(Is(None)))
+        self.assertThat(cache.size, Equals(entry().size))
+
+
+    def test_clear(self):
+        """
+        Clearing the cache discards every response.
+        """
+        cache = ResponseCache(clock=self.clock)
+        cache.set(u'a', entry(tags=[u'x']))
+        cache.clear()
+        self.assertThat(cache.get(u'a'), Equals((None, False)))
+        self.assertThat(cache.size, Equals(0))
+
+
+
+class CachingResourceTests(TestCase):
+    """
+    Tests for `txspinneret.cache.CachingResource`.
+    """
+    def setUp(self):
+        super(CachingResourceTests, self).setUp()
+        self.clock = Clock()
+        self.cache = ResponseCache(clock=self.clock)
+
+
+    def caching(self, handler, **kw):
+        """
+        Create a `CachingResource` for a spinneret resource.
+        """
+        return CachingResource(SpinneretResource(handler), self.cache, **kw)
+
+
+    def test_cached(self):
+        """
+        Identical requests are answered with the stored response, without
+        rendering anything.
+        """
+        handler = _Handler()
+        resource = self.caching(handler, ttl=60)
+        first = renderRequest(resource)
+        self.clock.advance(5)
+        second = renderRequest(resource)
+        self.assertThat(handler.renders, Equals(1))
+        self.assertThat(second.written, Equals(first.written))
+        self.assertThat(second.code, Equals(http.OK))
+        self.assertThat(
+            second.responseHeaders.getRawHeaders(b'content-type'),
+            Equals([b'text/plain']))
+        self.assertThat(
+            second.responseHeaders.getRawHeaders(b'age'),
+            Equals([b'5']))
+        self.assertThat(self.cache.hits, Equals(1))
+
+
+    def test_query(self):
+        """
+        Requests with the same query arguments, in any order, share a response
+        while different paths or arguments do not.
+        """
+        handler = _Handler()
+        resource = self.caching(handler, ttl=60)
+        renderRequest(resource, b'/foo?a=1&b=2')
+        renderRequest(resource, b'/foo?b=2&a=1')
+        self.assertThat(handler.renders, Equals(1))
+        renderRequest(resource, b'/foo?a=2&b=2')
+        renderRequest(resource, b'/bar?a=1&b=2')
+        self.assertThat(handler.renders, Equals(3))
+
+
+    def test_negotiated(self):
+        """
+        Each negotiated ``Content-Type`` is stored separately.
+        """
+        json = _Negotiable(b'application/json')
+        html = _Negotiable(b'text/html')
+        negotiator = ContentTypeNegotiator([json, html])
+        negotiator.isLeaf = True
+        resource = CachingResource(negotiator, self.cache, ttl=60)
+        for accept in [b'application/json', b'text/html'] * 2:
+            request = renderRequest(resource, headers={b'Accept': accept})
+            self.assertThat(request.written, Equals([accept]))
+        self.assertThat((json.renders, html.renders), Equals((1, 1)))
+
+
+    def test_deferred(self):
+        """
+        Responses rendered asynchronously are stored once they are finished.
+        """
+        d = Deferred()
+        handler = _Handler(body=d)
+        resource = self.caching(handler, ttl=60)
+        renderRequest(resource)
+        d.callback(b'later')
+        handler.body = b'wrong'
+        self.assertThat(renderRequest(resource).written, Equals([b'later']))
+        self.assertThat(handler.renders, Equals(1))
+
+
+    def test_deferredChild(self):
+        """
+        Responses of children located asynchronously are stored once they are
+        finished.
+        """
+        handler = _Handler()
+        parent = DeferredChild()
+        resource = self.caching(parent, ttl=60)
+        first = renderRequest(resource)
+        parent.locate(handler)
+        self.assertThat(first.written, Equals([b'hello']))
+        self.assertThat(renderRequest(resource).written, Equals([b'hello']))
+        self.assertThat(handler.renders, Equals(1))
+
+
+    def test_ttl(self):
+        """
+        Responses are rendered again once they expire.
+        """
+        handler = _Handler()
+        resource = self.caching(handler, ttl=60)
+        renderRequest(resource)
+        self.clock.advance(60)
+        renderRequest(resource)
+        self.assertThat(handler.renders, Equals(2))
+
+
+    def test_cacheControl(self):
+        """
+        The ``s-maxage`` and ``max-age`` ``Cache-Control`` directives, in
+        that order, determine how long a response is stored for.
+        """
+        handler = _Handler(
+            headers={b'Cache-Control': b'max-age=10, s-maxage=30'})
+        resource = self.caching(handler)
+        renderRequest(resource)
+        self.clock.advance(29)
+        renderRequest(resource)
+        self.assertThat(handler.renders, Equals(1))
+        handler.headers[b'Cache-Control'] = b'max-age=10'
+        self.clock.advance(1)
+        renderRequest(resource)
+        self.clock.advance(10)
+        renderRequest(resource)
+        self.assertThat(handler.renders, Equals(3))
+
+
+    def test_uncacheable(self):
+        """
+        Responses are not stored if they have no lifetime, are not ``200 OK``,
+        set cookies, vary on request headers other than ``Accept`` or are
+        marked as private or not to be stored.
+        """
+        cases = [
+            dict(),
+            dict(ttl=60, code=http.NOT_FOUND),
+            dict(ttl=60, headers={b'Set-Cookie': b'a=b'}),
+            dict(ttl=60, headers={b'Vary': b'Accept, Cookie'}),
+            dict(ttl=60, headers={b'Cache-Control': b'private'}),
+            dict(ttl=60, headers={b'Cache-Control': b'no-store'}),
+            dict(ttl=60, headers={b'Cache-Control': b'max-age=0'}),
+            ]
+        for case in cases:
+            ttl = case.pop('ttl', 0)
+            handler = _Handler(**case)
+            resource = self.caching(handler, ttl=ttl)
+            renderRequest(resource)
+            renderRequest(resource)
+            self.assertThat(handler.renders, Equals(2))
+        self.assertThat(len(self.cache), Equals(0))
+
+
+    def test_uncacheableRequests(self):
+        """
+        Requests with other methods than ``GET`` or ``HEAD``, or with an
+        ``Authorization`` or ``Cookie`` header, are never answered from the
+        cache and their responses are never stored.
+        """
+        handler = _Handler()
+        resource = self.caching(handler, ttl=60)
+        renderRequest(resource, headers={b'Cookie': b'session=a'})
+        self.assertThat(len(self.cache), Equals(0))
+        renderRequest(resource)
+        renderRequest(resource, method=b'POST')
+        renderRequest(resource, headers={b'Authorization': b'Basic Zm9v'})
+        renderRequest(resource, headers={b'Cookie': b'session=a'})
+        self.assertThat(handler.renders, Equals(5))
+
+
+    def test_head(self):
+        """
+        ``HEAD`` requests are answered from the cache, but their responses
+        are not stored.
+        """
+        handler = _Handler()
+        resource = self.caching(handler, ttl=60)
+        renderRequest(resource, method=b'HEAD')
+        self.assertThat(len(self.cache), Equals(0))
+        renderRequest(resource)
+        renderRequest(resource, method=b'HEAD')
+        self.assertThat(handler.renders, Equals(2))
+
+
+    def test_conditional(self):
+        """
+        Conditional requests matching a stored response's ``ETag`` are
+        answered with ``304 Not Modified``, without rendering anything.
+        """
+        handler = _Handler(headers={b'ETag': b'"v1"'})
+        resource = self.caching(handler, ttl=60)
+        renderRequest(resource)
+        request = renderRequest(resource, headers={b'If-None-Match': b'"v1"'})
+        self.assertThat(request.code, Equals(http.NOT_MODIFIED))
+        self.assertThat(b''.join(request.written), Equals(b''))
+        request = renderRequest(resource, headers={b'If-None-Match': b'"v0"'})
+        self.assertThat(request.written, Equals([b'hello']))
+        self.assertThat(handler.renders, Equals(1))
+
+
+    def test_tags(self):
+        """
+        Responses tagged with `tagResponse` are discarded when their tags are
+        invalidated.
+        """
+        handler = _Handler(tags=[u'foo'])
+        resource = self.caching(handler, ttl=60)
+        renderRequest(resource)
+        self.cache.invalidate(u'foo')
+        renderRequest(resource)
+        self.assertThat(handler.renders, Equals(2))
+
+
+    def test_staleWhileRevalidate(self):
+        """
+        Once a response is stale, the first request for it renders a fresh
+        response while other requests are answered with the stale one.
+        """
+        handler = _Handler(body=b'old')
+        resource = self.caching(handler, ttl=60, staleWhileRevalidate=30)
+        renderRequest(resource)
+        self.clock.advance(60)
+        d = Deferred()
+        handler.body = d
+        revalidating = renderRequest(resource)
+        self.assertThat(revalidating.written, Equals([]))
+        self.assertThat(renderRequest(resource).written, Equals([b'old']))
+        d.callback(b'new')
+        self.assertThat(revalidating.written, Equals([b'new']))
+        self.assertThat(renderRequest(resource).written, Equals([b'new']))
+        self.assertThat(handler.renders, Equals(2))
+        self.assertThat(self.cache.staleHits, Equals(2))
+
+
+    def test_staleWhileRevalidateDirective(self):
+        """
+        The ``stale-while-revalidate`` ``Cache-Control`` directive determines
+        how long a stale response may be used for.
+        """
+        handler = _Handler(
+            headers={
+                b'Cache-Control': b'max-age=60, stale-while-revalidate=30'})
+        resource = self.caching(handler)
+        renderRequest(resource)
+        self.clock.advance(89)
+        renderRequest(resource)
+        self.assertThat(self.cache.staleHits, Equals(1))
+
+
+    def test_staleExpired(self):
+        """
+        Stale responses are not used once the time they may be used for has
+        passed.
+        """
+        handler = _Handler()
+        resource = self.caching(handler, ttl=60, staleWhileRevalidate=30)
+        renderRequest(resource)
+        self.clock.advance(90)
+        renderRequest(resource)
+        self.assertThat(handler.renders, Equals(2))
+        self.assertThat(self.cache.staleHits, Equals(0))
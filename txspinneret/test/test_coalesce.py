@@ -0,0 +1,342 @@
+from testtools import TestCase
+from testtools.matchers import Equals, Is
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionDone
+from twisted.internet.interfaces import IPullProducer, IPushProducer
+from twisted.internet.task import Cooperator
+from twisted.python.failure import Failure
+from twisted.web import http
+from zope.interface import implementer
+
+from txspinneret.coalesce import CoalescingResource
+from txspinneret.resource import SpinneretResource
+from txspinneret.test.util import (
+    DeferredChild, Handler, captureLoggedErrors, renderRequest)
+
+
+
+@implementer(IPushProducer)
+class _PushProducer(object):
+    """
+    Push producer recording the calls made to it.
+    """
+    def __init__(self):
+        self.calls = []
+
+
+    def pauseProducing(self):
+        self.calls.append('pause')
+
+
+    def resumeProducing(self):
+        self.calls.append('resume')
+
+
+    def stopProducing(self):
+        self.calls.append('stop')
+
+
+
+@implementer(IPullProducer)
+class _PullProducer(object):
+    """
+    Pull producer writing chunks to a request.
+    """
+    def __init__(self, request, chunks):
+        self.request = request
+        self.chunks = list(chunks)
+
+
+    def resumeProducing(self):
+        if self.chunks:
+            self.request.write(self.chunks.pop(0))
+        else:
+            self.request.unregisterProducer()
+            self.request.finish()
+
+
+    def stopProducing(self):
+        pass
+
+
+
+class CoalescingResourceTests(TestCase):
+    """
+    Tests for `txspinneret.coalesce.CoalescingResource`.
+    """
+    def coalescing(self, body, **kw):
+        """
+        Create a `CoalescingResource` for a `Handler` rendering ``body``.
+        """
+        handler = Handler(body, code=http.CREATED)
+        return handler, CoalescingResource(SpinneretResource(handler), **kw)
+
+
+    def coalescingLater(self, body, **kw):
+        """
+        Create a `CoalescingResource` for a `Handler` rendering ``body``,
+        that is only located once ``located`` is called, so that requests
+        rendered before then all wait for the same response.
+        """
+        handler = Handler(body, code=http.CREATED)
+        parent = DeferredChild()
+        resource = CoalescingResource(SpinneretResource(parent), **kw)
+        return handler, resource, lambda: parent.locate(handler)
+
+
+    def assertResponse(self, request, body):
+        """
+        Assert that ``request`` was answered with the response rendered by
+        `Handler`.
+        """
+        self.assertThat(request.code, Equals(http.CREATED))
+        self.assertThat(
+            request.responseHeaders.getRawHeaders(b'content-type'),
+            Equals([b'text/plain']))
+        self.assertThat(b''.join(request.written), Equals(body))
+        self.assertThat(request.finished, Equals(1))
+
+
+    def test_coalesced(self):
+        """
+        Identical concurrent requests are rendered once, and the response is
+        written to all of them.
+        """
+        d = Deferred()
+        handler, resource = self.coalescing(lambda request: d)
+        requests = [renderRequest(resource) for _ in range(3)]
+        self.assertThat(handler.renders, Equals(1))
+        self.assertThat(resource.coalesced, Equals(2))
+        d.callback(b'hello')
+        for request in requests:
+            self.assertResponse(request, b'hello')
+
+
+    def test_notConcurrent(self):
+        """
+        Requests that arrive after the response is finished are rendered
+        again.
+        """
+        handler, resource = self.coalescing(lambda request: b'hello')
+        for _ in range(2):
+            self.assertResponse(renderRequest(resource), b'hello')
+        self.assertThat(handler.renders, Equals(2))
+        self.assertThat(resource._flights, Equals({}))
+
+
+    def test_identical(self):
+        """
+        Requests with the same method, path, query arguments, in any order,
+        and ``Accept`` headers are identical.
+        """
+        handler, resource = self.coalescing(lambda request: Deferred())
+        renderRequest(resource, b'/foo?a=1&b=2')
+        renderRequest(resource, b'/foo?b=2&a=1')
+        self.assertThat(handler.renders, Equals(1))
+        renderRequest(resource, b'/foo?a=2&b=2')
+        renderRequest(resource, b'/bar?a=1&b=2')
+        renderRequest(resource, b'/foo?a=1&b=2', method=b'HEAD')
+        renderRequest(
+            resource, b'/foo?a=1&b=2', headers={b'Accept': b'text/html'})
+        self.assertThat(handler.renders, Equals(5))
+
+
+    def test_uncoalesced(self):
+        """
+        Requests with methods other than ``GET`` or ``HEAD``, or with
+        ``Authorization`` or ``Cookie`` headers are rendered on their own.
+        """
+        handler, resource = self.coalescing(lambda request: Deferred())
+        handler.render_POST = handler.render_GET
+        renderRequest(resource)
+        renderRequest(resource, method=b'POST')
+        renderRequest(resource, headers={b'Authorization': b'Basic Zm9v'})
+        renderRequest(resource, headers={b'Cookie': b'a=b'})
+        self.assertThat(handler.renders, Equals(4))
+
+
+    def test_lateJoiner(self):
+        """
+        Requests that arrive part way through a response are written the
+        response so far, and then the rest of it.
+        """
+        d = Deferred()
+
+        def body(request):
+            request.write(b'he')
+            return d
+        handler, resource = self.coalescing(body)
+        first = renderRequest(resource)
+        second = renderRequest(resource)
+        d.callback(b'llo')
+        self.assertResponse(first, b'hello')
+        self.assertResponse(second, b'hello')
+        self.assertThat(handler.renders, Equals(1))
+
+
+    def test_waiterDisconnects(self):
+        """
+        A client disconnecting only stops its own request from waiting.
+        """
+        cancelled = []
+        d = Deferred(cancelled.append)
+        handler, resource = self.coalescing(lambda request: d)
+        first = renderRequest(resource)
+        second = renderRequest(resource)
+        third = renderRequest(resource)
+        first.processingFailed(Failure(ConnectionDone()))
+        second.processingFailed(Failure(ConnectionDone()))
+        self.assertThat(cancelled, Equals([]))
+        d.callback(b'hello')
+        self.assertThat(first.written, Equals([]))
+        self.assertResponse(third, b'hello')
+
+
+    def test_allDisconnect(self):
+        """
+        Once every waiting client has disconnected the response is
+        abandoned, cancelling the `Deferred` rendering it, and the next
+        request renders it again.
+        """
+        cancelled = []
+        d = Deferred(cancelled.append)
+        handler, resource = self.coalescing(lambda request: d)
+        requests = [renderRequest(resource) for _ in range(2)]
+        for request in requests:
+            request.processingFailed(Failure(ConnectionDone()))
+        self.assertThat(cancelled, Equals([d]))
+        self.assertThat(resource._flights, Equals({}))
+        handler.body = lambda request: b'hello'
+        self.assertResponse(renderRequest(resource), b'hello')
+        self.assertThat(handler.renders, Equals(2))
+
+
+    def test_failure(self):
+        """
+        If rendering fails the processing of every waiting request fails.
+        """
+        d = Deferred()
+        handler, resource = self.coalescing(lambda request: d)
+        failures = []
+        requests = [renderRequest(resource) for _ in range(2)]
+        for request in requests:
+            request.processingFailed = failures.append
+        d.errback(RuntimeError('Nope'))
+        self.assertThat(
+            [f.type for f in failures],
+            Equals([RuntimeError, RuntimeError]))
+        self.assertThat(resource._flights, Equals({}))
+
+
+    def test_failureAfterWriting(self):
+        """
+        If rendering fails after the response has started, the connection of
+        every waiting request is closed.
+        """
+        errors = captureLoggedErrors(self)
+        d = Deferred()
+        handler, resource, located = self.coalescingLater(
+            lambda request: iter([b'he', d]))
+        requests = [renderRequest(resource) for _ in range(2)]
+        located()
+        d.errback(RuntimeError('Nope'))
+        self.assertThat(
+            [failure.type for failure in errors], Equals([RuntimeError]))
+        for request in requests:
+            self.assertThat(request.written, Equals([b'he']))
+            self.assertThat(request.connectionLost, Equals(True))
+
+
+    def test_deferredChild(self):
+        """
+        Responses of children located asynchronously are written to every
+        waiting request, and the next request renders them again.
+        """
+        handler, resource, located = self.coalescingLater(
+            lambda request: b'hello')
+        requests = [renderRequest(resource) for _ in range(2)]
+        located()
+        for request in requests:
+            self.assertResponse(request, b'hello')
+        self.assertThat(resource._flights, Equals({}))
+        request = renderRequest(resource)
+        located()
+        self.assertResponse(request, b'hello')
+        self.assertThat(handler.renders, Equals(2))
+
+
+    def test_firstFinished(self):
+        """
+        Once the request rendering the response is finished, however that
+        happens, new requests no longer wait for the response.
+        """
+        d = Deferred()
+        handler, resource = self.coalescing(lambda request: d)
+        first = renderRequest(resource)
+        first.finish()
+        self.assertThat(resource._flights, Equals({}))
+        handler.body = lambda request: b'hello'
+        self.assertResponse(renderRequest(resource), b'hello')
+        self.assertThat(handler.renders, Equals(2))
+
+
+    def test_streamed(self):
+        """
+        Once the response is streamed it is no longer recorded, and new
+        requests no longer wait for it.
+        """
+        handler, resource = self.coalescing(
+            lambda request: iter([b'he', Deferred()]))
+        first = renderRequest(resource)
+        second = renderRequest(resource)
+        self.assertThat(resource._flights, Equals({}))
+        self.assertThat(handler.renders, Equals(2))
+        self.assertThat(resource.coalesced, Equals(0))
+        self.assertThat(first.written, Equals([b'he']))
+        self.assertThat(second.written, Equals([b'he']))
+
+
+    def test_pushProducer(self):
+        """
+        Push producers are paused while any waiting request's transport is
+        paused, or until that request goes away.
+        """
+        producer = _PushProducer()
+        handler, resource, located = self.coalescingLater(
+            lambda request: producer)
+        first, second, third = [renderRequest(resource) for _ in range(3)]
+        located()
+        self.assertThat(producer.calls, Equals(['resume']))
+        first.producer.pauseProducing()
+        second.producer.pauseProducing()
+        first.producer.resumeProducing()
+        self.assertThat(producer.calls, Equals(['resume', 'pause']))
+        second.processingFailed(Failure(ConnectionDone()))
+        self.assertThat(producer.calls, Equals(['resume', 'pause', 'resume']))
+
+
+    def test_pullProducer(self):
+        """
+        Pull producers are driven until they are unregistered, unless any
+        waiting request's transport is paused.
+        """
+        calls = []
+        cooperator = Cooperator(
+            terminationPredicateFactory=lambda: lambda: False,
+            scheduler=calls.append)
+        handler, resource, located = self.coalescingLater(
+            lambda request: _PullProducer(request, [b'he', b'llo']),
+            cooperator=cooperator)
+        requests = [renderRequest(resource) for _ in range(2)]
+        located()
+        requests[0].producer.pauseProducing()
+        while calls:
+            calls.pop(0)()
+        self.assertThat(requests[1].written, Equals([]))
+        requests[0].producer.resumeProducing()
+        while calls:
+            calls.pop(0)()
+        for request in requests:
+            self.assertResponse(request, b'hello')
+            self.assertThat(request.producer, Is(None))
+        self.assertThat(handler.renders, Equals(1))
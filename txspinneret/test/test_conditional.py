@@ -0,0 +1,371 @@
+from functools import partial
+from testtools import TestCase
+from testtools.matchers import Equals, Is, MatchesSetwise, MatchesStructure
+from twisted.internet.defer import Deferred
+from twisted.web import http
+from twisted.web.error import UnsupportedMethod
+from twisted.web.resource import getChildForRequest
+from twisted.web.static import Data
+from zope.interface import implementer
+
+from txspinneret.conditional import (
+    AutoETagResource, conditional, formatETag, notModified)
+from txspinneret.interfaces import ISpinneretResource
+from txspinneret.resource import NotFound, SpinneretResource
+from txspinneret.test.util import (
+    Handler, InMemoryRequest, MatchesException, renderDeferredChild)
+
+
+
+def request(method=b'GET', headers=None):
+    """
+    Create an `InMemoryRequest` with request headers.
+    """
+    request = InMemoryRequest([])
+    request.method = method
+    for name, value in (headers or {}).items():
+        request.requestHeaders.setRawHeaders(name, [value])
+    return request
+
+
+
+@implementer(ISpinneretResource)
+class _Handler(object):
+    """
+    Spinneret resource declaring validators for its response, counting the
+    number of times its body is built.
+    """
+    def __init__(self, body=b'hello', **validators):
+        self.body = body
+        self.validators = validators
+        self.builds = 0
+
+
+    def _build(self):
+        self.builds += 1
+        return self.body
+
+
+    def render_GET(self, request):
+        return conditional(self._build, **self.validators)
+
+
+    render_HEAD = render_GET
+
+
+
+class FormatETagTests(TestCase):
+    """
+    Tests for `txspinneret.conditional.formatETag`.
+    """
+    def test_quoted(self):
+        """
+        Tags are quoted, unless they already are.
+        """
+        self.assertThat(formatETag(b'abc'), Equals(b'"abc"'))
+        self.assertThat(formatETag(b'"abc"'), Equals(b'"abc"'))
+        self.assertThat(formatETag(b'W/"abc"'), Equals(b'W/"abc"'))
+
+
+    def test_types(self):
+        """
+        Text and numbers, such as version numbers, are converted to `bytes`.
+        """
+        self.assertThat(formatETag(42), Equals(b'"42"'))
+        self.assertThat(formatETag(u'\N{SNOWMAN}'), Equals(b'"\xe2\x98\x83"'))
+
+
+    def test_weak(self):
+        """
+        Weak tags are prefixed with the weakness indicator.
+        """
+        self.assertThat(formatETag(b'abc', weak=True), Equals(b'W/"abc"'))
+        self.assertThat(formatETag(b'W/"abc"', weak=True), Equals(b'W/"abc"'))
+
+
+
+class NotModifiedTests(TestCase):
+    """
+    Tests for `txspinneret.conditional.notModified`.
+    """
+    def test_noConditions(self):
+        """
+        Requests without conditional headers are never satisfied.
+        """
+        self.assertThat(
+            notModified(request(), b'"a"', 1000), Equals(False))
+
+
+    def test_ifNoneMatch(self):
+        """
+        ``If-None-Match`` is satisfied if any of its tags, or ``*``, matches
+        the response's tag, using weak comparison.
+        """
+        cases = [
+            (b'"a"', b'"a"', True),
+            (b'"b"', b'"a"', False),
+            (b'"b", "a"', b'"a"', True),
+            (b'W/"a"', b'"a"', True),
+            (b'"a"', b'W/"a"', True),
+            (b'*', b'"a"', True),
+            (b'"a"', None, False),
+            ]
+        for header, etag, expected in cases:
+            self.assertThat(
+                notModified(request(headers={b'If-None-Match': header}), etag),
+                Equals(expected))
+
+
+    def test_ifModifiedSince(self):
+        """
+        ``If-Modified-Since`` is satisfied if the response has not been
+        modified since then, malformed dates are ignored.
+        """
+        since = http.datetimeToString(1000)
+        cases = [
+            (since, 1000.5, True),
+            (since, 999, True),
+            (since, 1001, False),
+            (since, None, False),
+            (b'yesterday', 999, False),
+            ]
+        for header, lastModified, expected in cases:
+            r = request(headers={b'If-Modified-Since': header})
+            self.assertThat(
+                notModified(r, lastModified=lastModified),
+                Equals(expected))
+
+
+    def test_precedence(self):
+        """
+        ``If-Modified-Since`` is ignored when there is an ``If-None-Match``
+        header.
+        """
+        r = request(headers={
+            b'If-None-Match': b'"b"',
+            b'If-Modified-Since': http.datetimeToString(1000)})
+        self.assertThat(notModified(r, b'"a"', 1000), Equals(False))
+
+
+    def test_methods(self):
+        """
+        Only ``GET`` and ``HEAD`` requests are satisfied.
+        """
+        headers = {b'If-None-Match': b'"a"'}
+        self.assertThat(
+            notModified(request(b'HEAD', headers), b'"a"'), Equals(True))
+        self.assertThat(
+            notModified(request(b'POST', headers), b'"a"'), Equals(False))
+
+
+
+class ConditionalTests(TestCase):
+    """
+    Tests for `txspinneret.conditional.conditional`.
+    """
+    def test_notModified(self):
+        """
+        Requests whose conditions match the declared validators are answered
+        with ``304 Not Modified`` without building the body.
+        """
+        handler = _Handler(etag=3, lastModified=1000)
+        r = request(headers={b'If-None-Match': b'"3"'})
+        r.render(SpinneretResource(handler))
+        self.assertThat(r.code, Equals(http.NOT_MODIFIED))
+        self.assertThat(b''.join(r.written), Equals(b''))
+        self.assertThat(handler.builds, Equals(0))
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'etag'), Equals([b'"3"']))
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'last-modified'),
+            Equals([http.datetimeToString(1000)]))
+
+
+    def test_modified(self):
+        """
+        Requests whose conditions do not match the declared validators, or
+        have no conditions, are answered with the body, and the validators.
+        """
+        handler = _Handler(etag=3)
+        for headers in [{b'If-None-Match': b'"2"'}, {}]:
+            r = request(headers=headers)
+            r.render(SpinneretResource(handler))
+            self.assertThat(r.code, Equals(http.OK))
+            self.assertThat(r.written, Equals([b'hello']))
+            self.assertThat(
+                r.responseHeaders.getRawHeaders(b'etag'), Equals([b'"3"']))
+        self.assertThat(handler.builds, Equals(2))
+
+
+    def test_otherMethods(self):
+        """
+        Requests with methods other than ``GET`` or ``HEAD`` are not allowed,
+        and are answered with neither the body nor ``304 Not Modified``.
+        """
+        built = []
+
+        @implementer(ISpinneretResource)
+        class _Parent(object):
+            def locateChild(self, request, segments):
+                return conditional(
+                    lambda: built.append(True) or b'hello', etag=3), []
+
+        for method in [b'DELETE', b'POST']:
+            r = InMemoryRequest([b'child'])
+            r.method = method
+            r.requestHeaders.setRawHeaders(b'If-None-Match', [b'"3"'])
+            resource = getChildForRequest(SpinneretResource(_Parent()), r)
+            self.assertThat(
+                partial(r.render, resource),
+                MatchesException(
+                    UnsupportedMethod,
+                    MatchesStructure(
+                        allowedMethods=MatchesSetwise(
+                            Equals('GET'), Equals('HEAD')))))
+            self.assertThat(r.written, Equals([]))
+            self.assertThat(r.code, Equals(http.OK))
+        self.assertThat(built, Equals([]))
+
+
+    def test_deferredBody(self):
+        """
+        The body may be anything a spinneret resource can return, such as
+        a `Deferred`.
+        """
+        d = Deferred()
+        handler = _Handler(body=d, etag=3)
+        r = request()
+        r.render(SpinneretResource(handler))
+        d.callback(Data(b'later', b'text/plain'))
+        self.assertThat(r.written, Equals([b'later']))
+        self.assertThat(r.finished, Equals(1))
+
+
+    def test_locateChild(self):
+        """
+        ``locateChild`` may return validators for the child it locates.
+        """
+        built = []
+
+        @implementer(ISpinneretResource)
+        class _Parent(object):
+            def locateChild(self, request, segments):
+                return conditional(
+                    lambda: built.append(True) or Data(b'x', b'text/plain'),
+                    lastModified=1000), []
+
+        r = InMemoryRequest([b'child'])
+        r.requestHeaders.setRawHeaders(
+            b'If-Modified-Since', [http.datetimeToString(2000)])
+        r.render(getChildForRequest(SpinneretResource(_Parent()), r))
+        self.assertThat(r.code, Equals(http.NOT_MODIFIED))
+        self.assertThat(built, Equals([]))
+
+
+
+class AutoETagResourceTests(TestCase):
+    """
+    Tests for `txspinneret.conditional.AutoETagResource`.
+    """
+    def render(self, body, method=b'GET', headers=None, **kw):
+        """
+        Render a spinneret resource, with the body ``body``, wrapped in
+        `AutoETagResource`.
+        """
+        r = request(method, headers)
+        r.render(AutoETagResource(SpinneretResource(Handler(body)), **kw))
+        return r
+
+
+    def test_etag(self):
+        """
+        Responses are given an ``ETag`` derived from the body.
+        """
+        first = self.render(b'hello')
+        second = self.render(b'hello')
+        other = self.render(b'world')
+        etag = first.responseHeaders.getRawHeaders(b'etag')
+        self.assertThat(first.written, Equals([b'hello']))
+        self.assertThat(
+            second.responseHeaders.getRawHeaders(b'etag'), Equals(etag))
+        self.assertThat(
+            other.responseHeaders.getRawHeaders(b'etag') == etag,
+            Is(False))
+
+
+    def test_notModified(self):
+        """
+        Requests matching the derived ``ETag`` are answered with ``304 Not
+        Modified`` and no body.
+        """
+        etag = self.render(b'hello').responseHeaders.getRawHeaders(b'etag')[0]
+        r = self.render(b'hello', headers={b'If-None-Match': etag})
+        self.assertThat(r.code, Equals(http.NOT_MODIFIED))
+        self.assertThat(b''.join(r.written), Equals(b''))
+
+
+    def test_deferredChild(self):
+        """
+        Responses of children located asynchronously are tagged too.
+        """
+        etag = self.render(b'hello').responseHeaders.getRawHeaders(b'etag')
+        for headers, code, written in [
+                (None, http.OK, [b'hello']),
+                ({b'If-None-Match': etag[0]}, http.NOT_MODIFIED, [])]:
+            r = renderDeferredChild(AutoETagResource, Handler(), headers)
+            self.assertThat(r.code, Equals(code))
+            self.assertThat(
+                r.responseHeaders.getRawHeaders(b'etag'), Equals(etag))
+            self.assertThat(r.written, Equals(written))
+            self.assertThat(r.finished, Equals(1))
+
+
+    def test_streamed(self):
+        """
+        Streamed bodies are buffered until they are finished, and tagged.
+        """
+        etag = self.render(b'hello').responseHeaders.getRawHeaders(b'etag')
+        d = Deferred()
+        r = self.render(iter([b'he', d]))
+        self.assertThat(r.written, Equals([]))
+        d.callback(b'llo')
+        self.assertThat(r.written, Equals([b'hello']))
+        self.assertThat(r.responseHeaders.getRawHeaders(b'etag'), Equals(etag))
+        self.assertThat(r.finished, Equals(1))
+
+        r = self.render(
+            iter([b'he', b'llo']), headers={b'If-None-Match': etag[0]})
+        self.assertThat(r.code, Equals(http.NOT_MODIFIED))
+        self.assertThat(b''.join(r.written), Equals(b''))
+        self.assertThat(r.finished, Equals(1))
+
+
+    def test_maxBytes(self):
+        """
+        Bodies larger than ``maxBytes`` are written as they are produced,
+        once they outgrow the buffer, without an ``ETag``.
+        """
+        r = self.render(iter([b'he', b'llo', b'!']), maxBytes=3)
+        self.assertThat(r.written, Equals([b'hello', b'!']))
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'etag'), Is(None))
+
+
+    def test_untagged(self):
+        """
+        Responses to requests other than ``GET`` or ``HEAD``, responses other
+        than ``200 OK`` and responses that already have an ``ETag`` are not
+        given one.
+        """
+        r = self.render(b'hello', method=b'POST')
+        self.assertThat(r.written, Equals([b'hello']))
+        self.assertThat(r.responseHeaders.getRawHeaders(b'etag'), Is(None))
+        r = request()
+        r.render(AutoETagResource(NotFound()))
+        self.assertThat(r.code, Equals(http.NOT_FOUND))
+        self.assertThat(r.responseHeaders.getRawHeaders(b'etag'), Is(None))
+        r = request()
+        r.render(AutoETagResource(SpinneretResource(
+            _Handler(b'hello', etag=b'v1'))))
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'etag'), Equals([b'"v1"']))
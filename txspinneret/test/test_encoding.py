@@ -0,0 +1,320 @@
+import zlib
+
+from testtools import TestCase
+from testtools.matchers import Equals, Is
+from twisted.internet.defer import Deferred
+from twisted.web import http
+
+from txspinneret.encoding import (
+    CompressedCache, EncodingResource, negotiateEncoding)
+from txspinneret.resource import SpinneretResource
+from txspinneret.test.util import (
+    Handler, InMemoryRequest, renderDeferredChild)
+
+
+
+_BODY = b'{"items": [%s]}' % (b', '.join(b'%d' % (i,) for i in range(500)),)
+
+
+
+def decompress(data, encoding):
+    """
+    Decompress ``data`` encoded with ``encoding``.
+    """
+    wbits = {b'gzip': 16 + zlib.MAX_WBITS, b'deflate': zlib.MAX_WBITS}
+    return zlib.decompress(data, wbits[encoding])
+
+
+
+def request(acceptEncoding=None):
+    """
+    Create an `InMemoryRequest` with an ``Accept-Encoding`` header.
+    """
+    request = InMemoryRequest([])
+    if acceptEncoding is not None:
+        request.requestHeaders.setRawHeaders(
+            b'Accept-Encoding', [acceptEncoding])
+    return request
+
+
+
+def _jsonHandler(body=_BODY, **kw):
+    """
+    Create a `Handler` rendering a JSON body.
+    """
+    return Handler(body, contentType=b'application/json', **kw)
+
+
+
+class NegotiateEncodingTests(TestCase):
+    """
+    Tests for `txspinneret.encoding.negotiateEncoding`.
+    """
+    def test_negotiate(self):
+        """
+        The most acceptable supported content coding is negotiated, or
+        ``None`` if there is none.
+        """
+        cases = [
+            (None, None),
+            (b'gzip', b'gzip'),
+            (b'deflate, gzip;q=0.5', b'deflate'),
+            (b'gzip, deflate', b'gzip'),
+            (b'x-gzip', b'gzip'),
+            (b'*', b'gzip'),
+            (b'*, gzip;q=0', b'deflate'),
+            (b'gzip;q=0', None),
+            (b'br, identity', None),
+            (b'gzip;q=x', None),
+            (b'gzip;q=x, deflate', b'deflate'),
+            (b'gzip;q=nan, deflate;q=2', None),
+            ]
+        for acceptEncoding, expected in cases:
+            self.assertThat(
+                negotiateEncoding(
+                    request(acceptEncoding), [b'gzip', b'deflate']),
+                Equals(expected))
+
+
+
+class CompressedCacheTests(TestCase):
+    """
+    Tests for `txspinneret.encoding.CompressedCache`.
+    """
+    def test_compress(self):
+        """
+        Bodies are compressed with the given content coding.
+        """
+        cache = CompressedCache()
+        for encoding in [b'gzip', b'deflate']:
+            self.assertThat(
+                decompress(cache.compress(_BODY, encoding, 6), encoding),
+                Equals(_BODY))
+
+
+    def test_cached(self):
+        """
+        The same body is only compressed once for each content coding and
+        compression level.
+        """
+        cache = CompressedCache()
+        first = cache.compress(_BODY, b'gzip', 6)
+        self.assertThat(cache.compress(_BODY[:], b'gzip', 6), Is(first))
+        cache.compress(_BODY, b'gzip', 9)
+        cache.compress(_BODY, b'deflate', 6)
+        self.assertThat((cache.hits, cache.misses), Equals((1, 3)))
+
+
+    def test_maxBytes(self):
+        """
+        The least recently used bodies are discarded to keep the total size
+        of the compressed bodies within ``maxBytes``.
+        """
+        size = 100 + len(CompressedCache().compress(b'a' * 100, b'gzip', 6))
+        cache = CompressedCache(maxBytes=size * 2)
+        for body in [b'a', b'b', b'a', b'c']:
+            cache.compress(body * 100, b'gzip', 6)
+        cache.compress(b'b' * 100, b'gzip', 6)
+        self.assertThat((cache.hits, cache.misses), Equals((1, 4)))
+        self.assertThat(len(cache), Equals(2))
+        self.assertThat(cache.size, Equals(size * 2))
+
+
+    def test_collision(self):
+        """
+        Different bodies with the same length and checksum are compressed
+        separately.
+        """
+        cache = CompressedCache()
+        self.patch(zlib, 'crc32', lambda data: 0)
+        a = cache.compress(b'a' * 100, b'gzip', 6)
+        b = cache.compress(b'b' * 100, b'gzip', 6)
+        self.assertThat(decompress(a, b'gzip'), Equals(b'a' * 100))
+        self.assertThat(decompress(b, b'gzip'), Equals(b'b' * 100))
+        self.assertThat((cache.misses, len(cache)), Equals((2, 1)))
+
+
+    def test_clear(self):
+        """
+        Clearing the cache discards every compressed body.
+        """
+        cache = CompressedCache()
+        cache.compress(_BODY, b'gzip', 6)
+        cache.clear()
+        self.assertThat((len(cache), cache.size), Equals((0, 0)))
+
+
+
+class EncodingResourceTests(TestCase):
+    """
+    Tests for `txspinneret.encoding.EncodingResource`.
+    """
+    def render(self, handler, acceptEncoding=b'gzip', **kw):
+        """
+        Render a spinneret resource wrapped in `EncodingResource`.
+        """
+        r = request(acceptEncoding)
+        r.render(EncodingResource(SpinneretResource(handler), **kw))
+        return r
+
+
+    def assertEncoded(self, r, encoding, body=_BODY):
+        """
+        Assert that a response is encoded with ``encoding``.
+        """
+        headers = r.responseHeaders
+        self.assertThat(
+            headers.getRawHeaders(b'content-encoding'), Equals([encoding]))
+        self.assertThat(
+            headers.getRawHeaders(b'vary'), Equals([b'Accept-Encoding']))
+        self.assertThat(
+            decompress(b''.join(r.written), encoding), Equals(body))
+        self.assertThat(r.finished, Equals(1))
+
+
+    def assertNotEncoded(self, r, body=_BODY):
+        """
+        Assert that a response is not encoded, but varies on
+        ``Accept-Encoding``.
+        """
+        headers = r.responseHeaders
+        self.assertThat(
+            headers.getRawHeaders(b'content-encoding'), Is(None))
+        self.assertThat(
+            headers.getRawHeaders(b'vary'), Equals([b'Accept-Encoding']))
+        self.assertThat(b''.join(r.written), Equals(body))
+
+
+    def test_encoded(self):
+        """
+        Bodies are encoded with the negotiated content coding.
+        """
+        self.assertEncoded(self.render(_jsonHandler()), b'gzip')
+        self.assertEncoded(
+            self.render(_jsonHandler(), b'deflate, gzip;q=0.5'), b'deflate')
+
+
+    def test_notNegotiated(self):
+        """
+        Bodies are not encoded if no content coding could be negotiated.
+        """
+        self.assertNotEncoded(self.render(_jsonHandler(), None))
+        self.assertNotEncoded(self.render(_jsonHandler(), b'br'))
+
+
+    def test_minimumSize(self):
+        """
+        Bodies smaller than ``minimumSize`` are not encoded.
+        """
+        self.assertNotEncoded(self.render(_jsonHandler(b'{}')), b'{}')
+        self.assertEncoded(
+            self.render(_jsonHandler(b'{}'), minimumSize=2), b'gzip', b'{}')
+
+
+    def test_compressedOnce(self):
+        """
+        The same complete body is only compressed once.
+        """
+        cache = CompressedCache()
+        for _ in range(3):
+            self.assertEncoded(
+                self.render(_jsonHandler(), cache=cache), b'gzip')
+        self.assertThat((cache.hits, cache.misses), Equals((2, 1)))
+
+
+    def test_deferred(self):
+        """
+        Complete bodies written once they are available are encoded as
+        a whole.
+        """
+        cache = CompressedCache()
+        d = Deferred()
+        r = self.render(_jsonHandler(d), cache=cache)
+        d.callback(_BODY)
+        self.assertEncoded(r, b'gzip')
+        self.assertThat(cache.misses, Equals(1))
+
+
+    def test_deferredChild(self):
+        """
+        Responses of children located asynchronously are encoded too.
+        """
+        r = renderDeferredChild(
+            EncodingResource, _jsonHandler(), {b'Accept-Encoding': b'gzip'})
+        self.assertEncoded(r, b'gzip')
+
+
+    def test_streamed(self):
+        """
+        Streamed bodies are compressed as they are written, once there is
+        enough to be worth compressing.
+        """
+        cache = CompressedCache()
+        d = Deferred()
+        chunks = [_BODY[:10], _BODY[10:1500], d]
+        r = self.render(
+            _jsonHandler(
+                iter(chunks), headers={b'Content-Length': b'%d' % (2000,)}),
+            cache=cache)
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'content-length'), Is(None))
+        d.callback(_BODY[1500:])
+        self.assertEncoded(r, b'gzip')
+        self.assertThat(cache.misses, Equals(0))
+
+
+    def test_streamedSmall(self):
+        """
+        Streamed bodies smaller than ``minimumSize`` are not encoded.
+        """
+        self.assertNotEncoded(
+            self.render(_jsonHandler(iter([b'{', b'}']))), b'{}')
+
+
+    def test_notEncoded(self):
+        """
+        Responses without a body, that are already encoded or of a media type
+        that is already compressed are not encoded.
+        """
+        handlers = [
+            _jsonHandler(code=http.NOT_MODIFIED),
+            _jsonHandler(headers={b'Content-Type': b'image/png'}),
+            ]
+        for handler in handlers:
+            self.assertNotEncoded(self.render(handler))
+        r = self.render(_jsonHandler(headers={b'Content-Encoding': b'br'}))
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'content-encoding'),
+            Equals([b'br']))
+        self.assertThat(r.written, Equals([_BODY]))
+
+
+    def test_etag(self):
+        """
+        Strong ``ETag``\\s of encoded responses are made weak.
+        """
+        r = self.render(_jsonHandler(headers={b'ETag': b'"v1"'}))
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'etag'), Equals([b'W/"v1"']))
+        r = self.render(_jsonHandler(headers={b'ETag': b'"v1"'}), None)
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'etag'), Equals([b'"v1"']))
+
+
+    def test_vary(self):
+        """
+        ``Accept-Encoding`` is added to any existing ``Vary`` header.
+        """
+        r = self.render(_jsonHandler(headers={b'Vary': b'Accept'}))
+        self.assertThat(
+            r.responseHeaders.getRawHeaders(b'vary'),
+            Equals([b'Accept', b'Accept-Encoding']))
+
+
+    def test_unsupported(self):
+        """
+        Only supported content codings may be used.
+        """
+        self.assertRaises(
+            ValueError, EncodingResource, SpinneretResource(_jsonHandler()),
+            encodings=[b'br'])
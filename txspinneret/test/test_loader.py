@@ -0,0 +1,147 @@
+from testtools import TestCase
+from testtools.matchers import Equals, Is
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.task import Clock
+
+from txspinneret.loader import Loader
+
+
+
+class _BatchLoad(object):
+    """
+    Batch load function that records the batches it is called with.
+    """
+    def __init__(self, result=None):
+        self.batches = []
+        self.result = result
+
+
+    def __call__(self, keys):
+        self.batches.append(keys)
+        if self.result is not None:
+            return self.result
+        return succeed([key * 2 for key in keys])
+
+
+
+class LoaderTests(TestCase):
+    """
+    Tests for `txspinneret.loader.Loader`.
+    """
+    def setUp(self):
+        super(LoaderTests, self).setUp()
+        self.clock = Clock()
+
+
+    def resolved(self, d):
+        """
+        Get the result of a `Deferred` that has fired.
+        """
+        results = []
+        d.addBoth(results.append)
+        self.assertThat(results, Equals([results[0]]))
+        return results[0]
+
+
+    def test_batch(self):
+        """
+        Keys loaded within the same reactor turn are loaded in one batch.
+        """
+        batchLoad = _BatchLoad()
+        loader = Loader(batchLoad, self.clock)
+        d1 = loader.load(1)
+        d2 = loader.load(2)
+        self.assertThat(batchLoad.batches, Equals([]))
+        self.clock.advance(0)
+        self.assertThat(batchLoad.batches, Equals([[1, 2]]))
+        self.assertThat(self.resolved(d1), Equals(2))
+        self.assertThat(self.resolved(d2), Equals(4))
+        self.assertThat(loader.batches, Equals(1))
+
+
+    def test_coalesce(self):
+        """
+        Loading a key that is already waiting to be loaded shares the result.
+        """
+        batchLoad = _BatchLoad()
+        loader = Loader(batchLoad, self.clock)
+        d1 = loader.load(1)
+        d2 = loader.load(1)
+        self.clock.advance(0)
+        self.assertThat(batchLoad.batches, Equals([[1]]))
+        self.assertThat(self.resolved(d1), Equals(2))
+        self.assertThat(self.resolved(d2), Equals(2))
+        self.assertThat(loader.loads, Equals(2))
+
+
+    def test_coalesceInFlight(self):
+        """
+        Loading a key that is in the process of being loaded shares the result,
+        once the result has been delivered a new load is performed.
+        """
+        result = Deferred()
+        batchLoad = _BatchLoad(result)
+        loader = Loader(batchLoad, self.clock)
+        d1 = loader.load(1)
+        self.clock.advance(0)
+        d2 = loader.load(1)
+        self.clock.advance(0)
+        self.assertThat(batchLoad.batches, Equals([[1]]))
+        result.callback([u'one'])
+        self.assertThat(self.resolved(d1), Equals(u'one'))
+        self.assertThat(self.resolved(d2), Equals(u'one'))
+        batchLoad.result = None
+        loader.load(1)
+        self.clock.advance(0)
+        self.assertThat(batchLoad.batches, Equals([[1], [1]]))
+
+
+    def test_separateTurns(self):
+        """
+        Keys loaded in separate reactor turns are loaded in separate batches.
+        """
+        batchLoad = _BatchLoad()
+        loader = Loader(batchLoad, self.clock)
+        loader.load(1)
+        self.clock.advance(0)
+        loader.load(2)
+        self.clock.advance(0)
+        self.assertThat(batchLoad.batches, Equals([[1], [2]]))
+
+
+    def test_maxBatchSize(self):
+        """
+        Batches are no larger than ``maxBatchSize``.
+        """
+        batchLoad = _BatchLoad()
+        loader = Loader(batchLoad, self.clock, maxBatchSize=2)
+        for key in range(5):
+            loader.load(key)
+        self.clock.advance(0)
+        self.assertThat(batchLoad.batches, Equals([[0, 1], [2, 3], [4]]))
+
+
+    def test_failure(self):
+        """
+        If the batch load fails, every load in the batch fails.
+        """
+        batchLoad = _BatchLoad(fail(RuntimeError('Nope')))
+        loader = Loader(batchLoad, self.clock)
+        d1 = loader.load(1)
+        d2 = loader.load(2)
+        self.clock.advance(0)
+        self.assertThat(self.resolved(d1).type, Is(RuntimeError))
+        self.assertThat(self.resolved(d2).type, Is(RuntimeError))
+
+
+    def test_wrongLength(self):
+        """
+        If the batch load does not return a value for every key, every load in
+        the batch fails.
+        """
+        batchLoad = _BatchLoad(succeed([1]))
+        loader = Loader(batchLoad, self.clock)
+        d = loader.load(1)
+        loader.load(2).addErrback(lambda f: None)
+        self.clock.advance(0)
+        self.assertThat(self.resolved(d).type, Is(ValueError))
@@ -1,20 +1,28 @@
 from functools import partial
 from testtools import TestCase
 from testtools.matchers import (
-    Contains, Equals, ContainsDict, raises, MatchesStructure, MatchesSetwise)
-from twisted.internet.defer import Deferred
+    Contains, Equals, ContainsDict, Is, IsInstance, raises, MatchesStructure,
+    MatchesSetwise, Not)
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.error import ConnectionDone
+from twisted.internet.interfaces import IPullProducer, IPushProducer
+from twisted.python.failure import Failure
 from twisted.python.urlpath import URLPath
 from twisted.web import http
 from twisted.web.error import UnsupportedMethod
 from twisted.web.resource import getChildForRequest, Resource
+from twisted.web.static import Data
 from twisted.web.template import Element, TagLoader, tags
-from zope.interface import implementer
+from twisted.web.util import DeferredResource, Redirect
+from zope.interface import directlyProvides, implementer
 
 from txspinneret.interfaces import INegotiableResource, ISpinneretResource
 from txspinneret.resource import (
-    ContentTypeNegotiator, SpinneretResource, _renderResource)
+    ContentTypeNegotiator, NotFound, SpinneretResource, _AdaptationCache,
+    _RenderableResource, _StreamingResource, _renderResource)
 from txspinneret.util import identity
-from txspinneret.test.util import InMemoryRequest, MatchesException
+from txspinneret.test.util import (
+    InMemoryRequest, MatchesException, captureLoggedErrors)
 
 
 
@@ -99,6 +107,65 @@ class SpinneretResourceTests(TestCase):
         self.assertThat(request.written, Equals([b'hello']))
 
 
+    def test_renderSynchronous(self):
+        """
+        Results that are immediately available are rendered without waiting
+        for the request to finish.
+        """
+        @implementer(ISpinneretResource)
+        class _RenderBytes(object):
+            def render_GET(zelf, request):
+                return b'hello'
+
+        resource = SpinneretResource(_RenderBytes())
+        request = InMemoryRequest([])
+        request.method = b'GET'
+        request.notifyFinish = None
+        self.assertThat(resource.render(request), Equals(b'hello'))
+
+
+    def test_renderSynchronousResource(self):
+        """
+        Immediately available `IResource` results are rendered inline.
+        """
+        @implementer(ISpinneretResource)
+        class _RenderResource(object):
+            def render_GET(zelf, request):
+                return Data(b'hello', b'text/plain')
+
+        resource = SpinneretResource(_RenderResource())
+        request = InMemoryRequest([])
+        request.method = b'GET'
+        request.render(resource)
+        self.assertThat(request.written, Equals([b'hello']))
+        self.assertThat(request.finished, Equals(1))
+
+
+    def test_renderSynchronousFailure(self):
+        """
+        An exception raised while rendering an immediately available result
+        results in the request processing failing.
+        """
+        class _Broken(Resource):
+            def render(zelf, request):
+                raise RuntimeError('Nope')
+
+        @implementer(ISpinneretResource)
+        class _RenderResource(object):
+            def render_GET(zelf, request):
+                return _Broken()
+
+        failures = []
+        resource = SpinneretResource(_RenderResource())
+        request = InMemoryRequest([])
+        request.method = b'GET'
+        request.processingFailed = failures.append
+        request.render(resource)
+        self.assertThat(
+            [f.type for f in failures],
+            Equals([RuntimeError]))
+
+
     def test_locateChildSetPostpath(self):
         """
         The second elements in ``locateChild`` return value is the new request
@@ -114,7 +181,8 @@ class SpinneretResourceTests(TestCase):
         self.assertThat(
             request.postpath,
             Equals([b'foo', b'bar']))
-        getChildForRequest(resource, request)
+        request.prepath.append(request.postpath.pop(0))
+        resource.getChildWithDefault(b'foo', request)
         self.assertThat(
             request.postpath,
             Equals([b'quux']))
@@ -141,8 +209,8 @@ class SpinneretResourceTests(TestCase):
 
     def test_locateChildNotFound(self):
         """
-        If ``locateChild`` returns ``None`` the result is a resource for 404 Not
-        Found.
+        If ``locateChild`` returns ``None`` the result is a resource for 404
+        Not Found.
         """
         @implementer(ISpinneretResource)
         class _TestResource(object):
@@ -308,6 +376,610 @@ class SpinneretResourceTests(TestCase):
             Equals([]))
 
 
+    def test_locateChildNested(self):
+        """
+        Nested spinneret resources are located in a single pass over the path,
+        updating the request's prepath and postpath as Twisted's traversal
+        would.
+        """
+        located = []
+
+        @implementer(ISpinneretResource)
+        class _Nested(object):
+            def __init__(zelf, depth):
+                zelf.depth = depth
+
+            def locateChild(zelf, request, segments):
+                located.append((list(request.prepath), segments))
+                if zelf.depth == 0:
+                    return Data(b'leaf', b'text/plain'), segments[1:]
+                return _Nested(zelf.depth - 1), segments[1:]
+
+        resource = SpinneretResource(_Nested(2))
+        request = InMemoryRequest([b'a', b'b', b'c'])
+        result = getChildForRequest(resource, request)
+        self.assertThat(result, IsInstance(Data))
+        self.assertThat(
+            located,
+            Equals([([b'a'], [b'a', b'b', b'c']),
+                    ([b'a', b'b'], [b'b', b'c']),
+                    ([b'a', b'b', b'c'], [b'c'])]))
+        self.assertThat(request.prepath, Equals([b'a', b'b', b'c']))
+        self.assertThat(request.postpath, Equals([]))
+        request.render(result)
+        self.assertThat(request.written, Equals([b'leaf']))
+
+
+    def test_locateChildSynchronous(self):
+        """
+        A child located synchronously is returned directly, without being
+        deferred.
+        """
+        leaf = Data(b'leaf', b'text/plain')
+
+        @implementer(ISpinneretResource)
+        class _TestResource(object):
+            def locateChild(zelf, request, segments):
+                return leaf, []
+
+        resource = SpinneretResource(_TestResource())
+        request = InMemoryRequest([b'foo'])
+        self.assertThat(getChildForRequest(resource, request), Is(leaf))
+
+
+    def test_locateChildDeferred(self):
+        """
+        A child located asynchronously is deferred.
+        """
+        @implementer(ISpinneretResource)
+        class _TestResource(object):
+            def locateChild(zelf, request, segments):
+                return succeed((Data(b'leaf', b'text/plain'), []))
+
+        resource = SpinneretResource(_TestResource())
+        request = InMemoryRequest([b'foo'])
+        result = getChildForRequest(resource, request)
+        self.assertThat(result, IsInstance(DeferredResource))
+        request.render(result)
+        self.assertThat(request.written, Equals([b'leaf']))
+
+
+    def test_locateChildDeferredChild(self):
+        """
+        If ``locateChild`` returns a `Deferred` child, the child is adapted
+        once it fires.
+        """
+        d = Deferred()
+
+        @implementer(ISpinneretResource)
+        class _TestResource(object):
+            def locateChild(zelf, request, segments):
+                return d, []
+
+        resource = SpinneretResource(_TestResource())
+        request = InMemoryRequest([b'foo'])
+        request.method = b'GET'
+        request.render(getChildForRequest(resource, request))
+        self.assertThat(request.written, Equals([]))
+        d.callback(_RenderBody(b'leaf'))
+        self.assertThat(request.written, Equals([b'leaf']))
+        self.assertThat(request.finished, Equals(1))
+        self.assertThat(request.postpath, Equals([]))
+
+
+    def test_locateChildFailure(self):
+        """
+        An exception raised while locating a child results in the request
+        processing failing, when it is rendered.
+        """
+        @implementer(ISpinneretResource)
+        class _TestResource(object):
+            def locateChild(zelf, request, segments):
+                raise RuntimeError('Nope')
+
+        failures = []
+        resource = SpinneretResource(_TestResource())
+        request = InMemoryRequest([b'foo'])
+        request.processingFailed = failures.append
+        result = getChildForRequest(resource, request)
+        request.render(result)
+        self.assertThat(
+            [f.type for f in failures],
+            Equals([RuntimeError]))
+
+
+    def test_locateChildCancelled(self):
+        """
+        If the request finishes before a child has been located
+        asynchronously, such as when the client disconnects, the `Deferred`
+        returned by ``locateChild`` is cancelled, without the request
+        processing failing.
+        """
+        cancelled = []
+        d = Deferred(cancelled.append)
+
+        @implementer(ISpinneretResource)
+        class _TestResource(object):
+            def locateChild(zelf, request, segments):
+                return d
+
+        failures = []
+        resource = SpinneretResource(_TestResource())
+        request = InMemoryRequest([b'foo'])
+        request.processingFailed = failures.append
+        request.render(getChildForRequest(resource, request))
+        InMemoryRequest.processingFailed(request, Failure(ConnectionDone()))
+        self.assertThat(cancelled, Equals([d]))
+        self.assertThat(failures, Equals([]))
+        self.assertThat(request.written, Equals([]))
+
+
+    def test_locateChildNestedCancelled(self):
+        """
+        Cancellation is propagated to the `Deferred` returned by
+        ``locateChild`` of a nested spinneret resource that is being waited
+        on.
+        """
+        cancelled = []
+        outer = Deferred()
+        inner = Deferred(cancelled.append)
+
+        @implementer(ISpinneretResource)
+        class _Inner(object):
+            def locateChild(zelf, request, segments):
+                return inner
+
+        @implementer(ISpinneretResource)
+        class _Outer(object):
+            def locateChild(zelf, request, segments):
+                return outer
+
+        resource = SpinneretResource(_Outer())
+        request = InMemoryRequest([b'foo', b'bar'])
+        request.render(getChildForRequest(resource, request))
+        outer.callback((_Inner(), [b'bar']))
+        request.processingFailed(Failure(ConnectionDone()))
+        self.assertThat(cancelled, Equals([inner]))
+
+
+    def test_renderCancelled(self):
+        """
+        If the request finishes before the `Deferred` returned by a render
+        method fires it is cancelled, without the request processing failing.
+        """
+        cancelled = []
+        d = Deferred(cancelled.append)
+
+        @implementer(ISpinneretResource)
+        class _TestResource(object):
+            def render_GET(zelf, request):
+                return d
+
+        failures = []
+        request = InMemoryRequest([])
+        request.method = b'GET'
+        request.processingFailed = failures.append
+        request.render(SpinneretResource(_TestResource()))
+        InMemoryRequest.processingFailed(request, Failure(ConnectionDone()))
+        self.assertThat(cancelled, Equals([d]))
+        self.assertThat(failures, Equals([]))
+
+
+    def test_locateChildNestedDeferred(self):
+        """
+        Nested spinneret resources may be located asynchronously.
+        """
+        d = Deferred()
+
+        @implementer(ISpinneretResource)
+        class _Leaf(object):
+            def locateChild(zelf, request, segments):
+                return Data(segments[0], b'text/plain'), []
+
+        @implementer(ISpinneretResource)
+        class _TestResource(object):
+            def locateChild(zelf, request, segments):
+                return d
+
+        resource = SpinneretResource(_TestResource())
+        request = InMemoryRequest([b'foo', b'bar'])
+        result = getChildForRequest(resource, request)
+        request.render(result)
+        self.assertThat(request.written, Equals([]))
+        d.callback((_Leaf(), [b'bar']))
+        self.assertThat(request.written, Equals([b'bar']))
+        self.assertThat(request.prepath, Equals([b'foo', b'bar']))
+
+
+    def test_locateChildResourceBoundary(self):
+        """
+        Traversal of resources that are not spinneret resources is left to
+        Twisted, which continues from the located resource without deferring
+        anything.
+        """
+        leaf = Data(b'leaf', b'text/plain')
+        child = Resource()
+        child.putChild(b'bar', leaf)
+
+        @implementer(ISpinneretResource)
+        class _TestResource(object):
+            def locateChild(zelf, request, segments):
+                return child, segments[1:]
+
+        resource = SpinneretResource(_TestResource())
+        request = InMemoryRequest([b'foo', b'bar'])
+        result = getChildForRequest(resource, request)
+        self.assertThat(result, Is(leaf))
+        self.assertThat(request.postpath, Equals([]))
+        request.render(result)
+        self.assertThat(request.written, Equals([b'leaf']))
+
+
+
+@implementer(ISpinneretResource)
+class _RenderBody(object):
+    """
+    Spinneret resource rendering a given body.
+    """
+    def __init__(self, body):
+        self.body = body
+
+
+    def render_GET(self, request):
+        return self.body
+
+
+
+class _Producer(object):
+    """
+    Producer that records the calls made to it.
+    """
+    def __init__(self):
+        self.calls = []
+
+
+    def pauseProducing(self):
+        self.calls.append('pause')
+
+
+    def resumeProducing(self):
+        self.calls.append('resume')
+
+
+    def stopProducing(self):
+        self.calls.append('stop')
+
+
+
+class StreamingTests(TestCase):
+    """
+    Tests for streaming response bodies from `SpinneretResource`.
+    """
+    def render(self, body):
+        """
+        Render a spinneret resource whose body is ``body``.
+        """
+        request = InMemoryRequest([])
+        request.method = b'GET'
+        request.render(SpinneretResource(_RenderBody(body)))
+        return request
+
+
+    def test_iterator(self):
+        """
+        The items of an iterator are written to the request, once they are
+        exhausted the request is finished.
+        """
+        request = self.render(iter([b'foo', b'bar']))
+        self.assertThat(request.written, Equals([b'foo', b'bar']))
+        self.assertThat(request.finished, Equals(1))
+        self.assertThat(request.producer, Is(None))
+
+
+    def test_deferredItems(self):
+        """
+        Items that are `Deferred` are waited on before producing the next
+        item.
+        """
+        d = Deferred()
+        request = self.render(iter([succeed(b'foo'), d, b'baz']))
+        self.assertThat(request.written, Equals([b'foo']))
+        self.assertThat(request.finished, Equals(0))
+        d.callback(b'bar')
+        self.assertThat(request.written, Equals([b'foo', b'bar', b'baz']))
+        self.assertThat(request.finished, Equals(1))
+
+
+    def test_deferredBody(self):
+        """
+        A `Deferred` that fires with an iterator streams the iterator.
+        """
+        d = Deferred()
+        request = self.render(d)
+        d.callback(iter([b'foo', b'bar']))
+        self.assertThat(request.written, Equals([b'foo', b'bar']))
+        self.assertThat(request.finished, Equals(1))
+
+
+    def test_backpressure(self):
+        """
+        Nothing is produced while the producer is paused.
+        """
+        request = InMemoryRequest([])
+        request.method = b'GET'
+        write = request.write
+        def _write(data):
+            write(data)
+            request.producer.pauseProducing()
+        request.write = _write
+        request.render(SpinneretResource(_RenderBody(iter([b'foo', b'bar']))))
+        self.assertThat(request.written, Equals([b'foo']))
+        self.assertThat(request.streaming, Equals(True))
+        request.producer.resumeProducing()
+        self.assertThat(request.written, Equals([b'foo', b'bar']))
+        self.assertThat(request.finished, Equals(0))
+        request.producer.resumeProducing()
+        self.assertThat(request.finished, Equals(1))
+
+
+    def test_disconnect(self):
+        """
+        If the request finishes prematurely, the `Deferred` being waited on is
+        cancelled, the iterator is closed and nothing more is produced.
+        """
+        closed = []
+        cancelled = []
+        d = Deferred(cancelled.append)
+        def _body():
+            try:
+                yield b'foo'
+                yield d
+                yield b'bar'
+            finally:
+                closed.append(True)
+        request = self.render(_body())
+        request.processingFailed(Failure(ConnectionDone()))
+        self.assertThat(closed, Equals([True]))
+        self.assertThat(request.written, Equals([b'foo']))
+        self.assertThat(cancelled, Equals([d]))
+
+
+    def test_failureBeforeWriting(self):
+        """
+        If producing fails before anything is written, the request processing
+        fails.
+        """
+        def _body():
+            raise RuntimeError('Nope')
+            yield
+        failures = []
+        request = InMemoryRequest([])
+        request.method = b'GET'
+        request.processingFailed = failures.append
+        request.render(SpinneretResource(_RenderBody(_body())))
+        self.assertThat(
+            [f.type for f in failures],
+            Equals([RuntimeError]))
+
+
+    def test_failureAfterWriting(self):
+        """
+        If producing fails after something has been written, the connection is
+        closed.
+        """
+        errors = captureLoggedErrors(self)
+        d = Deferred()
+        request = self.render(iter([b'foo', d]))
+        d.errback(RuntimeError('Nope'))
+        self.assertThat(request.written, Equals([b'foo']))
+        self.assertThat(request.connectionLost, Equals(True))
+        self.assertThat(request.producer, Is(None))
+        self.assertThat(
+            [failure.type for failure in errors],
+            Equals([RuntimeError]))
+
+
+    def test_pushProducer(self):
+        """
+        `IPushProducer` providers are registered with the request as streaming
+        producers, and started.
+        """
+        producer = _Producer()
+        directlyProvides(producer, IPushProducer)
+        request = self.render(producer)
+        self.assertThat(request.streaming, Equals(True))
+        self.assertThat(producer.calls, Equals(['resume']))
+        request.producer.pauseProducing()
+        self.assertThat(producer.calls, Equals(['resume', 'pause']))
+
+
+    def test_pullProducer(self):
+        """
+        `IPullProducer` providers are registered with the request as
+        non-streaming producers.
+        """
+        producer = _Producer()
+        directlyProvides(producer, IPullProducer)
+        request = self.render(producer)
+        self.assertThat(request.streaming, Equals(False))
+        self.assertThat(producer.calls, Equals([]))
+        request.producer.resumeProducing()
+        self.assertThat(producer.calls, Equals(['resume']))
+
+
+    def test_producerDisconnect(self):
+        """
+        Producers are stopped, only once, if the request finishes
+        prematurely.
+        """
+        producer = _Producer()
+        directlyProvides(producer, IPushProducer)
+        request = self.render(producer)
+        request.processingFailed(Failure(ConnectionDone()))
+        request.producer.stopProducing()
+        self.assertThat(producer.calls, Equals(['resume', 'stop']))
+
+
+
+@implementer(ISpinneretResource)
+class _Spinneret(object):
+    """
+    Spinneret resource.
+    """
+
+
+
+class _StableSpinneret(_Spinneret):
+    """
+    Spinneret resource that is returned for many requests.
+    """
+    stable = True
+
+
+
+class _Body(Resource):
+    """
+    Leaf resource.
+    """
+    isLeaf = True
+
+
+
+class AdaptationCacheTests(TestCase):
+    """
+    Tests for `txspinneret.resource._AdaptationCache`.
+    """
+    def test_none(self):
+        """
+        ``None`` is adapted to a ``404 Not Found`` resource.
+        """
+        cache = _AdaptationCache()
+        self.assertThat(cache.adapt(None), IsInstance(NotFound))
+
+
+    def test_adaptions(self):
+        """
+        Results are adapted to `IResource` according to what they provide.
+        """
+        cache = _AdaptationCache()
+        resource = Data(b'', b'text/plain')
+        self.assertThat(cache.adapt(resource), Is(resource))
+        self.assertThat(
+            cache.adapt(_Spinneret()), IsInstance(SpinneretResource))
+        self.assertThat(
+            cache.adapt(Element()), IsInstance(_RenderableResource))
+        self.assertThat(
+            cache.adapt(URLPath.fromString('http://example.com/')),
+            IsInstance(Redirect))
+        self.assertThat(
+            cache.adapt(iter([])), IsInstance(_StreamingResource))
+        self.assertThat(cache.adapt(b'hello'), Equals(b'hello'))
+
+
+    def test_notStreamed(self):
+        """
+        Iterables that are not iterators, and `Deferred`, are not streamed.
+        """
+        cache = _AdaptationCache()
+        d = Deferred()
+        self.assertThat(cache.adapt(d), Is(d))
+        self.assertThat(cache.adapt([b'foo']), Equals([b'foo']))
+        self.assertThat(
+            cache.adapt({b'foo': b'bar'}), Equals({b'foo': b'bar'}))
+
+
+    def test_cached(self):
+        """
+        The adaption is looked up once per type of result.
+        """
+        cache = _AdaptationCache()
+        cache.adapt(Data(b'', b'text/plain'))
+        cache.adapt(Data(b'', b'text/plain'))
+        cache.adapt(b'hello')
+        self.assertThat(
+            (cache.hits, cache.misses),
+            Equals((1, 2)))
+
+
+    def test_maxTypes(self):
+        """
+        Adaptions are discarded once there are more than ``maxTypes`` of them.
+        """
+        cache = _AdaptationCache(maxTypes=1)
+        cache.adapt(b'hello')
+        cache.adapt(Data(b'', b'text/plain'))
+        cache.adapt(b'hello')
+        self.assertThat(
+            (cache.hits, cache.misses),
+            Equals((0, 3)))
+
+
+    def test_directlyProvides(self):
+        """
+        Results that directly provide interfaces are not adapted according to
+        their type.
+        """
+        cache = _AdaptationCache()
+        self.assertThat(cache.adapt(_Body()), IsInstance(_Body))
+        body = _Body()
+        directlyProvides(body, ISpinneretResource)
+        self.assertThat(cache.adapt(body), IsInstance(SpinneretResource))
+        self.assertThat(
+            (cache.hits, cache.misses),
+            Equals((0, 1)))
+
+
+    def test_reuseWrapper(self):
+        """
+        Adapting the same stable spinneret resource again reuses its wrapper.
+        """
+        cache = _AdaptationCache()
+        spinneret = _StableSpinneret()
+        wrapper = cache.adapt(spinneret)
+        self.assertThat(cache.adapt(spinneret), Is(wrapper))
+        self.assertThat(cache.adapt(_StableSpinneret()), Not(Is(wrapper)))
+        self.assertThat(
+            (cache.wrapperHits, cache.wrapperMisses),
+            Equals((1, 2)))
+
+
+    def test_unstableWrapper(self):
+        """
+        Spinneret resources that are not stable are not kept, and are wrapped
+        every time they are adapted.
+        """
+        cache = _AdaptationCache()
+        spinneret = _Spinneret()
+        wrapper = cache.adapt(spinneret)
+        self.assertThat(cache.adapt(spinneret), Not(Is(wrapper)))
+        self.assertThat(cache._wrappers, Equals({}))
+
+
+    def test_noWrappers(self):
+        """
+        Wrappers are not reused if ``maxWrappers`` is ``0``.
+        """
+        cache = _AdaptationCache(maxWrappers=0)
+        spinneret = _StableSpinneret()
+        wrapper = cache.adapt(spinneret)
+        self.assertThat(cache.adapt(spinneret), Not(Is(wrapper)))
+        self.assertThat(
+            (cache.wrapperHits, cache.wrapperMisses),
+            Equals((0, 2)))
+
+
+    def test_clear(self):
+        """
+        Clearing the cache discards adaptions and wrappers.
+        """
+        cache = _AdaptationCache()
+        spinneret = _StableSpinneret()
+        wrapper = cache.adapt(spinneret)
+        cache.clear()
+        self.assertThat(cache.adapt(spinneret), Not(Is(wrapper)))
+        self.assertThat(cache.misses, Equals(2))
+
+
 
 @implementer(INegotiableResource)
 class _FooJSON(Resource):
@@ -1,15 +1,27 @@
+import os
+import re
+import uuid
 from collections import OrderedDict
+from shutil import rmtree
+from tempfile import mkdtemp
 
 from testtools import TestCase
-from testtools.matchers import Equals, Is, Not
+from testtools.matchers import Contains, Equals, HasLength, Is, Not, raises
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
 from twisted.web import http
 from twisted.web.http_headers import Headers
-from twisted.web.resource import getChildForRequest
+from twisted.web.resource import Resource, getChildForRequest
 from twisted.web.static import Data
 
 from txspinneret.route import (
-    Integer, route, routedResource, Router, subroute, Text)
-from txspinneret.test.util import InMemoryRequest
+    Choice, Integer, Load, Regex, Rest, route, routedResource, Router,
+    subroute, Text, UUID, findShadowedRoutes,
+    _CachingRouteTable, _prioritiseRoutes, _DispatcherSource,
+    _GeneratedDispatcher, _RouteFilter, _RouteTrie)
+from txspinneret.loader import Loader
+from txspinneret.util import LRUCache
+from txspinneret.test.util import InMemoryRequest, captureLoggedErrors
 
 
 
@@ -17,10 +29,11 @@ class MockRequest(object):
     """
     A mock `twisted.web.iweb.IRequest`.
     """
-    def __init__(self, requestHeaders=None):
+    def __init__(self, requestHeaders=None, method=b'GET'):
         if requestHeaders is None:
             requestHeaders = Headers()
         self.requestHeaders = requestHeaders
+        self.method = method
 
 
 
@@ -114,6 +127,195 @@ class IntegerParameterTests(TestCase):
             Equals((b'foo', None)))
 
 
+    def test_signed(self):
+        """
+        Decimal values may have a sign.
+        """
+        request = MockRequest()
+        match = Integer(b'foo')
+        self.assertThat(
+            match(request, b'-42'),
+            Equals((b'foo', -42)))
+        self.assertThat(
+            match(request, b'+42'),
+            Equals((b'foo', 42)))
+
+
+    def test_notDigits(self):
+        """
+        ``None`` is returned if a decimal value is not made up of ASCII
+        digits.
+        """
+        request = MockRequest()
+        match = Integer(b'foo')
+        for value in [b'', b'-', b'4 2', b' 42', b'4.2', b'\xd9\xa4']:
+            self.assertThat(
+                match(request, value),
+                Equals((b'foo', None)))
+
+
+    def test_base(self):
+        """
+        Values in other bases are parsed.
+        """
+        request = MockRequest()
+        match = Integer(b'foo', base=16)
+        self.assertThat(
+            match(request, b'ff'),
+            Equals((b'foo', 255)))
+        self.assertThat(
+            match(request, b'fg'),
+            Equals((b'foo', None)))
+
+
+    def test_bounds(self):
+        """
+        ``None`` is returned if the value is outside of the inclusive
+        bounds.
+        """
+        request = MockRequest()
+        match = Integer(b'foo', minimum=1, maximum=10)
+        self.assertThat(
+            [match(request, value)[1]
+             for value in [b'0', b'1', b'10', b'11', b'-5']],
+            Equals([None, 1, 10, None, None]))
+
+
+
+class UUIDParameterTests(TestCase):
+    """
+    Tests for `txspinneret.route.UUID`.
+    """
+    def test_match(self):
+        """
+        Hexadecimal values, with or without hyphens, are parsed as UUIDs.
+        """
+        request = MockRequest()
+        match = UUID(b'foo')
+        expected = uuid.UUID(b'12345678-1234-5678-1234-567812345678')
+        self.assertThat(
+            match(request, b'12345678-1234-5678-1234-567812345678'),
+            Equals((b'foo', expected)))
+        self.assertThat(
+            match(request, b'12345678123456781234567812345678'),
+            Equals((b'foo', expected)))
+
+
+    def test_noMatch(self):
+        """
+        ``None`` is returned if the value is not a UUID.
+        """
+        request = MockRequest()
+        match = UUID(b'foo')
+        for value in [b'', b'42', b'12345678-1234-5678-1234-56781234567g',
+                      b'12345678-1234-5678-1234-5678123456789']:
+            self.assertThat(
+                match(request, value),
+                Equals((b'foo', None)))
+
+
+
+class ChoiceParameterTests(TestCase):
+    """
+    Tests for `txspinneret.route.Choice`.
+    """
+    def test_choices(self):
+        """
+        Only values that are one of the choices match.
+        """
+        request = MockRequest()
+        match = Choice(b'foo', [b'asc', b'desc'])
+        self.assertThat(
+            match(request, b'asc'),
+            Equals((b'foo', b'asc')))
+        self.assertThat(
+            match(request, b'up'),
+            Equals((b'foo', None)))
+
+
+    def test_mapping(self):
+        """
+        Choices may be a mapping of segment values to parameter values.
+        """
+        request = MockRequest()
+        match = Choice(b'foo', {b'asc': 1, b'desc': -1})
+        self.assertThat(
+            match(request, b'desc'),
+            Equals((b'foo', -1)))
+        self.assertThat(
+            match(request, b'up'),
+            Equals((b'foo', None)))
+
+
+
+class RegexParameterTests(TestCase):
+    """
+    Tests for `txspinneret.route.Regex`.
+    """
+    def test_match(self):
+        """
+        Values that entirely match the pattern are parsed as text.
+        """
+        request = MockRequest()
+        match = Regex(b'foo', b'[a-z]+-\\d+')
+        self.assertThat(
+            match(request, b'abc-42'),
+            Equals((b'foo', u'abc-42')))
+        self.assertThat(
+            match(request, b'abc-42x'),
+            Equals((b'foo', None)))
+        self.assertThat(
+            match(request, b'ABC-42'),
+            Equals((b'foo', None)))
+
+
+    def test_compiled(self):
+        """
+        Precompiled patterns are used with their flags.
+        """
+        request = MockRequest()
+        match = Regex(b'foo', re.compile(b'[a-z]+', re.IGNORECASE))
+        self.assertThat(
+            match(request, b'ABC'),
+            Equals((b'foo', u'ABC')))
+        self.assertThat(
+            match(request, b'42'),
+            Equals((b'foo', None)))
+
+
+    def test_compiledEntireSegment(self):
+        """
+        Precompiled patterns must also match the entire segment.
+        """
+        request = MockRequest()
+        match = Regex(b'foo', re.compile(b'\\d+'))
+        self.assertThat(
+            match(request, b'12'),
+            Equals((b'foo', u'12')))
+        self.assertThat(
+            match(request, b'12abc'),
+            Equals((b'foo', None)))
+
+
+
+class RestParameterTests(TestCase):
+    """
+    Tests for `txspinneret.route.Rest`.
+    """
+    def test_match(self):
+        """
+        Every segment is parsed as text.
+        """
+        request = MockRequest()
+        match = Rest(b'foo')
+        self.assertThat(
+            match(request, [b'a', b'\xe2\x98\x83']),
+            Equals((b'foo', [u'a', u'\N{SNOWMAN}'])))
+        self.assertThat(
+            match(request, []),
+            Equals((b'foo', [])))
+
+
 
 class StaticRouteTests(TestCase):
     """
@@ -320,6 +522,115 @@ class DynamicRouteTests(TestCase):
 
 
 
+class RestRouteTests(TestCase):
+    """
+    Tests for `txspinneret.route.route` using `Rest`.
+    """
+    def test_rest(self):
+        """
+        All of the remaining segments are matched.
+        """
+        request = MockRequest()
+        match = route(b'files', Rest(b'path'))
+        self.assertThat(
+            match(request, [b'files', b'a', b'b']),
+            Equals((OrderedDict([(b'path', [u'a', u'b'])]), [])))
+        self.assertThat(
+            match(request, [b'files']),
+            Equals((OrderedDict([(b'path', [])]), [])))
+        self.assertThat(
+            match(request, [b'other', b'a']),
+            Equals((None, [b'other', b'a'])))
+
+
+    def test_subroute(self):
+        """
+        A subroute matching the rest of the path leaves no remaining segments.
+        """
+        request = MockRequest()
+        self.assertThat(
+            subroute(Rest(b'path'))(request, [b'a', b'b']),
+            Equals((OrderedDict([(b'path', [u'a', u'b'])]), [])))
+
+
+    def test_notLast(self):
+        """
+        `Rest` may only be the last route component.
+        """
+        self.assertThat(
+            lambda: route(Rest(b'path'), b'foo'),
+            raises(ValueError))
+
+
+
+class MethodRouteTests(TestCase):
+    """
+    Tests for `txspinneret.route.route` and `txspinneret.route.subroute` with
+    ``methods``.
+    """
+    def test_methods(self):
+        """
+        Only requests with one of the route's methods match.
+        """
+        match = route(b'foo', methods=[b'POST', b'put'])
+        self.assertThat(
+            match(MockRequest(method=b'POST'), [b'foo']),
+            Equals((OrderedDict(), [])))
+        self.assertThat(
+            match(MockRequest(method=b'PUT'), [b'foo']),
+            Equals((OrderedDict(), [])))
+        self.assertThat(
+            match(MockRequest(method=b'GET'), [b'foo']),
+            Equals((None, [b'foo'])))
+
+
+    def test_singleMethod(self):
+        """
+        A single method can be given as `bytes`, rather than an iterable of
+        methods.
+        """
+        match = route(b'foo', methods=b'post')
+        self.assertThat(match.methods, Equals(frozenset([b'POST'])))
+        self.assertThat(
+            match(MockRequest(method=b'POST'), [b'foo']),
+            Equals((OrderedDict(), [])))
+        self.assertThat(
+            match(MockRequest(method=b'GET'), [b'foo']),
+            Equals((None, [b'foo'])))
+
+
+    def test_head(self):
+        """
+        ``HEAD`` is implied by ``GET``.
+        """
+        match = subroute(b'foo', methods=[b'GET'])
+        self.assertThat(match.methods, Equals(frozenset([b'GET', b'HEAD'])))
+        self.assertThat(
+            match(MockRequest(method=b'HEAD'), [b'foo', b'bar']),
+            Equals((OrderedDict(), [b'bar'])))
+
+
+    def test_anyMethod(self):
+        """
+        Routes match any method by default.
+        """
+        match = route(b'foo')
+        self.assertThat(match.methods, Is(None))
+        self.assertThat(
+            match(MockRequest(method=b'DELETE'), [b'foo']),
+            Equals((OrderedDict(), [])))
+
+
+    def test_unexpectedArguments(self):
+        """
+        Unexpected keyword arguments are rejected.
+        """
+        self.assertThat(
+            lambda: route(b'foo', method=b'GET'),
+            raises(TypeError))
+
+
+
 class MixedRouteTests(TestCase):
     """
     Tests for `txspinneret.route.route` using mixed static and dynamic path
@@ -366,159 +677,1466 @@ class MixedRouteTests(TestCase):
 
 
 
-class _RoutedThing(object):
+def _routes(*matchers):
     """
-    Basic router.
+    Create a list of routes, suitable for `_RouteTrie`, from route matchers.
     """
-    router = Router()
-
-    @router.route(b'foo')
-    @router.route(b'foo2')
-    def foo(self, request, params):
-        return Data(b'hello world', b'text/plain')
-
-
-    @router.route()
-    def null(self, request, params):
-        return Data(b'null route', b'text/plain')
+    return [(b'route%d' % (i,), None, matcher)
+            for i, matcher in enumerate(matchers)]
 
 
 
-class _SubroutedThing(object):
+class RouteTrieTests(TestCase):
     """
-    Basic sub-router.
+    Tests for `txspinneret.route._RouteTrie`.
     """
-    router = Router()
-    otherRouter = Router()
-
-    @router.subroute(b'bar')
-    def bar(self, request, params):
-        return _RoutedThing().router.resource()
-
+    def table(self, routes):
+        """
+        Compile routes.
+        """
+        return _RouteTrie(routes)
 
-    @otherRouter.route(b'other')
-    def other(self, request, params):
-        return Data(b'other router', b'text/plain')
 
+    def test_noRoutes(self):
+        """
+        Nothing matches if there are no routes.
+        """
+        trie = self.table([])
+        self.assertThat(
+            trie.match(MockRequest(), []),
+            Is(None))
 
 
-def renderRoute(resource, segments):
-    """
-    Locate and render a child resource.
+    def test_noMatch(self):
+        """
+        ``None`` is returned if no route matches.
+        """
+        trie = self.table(_routes(route('foo'), route(Integer('id'))))
+        self.assertThat(
+            trie.match(MockRequest(), ['bar']),
+            Is(None))
 
-    @type  resource: `IResource`
-    @param resource: Resource to locate the child resource on.
 
-    @type  segments: `list` of `bytes`
-    @param segments: Path segments.
+    def test_match(self):
+        """
+        The index of the matching route, the parameters and remaining segments
+        are returned.
+        """
+        trie = self.table(_routes(
+            route('foo'),
+            route('foo', Integer('id')),
+            subroute('bar', Text('name'))))
+        request = MockRequest()
+        self.assertThat(
+            trie.match(request, ['foo']),
+            Equals((0, OrderedDict(), [])))
+        self.assertThat(
+            trie.match(request, ['foo', '42']),
+            Equals((1, OrderedDict([('id', 42)]), [])))
+        self.assertThat(
+            trie.match(request, ['bar', 'bob', 'quux']),
+            Equals((2, OrderedDict([('name', u'bob')]), ['quux'])))
 
-    @return: Request.
-    """
-    request = InMemoryRequest(segments)
-    child = getChildForRequest(resource, request)
-    request.render(child)
-    return request
 
+    def test_nullRoutes(self):
+        """
+        The null route only matches zero segments, while the null subroute
+        matches any segments.
+        """
+        request = MockRequest()
+        trie = self.table(_routes(route(), subroute()))
+        self.assertThat(
+            trie.match(request, []),
+            Equals((0, OrderedDict(), [])))
+        self.assertThat(
+            trie.match(request, ['foo', 'bar']),
+            Equals((1, OrderedDict(), ['foo', 'bar'])))
 
 
-class RouterTests(TestCase):
-    """
-    Tests for `txspinneret.resource.Router`.
-    """
-    def test_descriptorRouter(self):
+    def test_firstDeclaredWins(self):
         """
-        `Router.__get__` returns the `Router` instance when accessed via
-        a type.
+        When several routes match, the first declared one wins regardless of
+        whether literal or parameter components are involved.
         """
-        _router = Router()
-        class _Descriptor(object):
-            router = _router
+        request = MockRequest()
+        trie = self.table(_routes(
+            route(Text('name'), 'bar'),
+            route('foo', Text('name')),
+            route('foo', 'bar')))
+        self.assertThat(
+            trie.match(request, ['foo', 'bar']),
+            Equals((0, OrderedDict([('name', u'foo')]), [])))
+        self.assertThat(
+            trie.match(request, ['foo', 'quux']),
+            Equals((1, OrderedDict([('name', u'quux')]), [])))
 
+        trie = self.table(_routes(
+            route('foo', 'bar'),
+            route(Text('name'), 'bar')))
         self.assertThat(
-            _Descriptor.router,
-            Is(_router))
+            trie.match(request, ['foo', 'bar']),
+            Equals((0, OrderedDict(), [])))
 
 
-    def test_descriptorObject(self):
+    def test_subrouteBeforeRoute(self):
         """
-        `Router.__get__` returns the instance of the object it's an attribute
-        of when accessed via an instance.
+        An earlier subroute wins over a later, longer, exact route.
         """
-        thing = _RoutedThing()
+        request = MockRequest()
+        trie = self.table(_routes(
+            subroute('foo'),
+            route('foo', 'bar')))
         self.assertThat(
-            thing.router._self,
-            Is(thing))
+            trie.match(request, ['foo', 'bar']),
+            Equals((0, OrderedDict(), ['bar'])))
 
 
-    def test_nullRoute(self):
+    def test_rest(self):
         """
-        Match the null route.
+        Routes ending in `Rest` match any number of further segments, the
+        first declared matching route wins.
         """
-        resource = _RoutedThing().router.resource()
+        request = MockRequest()
+        trie = self.table(_routes(
+            route(b'files', b'special'),
+            route(b'files', Rest(b'path')),
+            route(b'files', b'a', b'b'),
+            route(Rest(b'other'))))
         self.assertThat(
-            renderRoute(resource, []).written,
-            Equals([b'null route']))
+            trie.match(request, [b'files', b'special']),
+            Equals((0, OrderedDict(), [])))
+        self.assertThat(
+            trie.match(request, [b'files', b'a', b'b']),
+            Equals((1, OrderedDict([(b'path', [u'a', u'b'])]), [])))
+        self.assertThat(
+            trie.match(request, [b'files']),
+            Equals((1, OrderedDict([(b'path', [])]), [])))
+        self.assertThat(
+            trie.match(request, [b'quux', b'a']),
+            Equals((3, OrderedDict([(b'other', [u'quux', u'a'])]), [])))
 
 
-    def test_nullRouteNoMatch(self):
+    def test_equivalentMatchers(self):
         """
-        If there is no route that can match the request path return 404 Not
-        Found.
+        Equivalent matchers, created with the same arguments, share an edge
+        while other matchers do not.
         """
-        resource = _SubroutedThing().router.resource()
+        routes = _routes(
+            route(Integer(b'id'), b'a'),
+            route(Integer(b'id'), b'b'),
+            route(Integer(b'id', base=16), b'c'),
+            route(Choice(b'id', {b'x': [1]}), b'd'),
+            route(Choice(b'id', {b'x': [1]}), b'e'))
+        self.assertThat(_RouteTrie(routes)._root.matchers, HasLength(4))
+        request = MockRequest()
+        trie = self.table(routes)
+        self.assertThat(
+            trie.match(request, [b'42', b'b']),
+            Equals((1, OrderedDict([(b'id', 42)]), [])))
+        self.assertThat(
+            trie.match(request, [b'1a', b'c']),
+            Equals((2, OrderedDict([(b'id', 26)]), [])))
+        self.assertThat(
+            trie.match(request, [b'x', b'e']),
+            Equals((4, OrderedDict([(b'id', [1])]), [])))
+
+
+    def test_skipsUnneededMatchers(self):
+        """
+        Parameter matchers for routes that cannot beat an existing match are
+        not called.
+        """
+        calls = []
+        def _match(request, value):
+            calls.append(value)
+            return b'name', value
+
+        request = MockRequest()
+        trie = self.table(_routes(
+            route('foo'),
+            route(_match)))
+        self.assertThat(
+            trie.match(request, ['foo']),
+            Equals((0, OrderedDict(), [])))
+        self.assertThat(calls, Equals([]))
+        self.assertThat(
+            trie.match(request, ['bar']),
+            Equals((1, OrderedDict([(b'name', 'bar')]), [])))
+        self.assertThat(calls, Equals(['bar']))
+
+
+
+class GeneratedDispatcherTests(RouteTrieTests):
+    """
+    Tests for `txspinneret.route._GeneratedDispatcher`.
+    """
+    def table(self, routes):
+        return _GeneratedDispatcher(_RouteTrie(routes))
+
+
+    def assertSameMatches(self, routes, paths):
+        """
+        Assert that the generated dispatcher and the trie produce the same
+        results for every path.
+        """
+        request = MockRequest()
+        trie = _RouteTrie(routes)
+        dispatcher = _GeneratedDispatcher(trie)
+        for segments in paths:
+            self.assertThat(
+                dispatcher.match(request, segments),
+                Equals(trie.match(request, segments)))
+
+
+    def test_manyLiterals(self):
+        """
+        Nodes with many literal children dispatch via a lookup table.
+        """
+        routes = _routes(*(
+            [route(b'item%d' % (i,), Integer(b'id')) for i in range(20)] +
+            [subroute(Text(b'name'), b'item3')]))
+        self.assertSameMatches(
+            routes,
+            [[b'item%d' % (i,), b'42'] for i in range(22)] +
+            [[b'item3', b'item3', b'foo'],
+             [b'item3', b'foo'],
+             [b'item3']])
+
+
+    def test_deepNesting(self):
+        """
+        Deeply nested routes are split into several functions.
+        """
+        depth = 30
+        routes = _routes(
+            route(*[Integer(b'i%d' % (i,)) for i in range(depth)]),
+            subroute(*([b'x'] * depth)),
+            route(*([b'x'] * (depth + 1))))
+        self.assertSameMatches(
+            routes,
+            [[b'1'] * depth,
+             [b'x'] * depth,
+             [b'x'] * (depth + 1),
+             [b'x'] * (depth - 1),
+             [b'1'] * (depth + 1)])
+
+
+    def test_nonTextLiterals(self):
+        """
+        Literals that are not text are referenced rather than written as
+        source.
+        """
+        routes = _routes(route(42, b'foo'), route(Text(b'name')))
+        self.assertSameMatches(routes, [[42, b'foo'], [b'42']])
+
+
+    def test_cacheDirectory(self):
+        """
+        Generated dispatcher code is cached on disk and reused, without
+        generating source, for routes of the same structure.
+        """
+        cacheDirectory = mkdtemp()
+        self.addCleanup(rmtree, cacheDirectory)
+        request = MockRequest()
+        routes = _routes(route(b'foo', Integer(b'id')), subroute(b'bar'))
+        dispatcher = _GeneratedDispatcher(_RouteTrie(routes), cacheDirectory)
+        self.assertThat(os.listdir(cacheDirectory), HasLength(1))
+
+        def _generate(self):
+            raise RuntimeError('Source should not be generated')
+        self.patch(_DispatcherSource, 'generate', _generate)
+        routes = _routes(route(b'foo', Integer(b'id')), subroute(b'bar'))
+        dispatcher = _GeneratedDispatcher(_RouteTrie(routes), cacheDirectory)
+        self.assertThat(
+            dispatcher.match(request, [b'foo', b'42']),
+            Equals((0, OrderedDict([(b'id', 42)]), [])))
+        self.assertThat(
+            dispatcher.match(request, [b'bar', b'baz']),
+            Equals((1, OrderedDict(), [b'baz'])))
+        self.assertThat(os.listdir(cacheDirectory), HasLength(1))
+
+
+    def test_cacheDirectoryEquivalentMatchers(self):
+        """
+        Routes whose matchers are shared, because they are equivalent, do not
+        reuse the cached code of routes whose matchers are not.
+        """
+        cacheDirectory = mkdtemp()
+        self.addCleanup(rmtree, cacheDirectory)
+        request = MockRequest()
+        routes = _routes(
+            route(Integer(b'id'), b'a'), route(Integer(b'id'), b'b'))
+        _GeneratedDispatcher(_RouteTrie(routes), cacheDirectory)
+        routes = _routes(
+            route(Integer(b'id'), b'a'), route(Integer(b'id', base=16), b'b'))
+        dispatcher = _GeneratedDispatcher(_RouteTrie(routes), cacheDirectory)
+        self.assertThat(
+            dispatcher.match(request, [b'1a', b'b']),
+            Equals((1, OrderedDict([(b'id', 26)]), [])))
+        self.assertThat(os.listdir(cacheDirectory), HasLength(2))
+
+
+    def test_unwritableCacheDirectory(self):
+        """
+        If the generated dispatcher code cannot be cached on disk the failure
+        is logged and the compiled code is still used.
+        """
+        errors = captureLoggedErrors(self)
+        cacheDirectory = os.path.join(mkdtemp(), b'missing')
+        self.addCleanup(rmtree, os.path.dirname(cacheDirectory))
+        routes = _routes(route(b'foo', Integer(b'id')))
+        dispatcher = _GeneratedDispatcher(_RouteTrie(routes), cacheDirectory)
+        self.assertThat(
+            dispatcher.match(MockRequest(), [b'foo', b'42']),
+            Equals((0, OrderedDict([(b'id', 42)]), [])))
+        self.assertThat(
+            [failure.type for failure in errors],
+            Equals([IOError]))
+
+
+
+def _countingMatcher(calls, pure=True):
+    """
+    Create a matcher that records the values it is called with.
+    """
+    def _match(request, value):
+        calls.append(value)
+        return b'name', value
+    _match.pure = pure
+    return _match
+
+
+
+class RouteFilterTests(TestCase):
+    """
+    Tests for `txspinneret.route._RouteFilter`.
+    """
+    def test_firstLiterals(self):
+        """
+        Paths whose first segment is not the first literal of any route are
+        rejected.
+        """
+        routeFilter = _RouteFilter(_routes(
+            route(b'foo', Integer(b'id')),
+            subroute(b'bar'),
+            route()))
+        self.assertThat(routeFilter.rejects(b'foo', 2), Equals(False))
+        self.assertThat(routeFilter.rejects(b'bar', 5), Equals(False))
+        self.assertThat(routeFilter.rejects(b'wp-admin', 1), Equals(True))
+        self.assertThat(routeFilter.rejects(b'.env', 1), Equals(True))
+
+
+    def test_length(self):
+        """
+        Paths longer than any route can match are rejected.
+        """
+        routeFilter = _RouteFilter(_routes(
+            route(b'foo', Integer(b'id')),
+            route(Text(b'name'))))
+        self.assertThat(routeFilter.rejects(b'foo', 2), Equals(False))
+        self.assertThat(routeFilter.rejects(b'quux', 1), Equals(False))
+        self.assertThat(routeFilter.rejects(b'foo', 3), Equals(True))
+
+
+    def test_open(self):
+        """
+        Routes that can match any path disable the filter.
+        """
+        for matcher in [subroute(), route(Rest(b'path')),
+                        subroute(Text(b'name'))]:
+            routeFilter = _RouteFilter(_routes(route(b'foo'), matcher))
+            self.assertThat(routeFilter.rejects(b'bar', 10), Equals(False))
+
+
+    def test_nullRoute(self):
+        """
+        Only the null route rejects every non-empty path.
+        """
+        routeFilter = _RouteFilter(_routes(route()))
+        self.assertThat(routeFilter.rejects(b'', 1), Equals(True))
+
+
+
+class CachingRouteTableTests(TestCase):
+    """
+    Tests for `txspinneret.route._CachingRouteTable`.
+    """
+    def test_cached(self):
+        """
+        Match results are cached, hits and misses are counted.
+        """
+        calls = []
+        cache = LRUCache(10)
+        table = _CachingRouteTable(
+            _RouteTrie(_routes(route(b'foo', _countingMatcher(calls)))),
+            cache)
+        request = MockRequest()
+        for i in range(2):
+            self.assertThat(
+                table.match(request, [b'foo', b'bar']),
+                Equals((0, OrderedDict([(b'name', b'bar')]), [])))
+        self.assertThat(
+            table.match(request, [b'quux']),
+            Is(None))
+        self.assertThat(calls, Equals([b'bar']))
+        self.assertThat(
+            (cache.hits, cache.misses),
+            Equals((1, 2)))
+
+
+    def test_impure(self):
+        """
+        Match results are not cached if any matcher is not pure.
+        """
+        calls = []
+        cache = LRUCache(10)
+        table = _CachingRouteTable(
+            _RouteTrie(_routes(
+                route(b'foo', _countingMatcher(calls, pure=False)),
+                route(Text(b'name')))),
+            cache)
+        request = MockRequest()
+        table.match(request, [b'foo', b'bar'])
+        table.match(request, [b'foo', b'bar'])
+        self.assertThat(calls, Equals([b'bar', b'bar']))
+        self.assertThat(len(cache), Equals(0))
+
+
+    def test_charset(self):
+        """
+        Match results for parameters depend on the ``Content-Type`` charset.
+        """
+        cache = LRUCache(10)
+        table = _CachingRouteTable(
+            _RouteTrie(_routes(route(Text(b'name')))), cache)
+        request = MockRequest(
+            requestHeaders=Headers(
+                {b'Content-Type': [b'text/plain;charset=latin-1']}))
+        self.assertThat(
+            table.match(MockRequest(), [b'\xe2\x98\x83']),
+            Equals((0, OrderedDict([(b'name', u'\N{SNOWMAN}')]), [])))
+        self.assertThat(
+            table.match(request, [b'\xe2\x98\x83']),
+            Equals((0, OrderedDict([(b'name', u'\xe2\x98\x83')]), [])))
+        self.assertThat(len(cache), Equals(2))
+
+
+    def test_copied(self):
+        """
+        Modifying the results of a match does not affect the cached result.
+        """
+        table = _CachingRouteTable(
+            _RouteTrie(_routes(subroute(Text(b'name')))), LRUCache(10))
+        request = MockRequest()
+        index, params, remaining = table.match(request, [b'foo', b'bar'])
+        params[b'name'] = u'quux'
+        remaining.append(b'baz')
+        self.assertThat(
+            table.match(request, [b'foo', b'bar']),
+            Equals((0, OrderedDict([(b'name', u'foo')]), [b'bar'])))
+
+
+    def test_copiedRest(self):
+        """
+        Modifying the segments matched by `Rest` does not affect the cached
+        result.
+        """
+        table = _CachingRouteTable(
+            _RouteTrie(_routes(route(b'files', Rest(b'path')))), LRUCache(10))
+        request = MockRequest()
+        index, params, remaining = table.match(request, [b'files', b'a', b'b'])
+        params[b'path'].pop()
+        self.assertThat(
+            table.match(request, [b'files', b'a', b'b']),
+            Equals((0, OrderedDict([(b'path', [u'a', u'b'])]), [])))
+
+
+
+class _RoutedThing(object):
+    """
+    Basic router.
+    """
+    router = Router()
+
+    @router.route(b'foo')
+    @router.route(b'foo2')
+    def foo(self, request, params):
+        return Data(b'hello world', b'text/plain')
+
+
+    @router.route()
+    def null(self, request, params):
+        return Data(b'null route', b'text/plain')
+
+
+
+class _SubroutedThing(object):
+    """
+    Basic sub-router.
+    """
+    router = Router()
+    otherRouter = Router()
+
+    @router.subroute(b'bar')
+    def bar(self, request, params):
+        return _RoutedThing().router.resource()
+
+
+    @otherRouter.route(b'other')
+    def other(self, request, params):
+        return Data(b'other router', b'text/plain')
+
+
+
+class _Body(Resource):
+    """
+    Leaf resource that renders a body for any method.
+    """
+    isLeaf = True
+
+    def __init__(self, body):
+        Resource.__init__(self)
+        self._body = body
+
+
+    def render(self, request):
+        return self._body
+
+
+
+class _MethodThing(object):
+    """
+    Router with method-restricted routes.
+    """
+    router = Router()
+
+    @router.route(b'items', methods=[b'GET'])
+    def listItems(self, request, params):
+        return _Body(b'list')
+
+
+    @router.route(b'items', methods=[b'POST'])
+    def createItem(self, request, params):
+        return _Body(b'create')
+
+
+    @router.route(b'items', Integer(b'id'), methods=[b'PUT'])
+    def updateItem(self, request, params):
+        return _Body(b'update')
+
+
+    @router.route(b'items', Text(b'name'))
+    def item(self, request, params):
+        return _Body(b'item')
+
+
+
+def renderRoute(resource, segments, method=b'GET'):
+    """
+    Locate and render a child resource.
+
+    @type  resource: `IResource`
+    @param resource: Resource to locate the child resource on.
+
+    @type  segments: `list` of `bytes`
+    @param segments: Path segments.
+
+    @type  method: `bytes`
+    @param method: Request method.
+
+    @return: Request.
+    """
+    request = InMemoryRequest(segments)
+    request.method = method
+    child = getChildForRequest(resource, request)
+    request.render(child)
+    return request
+
+
+
+class RouterTests(TestCase):
+    """
+    Tests for `txspinneret.resource.Router`.
+    """
+    def test_descriptorRouter(self):
+        """
+        `Router.__get__` returns the `Router` instance when accessed via
+        a type.
+        """
+        _router = Router()
+        class _Descriptor(object):
+            router = _router
+
+        self.assertThat(
+            _Descriptor.router,
+            Is(_router))
+
+
+    def test_descriptorObject(self):
+        """
+        `Router.__get__` returns the instance of the object it's an attribute
+        of when accessed via an instance.
+        """
+        thing = _RoutedThing()
+        self.assertThat(
+            thing.router._self,
+            Is(thing))
+
+
+    def test_sharedRoutes(self):
+        """
+        The compiled routes are shared by every object a router is bound to.
+        """
+        first = _RoutedThing().router
+        second = _RoutedThing().router
+        self.assertThat(
+            first._router._routeTable(),
+            Is(second._router._routeTable()))
+        self.assertThat(
+            first.resource()._wrappedResource._table,
+            Is(second.resource()._wrappedResource._table))
+
+
+    def test_addRouteAfterCompiling(self):
+        """
+        Adding a route after the routes have been compiled recompiles them.
+        """
+        class _Thing(object):
+            router = Router()
+
+            @router.route(b'foo')
+            def foo(self, request, params):
+                return Data(b'foo', b'text/plain')
+
+        self.assertThat(
+            renderRoute(_Thing().router.resource(), [b'bar']).responseCode,
+            Equals(http.NOT_FOUND))
+
+        @_Thing.router.route(b'bar')
+        def bar(self, request, params):
+            return Data(b'bar', b'text/plain')
+        self.assertThat(
+            renderRoute(_Thing().router.resource(), [b'bar']).written,
+            Equals([b'bar']))
+
+
+    def test_nullRoute(self):
+        """
+        Match the null route.
+        """
+        resource = _RoutedThing().router.resource()
+        self.assertThat(
+            renderRoute(resource, []).written,
+            Equals([b'null route']))
+
+
+    def test_nullRouteNoMatch(self):
+        """
+        If there is no route that can match the request path return 404 Not
+        Found.
+        """
+        resource = _SubroutedThing().router.resource()
         request = renderRoute(resource, [])
         self.assertThat(
-            request.responseCode,
+            request.responseCode,
+            Equals(http.NOT_FOUND))
+        self.assertThat(
+            request.written,
+            Not(Equals([b'null route'])))
+
+
+    def test_route(self):
+        """
+        Perform exact route matching using the `Router.route` decorator.
+        """
+        resource = _RoutedThing().router.resource()
+        self.assertThat(
+            renderRoute(resource, [b'foo']).written,
+            Equals([b'hello world']))
+
+
+    def test_routeNoMatch(self):
+        """
+        If there is no route that can match the request path return 404 Not
+        Found.
+        """
+        resource = _RoutedThing().router.resource()
+        request = renderRoute(resource, [b'not_a_thing'])
+        self.assertThat(
+            request.responseCode,
+            Equals(http.NOT_FOUND))
+        self.assertThat(
+            request.written,
+            Not(Equals([b'hello world'])))
+
+
+    def test_subroute(self):
+        """
+        Perform partial route matching using the `Router.subroute` decorator.
+        """
+        resource = _SubroutedThing().router.resource()
+        self.assertThat(
+            renderRoute(resource, [b'bar', b'foo']).written,
+            Equals([b'hello world']))
+
+
+    def test_rest(self):
+        """
+        Routes ending in `Rest` dispatch deep paths in a single step.
+        """
+        class _Files(object):
+            router = Router()
+
+            @router.route(b'files', Rest(b'path'))
+            def files(self, request, params):
+                return Data(
+                    u'/'.join(params[b'path']).encode('utf-8'), b'text/plain')
+
+        request = renderRoute(
+            _Files().router.resource(), [b'files', b'a', b'b', b'c'])
+        self.assertThat(request.written, Equals([b'a/b/c']))
+        self.assertThat(request.postpath, Equals([]))
+
+
+    def test_methods(self):
+        """
+        Routes restricted to HTTP methods are only matched for those methods.
+        """
+        resource = _MethodThing().router.resource()
+        for method, segments, expected in [
+                (b'GET', [b'items'], [b'list']),
+                (b'HEAD', [b'items'], [b'list']),
+                (b'POST', [b'items'], [b'create']),
+                (b'PUT', [b'items', b'1'], [b'update']),
+                (b'GET', [b'items', b'1'], [b'item']),
+                (b'DELETE', [b'items', b'bob'], [b'item'])]:
+            self.assertThat(
+                renderRoute(resource, segments, method).written,
+                Equals(expected))
+
+
+    def test_methodNotAllowed(self):
+        """
+        A request for a path only matched by routes for other methods results
+        in ``405 Method Not Allowed`` and an ``Allow`` header, without
+        invoking any route handlers.
+        """
+        request = renderRoute(
+            _MethodThing().router.resource(), [b'items'], b'DELETE')
+        self.assertThat(request.responseCode, Equals(http.NOT_ALLOWED))
+        self.assertThat(
+            request.responseHeaders.getRawHeaders(b'Allow'),
+            Equals([b'GET, HEAD, POST']))
+
+
+    def test_methodNotAllowedImpure(self):
+        """
+        Parameter matchers that are not pure, such as `Load`, are not called
+        to find the allowed methods of a path.
+        """
+        calls = []
+
+        class _Loaded(object):
+            router = Router()
+
+            @router.route(
+                b'users', _countingMatcher(calls, pure=False),
+                methods=[b'GET'])
+            def user(self, request, params):
+                return _Body(b'user')
+
+            @router.route(b'users', Integer(b'id'), methods=[b'PUT'])
+            def updateUser(self, request, params):
+                return _Body(b'update')
+
+        resource = _Loaded().router.resource()
+        request = renderRoute(resource, [b'users', b'bob'], b'POST')
+        self.assertThat(request.responseCode, Equals(http.NOT_ALLOWED))
+        self.assertThat(
+            request.responseHeaders.getRawHeaders(b'Allow'),
+            Equals([b'GET, HEAD']))
+        self.assertThat(calls, Equals([]))
+        request = renderRoute(resource, [b'users', b'1'], b'POST')
+        self.assertThat(
+            request.responseHeaders.getRawHeaders(b'Allow'),
+            Equals([b'GET, HEAD, PUT']))
+        self.assertThat(calls, Equals([]))
+
+
+    def test_methodNotFound(self):
+        """
+        A request for a path not matched by any route, for any method, results
+        in ``404 Not Found``.
+        """
+        request = renderRoute(
+            _MethodThing().router.resource(), [b'other'], b'DELETE')
+        self.assertThat(request.responseCode, Equals(http.NOT_FOUND))
+
+
+    def test_rejected(self):
+        """
+        Paths that cannot match any route result in a pre-rendered ``404 Not
+        Found`` without searching the routes, or deferring the result.
+        """
+        calls = []
+
+        class _Filtered(object):
+            router = Router()
+
+            @router.route(b'users', _countingMatcher(calls))
+            def user(self, request, params):
+                return Data(b'user', b'text/plain')
+
+        resource = _Filtered().router.resource()
+        request = InMemoryRequest([b'wp-admin', b'setup.php'])
+        child = getChildForRequest(resource, request)
+        self.assertThat(child.isLeaf, Equals(True))
+        request.render(child)
+        self.assertThat(request.responseCode, Equals(http.NOT_FOUND))
+        self.assertThat(b''.join(request.written), Contains(b'not found'))
+        self.assertThat(
+            renderRoute(resource, [b'users', b'a', b'b']).responseCode,
             Equals(http.NOT_FOUND))
-        self.assertThat(
-            request.written,
-            Not(Equals([b'null route'])))
+        self.assertThat(calls, Equals([]))
 
 
-    def test_route(self):
+    def test_rejectedNested(self):
         """
-        Perform exact route matching using the `Router.route` decorator.
+        Paths that cannot match any route of a nested router result in ``404
+        Not Found``.
+        """
+        request = renderRoute(
+            _SubroutedThing().router.resource(), [b'bar', b'wp-admin'])
+        self.assertThat(request.responseCode, Equals(http.NOT_FOUND))
+
+
+    def test_multipleRoutes(self):
+        """
+        It is possible to have multiple routes handled by the same route
+        handler just by stacking the decorators.
         """
         resource = _RoutedThing().router.resource()
         self.assertThat(
-            renderRoute(resource, [b'foo']).written,
+            renderRoute(resource, [b'foo2']).written,
             Equals([b'hello world']))
 
 
-    def test_routeNoMatch(self):
+    def test_deferredHandlerResult(self):
         """
-        If there is no route that can match the request path return 404 Not
-        Found.
+        A route handler may return a `Deferred`, its result is adapted and
+        rendered once it fires.
         """
-        resource = _RoutedThing().router.resource()
-        request = renderRoute(resource, [b'not_a_thing'])
+        results = [Deferred(), Deferred()]
+
+        class _Thing(object):
+            router = Router()
+
+            @router.route(Integer(b'id'))
+            def thing(self, request, params):
+                return results[params[b'id']]
+
+        resource = _Thing().router.resource()
+        found = renderRoute(resource, [b'0'])
+        notFound = renderRoute(resource, [b'1'])
+        self.assertThat(found.written, Equals([]))
+        results[0].callback(Data(b'foo', b'text/plain'))
+        results[1].callback(None)
+        self.assertThat(found.written, Equals([b'foo']))
+        self.assertThat(found.finished, Equals(1))
+        self.assertThat(notFound.responseCode, Equals(http.NOT_FOUND))
+
+
+
+def _generatedRouter(router):
+    """
+    Create a `Router`, with the same routes as ``router``, that uses generated
+    dispatch code.
+    """
+    generated = Router(generateCode=True)
+    generated._routes = list(router._routes)
+    return generated
+
+
+
+class _GeneratedRoutersMixin(object):
+    """
+    Use generated dispatch code for all of the test routers.
+    """
+    def setUp(self):
+        super(_GeneratedRoutersMixin, self).setUp()
+        self.patch(_RoutedThing, 'router',
+                   _generatedRouter(_RoutedThing.router))
+        self.patch(_SubroutedThing, 'router',
+                   _generatedRouter(_SubroutedThing.router))
+        self.patch(_SubroutedThing, 'otherRouter',
+                   _generatedRouter(_SubroutedThing.otherRouter))
+        self.patch(_MethodThing, 'router',
+                   _generatedRouter(_MethodThing.router))
+
+
+
+class GeneratedRouterTests(_GeneratedRoutersMixin, RouterTests):
+    """
+    Tests for `txspinneret.resource.Router` using generated dispatch code.
+    """
+
+
+
+class CachingRouterTests(TestCase):
+    """
+    Tests for `txspinneret.resource.Router` with a match cache.
+    """
+    def test_noCache(self):
+        """
+        Match results are not cached by default.
+        """
+        self.assertThat(Router().matchCache, Is(None))
+
+
+    def test_cache(self):
+        """
+        Route match results are cached in `Router.matchCache`, shared by every
+        instance.
+        """
+        router = Router(cacheSize=10)
+        router._routes = list(_RoutedThing.router._routes)
+        self.patch(_RoutedThing, 'router', router)
+        for i in range(3):
+            self.assertThat(
+                renderRoute(_RoutedThing().router.resource(), [b'foo'])
+                .written,
+                Equals([b'hello world']))
         self.assertThat(
-            request.responseCode,
-            Equals(http.NOT_FOUND))
+            (router.matchCache.hits, router.matchCache.misses),
+            Equals((2, 1)))
+
+
+    def test_cacheMethods(self):
+        """
+        Route match results for method-restricted routes are cached for each
+        request method.
+        """
+        router = Router(cacheSize=10)
+        router._routes = list(_MethodThing.router._routes)
+        self.patch(_MethodThing, 'router', router)
+        for method, expected in [(b'GET', [b'list']),
+                                 (b'POST', [b'create']),
+                                 (b'GET', [b'list'])]:
+            self.assertThat(
+                renderRoute(_MethodThing().router.resource(), [b'items'],
+                            method).written,
+                Equals(expected))
         self.assertThat(
-            request.written,
-            Not(Equals([b'hello world'])))
+            (router.matchCache.hits, router.matchCache.misses),
+            Equals((1, 2)))
+
+
+
+class FindShadowedRoutesTests(TestCase):
+    """
+    Tests for `txspinneret.route.findShadowedRoutes`.
+    """
+    def shadowed(self, *matchers):
+        """
+        Find the shadowed routes, by index, for some route matchers.
+        """
+        router = Router()
+        router._routes = _routes(*matchers)
+        return [(int(shadowed[0][5:]), int(shadowing[0][5:]))
+                for shadowed, shadowing in findShadowedRoutes(router)]
+
+
+    def test_none(self):
+        """
+        There are no shadowed routes if every route can match some path that
+        earlier routes cannot.
+        """
+        self.assertThat(
+            self.shadowed(
+                route(b'foo'),
+                route(b'foo', b'bar'),
+                route(Integer(b'id')),
+                route(b'quux'),
+                subroute(b'foo', Text(b'name'))),
+            Equals([]))
+
+
+    def test_identical(self):
+        """
+        A route is shadowed by an identical earlier route.
+        """
+        matcher = Integer(b'id')
+        self.assertThat(
+            self.shadowed(
+                route(b'foo', matcher),
+                route(b'foo', matcher),
+                route(b'/foo/bar'),
+                route(b'foo', b'bar')),
+            Equals([(1, 0), (3, 2)]))
+
+
+    def test_matchesAll(self):
+        """
+        A route is shadowed by an earlier route whose matchers match any
+        segment in the same place.
+        """
+        self.assertThat(
+            self.shadowed(
+                route(b'foo', Text(b'name')),
+                route(b'foo', b'bar'),
+                route(b'foo', Integer(b'id'))),
+            Equals([(1, 0), (2, 0)]))
 
 
     def test_subroute(self):
         """
-        Perform partial route matching using the `Router.subroute` decorator.
+        A route is shadowed by an earlier subroute that matches a prefix of its
+        components.
         """
-        resource = _SubroutedThing().router.resource()
         self.assertThat(
-            renderRoute(resource, [b'bar', b'foo']).written,
-            Equals([b'hello world']))
+            self.shadowed(
+                subroute(b'foo'),
+                route(b'foo', b'bar'),
+                subroute(b'foo', Integer(b'id')),
+                route(b'foo'),
+                subroute()),
+            Equals([(1, 0), (2, 0), (3, 0)]))
 
 
-    def test_multipleRoutes(self):
+
+    def test_rest(self):
         """
-        It is possible to have multiple routes handled by the same route
-        handler just by stacking the decorators.
+        A route ending in `Rest` shadows later routes with a matching prefix.
         """
-        resource = _RoutedThing().router.resource()
         self.assertThat(
-            renderRoute(resource, [b'foo2']).written,
-            Equals([b'hello world']))
+            self.shadowed(
+                route(b'foo', Rest(b'path')),
+                route(b'foo', b'bar'),
+                subroute(b'foo', Integer(b'id')),
+                route(b'foo'),
+                route(b'bar')),
+            Equals([(1, 0), (2, 0), (3, 0)]))
+
+
+
+    def test_methods(self):
+        """
+        A route only shadows later routes if it matches all of their methods.
+        """
+        self.assertThat(
+            self.shadowed(
+                route(b'foo', methods=[b'GET']),
+                route(b'foo', methods=[b'POST']),
+                route(b'foo', methods=[b'HEAD']),
+                route(b'bar'),
+                route(b'bar', methods=[b'PUT'])),
+            Equals([(2, 0), (4, 3)]))
+
+
+    def test_boundRouter(self):
+        """
+        A router bound to an instance can be analyzed like the router itself.
+        """
+        class _Thing(object):
+            router = Router()
+
+            @router.route(b'foo', Text(b'name'))
+            def name(self, request, params):
+                pass
+
+            @router.route(b'foo', b'bar')
+            def bar(self, request, params):
+                pass
+
+        self.assertThat(
+            [(shadowed[0], shadowing[0])
+             for shadowed, shadowing in findShadowedRoutes(_Thing().router)],
+            Equals([(b'bar', b'name')]))
+
+
+
+class PrioritiseRoutesTests(TestCase):
+    """
+    Tests for `txspinneret.route._prioritiseRoutes`.
+    """
+    def test_noHits(self):
+        """
+        Routes without any hits remain in declaration order.
+        """
+        routes = _routes(route(b'a'), route(b'b'), route(b'c'))
+        self.assertThat(
+            _prioritiseRoutes(routes, [0, 0, 0]),
+            Equals([0, 1, 2]))
+
+
+    def test_disjoint(self):
+        """
+        Routes with more hits are moved ahead of routes that are disjoint from
+        them.
+        """
+        routes = _routes(
+            route(b'a'),
+            route(b'b', Integer(b'id')),
+            route(b'c', Text(b'name'), b'c'),
+            subroute(b'd', Text(b'name')),
+            route(b'e'))
+        self.assertThat(
+            _prioritiseRoutes(routes, [1, 2, 3, 4, 5]),
+            Equals([4, 3, 2, 1, 0]))
+
+
+    def test_disjointMethods(self):
+        """
+        Routes for disjoint sets of methods are disjoint.
+        """
+        routes = _routes(
+            route(Text(b'name'), methods=[b'GET']),
+            route(b'a', methods=[b'POST']),
+            route(b'a'))
+        self.assertThat(
+            _prioritiseRoutes(routes, [0, 5, 10]),
+            Equals([1, 0, 2]))
+
+
+    def test_overlapping(self):
+        """
+        Routes are never moved ahead of routes that might match the same path.
+        """
+        routes = _routes(
+            route(Text(b'name'), Text(b'name2')),
+            route(b'b', Integer(b'id')),
+            route(Text(b'name'), b'c'))
+        self.assertThat(
+            _prioritiseRoutes(routes, [0, 5, 10]),
+            Equals([0, 1, 2]))
+        routes = _routes(
+            route(Text(b'name')),
+            route(b'b'),
+            route(b'c'),
+            subroute(b'c'))
+        self.assertThat(
+            _prioritiseRoutes(routes, [0, 5, 10, 20]),
+            Equals([0, 2, 3, 1]))
+
+
+
+class ProfilingRouterTests(TestCase):
+    """
+    Tests for `txspinneret.resource.Router` route profiling.
+    """
+    def setUp(self):
+        super(ProfilingRouterTests, self).setUp()
+        class _Thing(object):
+            router = Router(profile=True)
+
+            @router.route(Integer(b'id'))
+            def integer(self, request, params):
+                return Data(b'integer', b'text/plain')
+
+            @router.route(b'foo')
+            def foo(self, request, params):
+                return Data(b'foo', b'text/plain')
+
+            @router.subroute(b'bar')
+            def bar(self, request, params):
+                return Data(b'bar', b'text/plain')
+        self.thing = _Thing
+
+
+    def render(self, segments):
+        """
+        Render a route of the test router.
+        """
+        return renderRoute(self.thing().router.resource(), segments).written
+
+
+    def test_noProfile(self):
+        """
+        Routes are not profiled by default.
+        """
+        self.assertThat(Router().statistics, Is(None))
+
+
+    def test_statistics(self):
+        """
+        Lookups, route hits and matcher calls are counted.
+        """
+        self.render([b'foo'])
+        self.render([b'42'])
+        self.render([b'bar', b'quux'])
+        self.render([b'nope', b'nope'])
+        statistics = self.thing().router.statistics
+        self.assertThat(statistics.lookups, Equals(4))
+        self.assertThat(statistics.hits, Equals([1, 1, 1]))
+        self.assertThat(statistics.attempts, Equals([4, 0, 0]))
+        self.assertThat(statistics.matcherCalls, Equals(4))
+
+
+    def test_prioritise(self):
+        """
+        Prioritising the routes tries the most frequently matched routes first,
+        without changing which route matches.
+        """
+        for i in range(3):
+            self.assertThat(self.render([b'bar']), Equals([b'bar']))
+        self.thing.router.prioritiseRoutes()
+        self.assertThat(
+            [name for name, meth, matcher
+             in self.thing.router._routeTable().routes],
+            Equals(['integer', 'bar', 'foo']))
+        self.assertThat(self.render([b'bar']), Equals([b'bar']))
+        self.assertThat(self.render([b'foo']), Equals([b'foo']))
+        self.assertThat(self.render([b'42']), Equals([b'integer']))
+        self.assertThat(
+            self.thing.router.statistics.hits,
+            Equals([1, 1, 4]))
+
+
+    def test_adaptive(self):
+        """
+        Adaptive routers prioritise their routes periodically.
+        """
+        router = Router(adaptive=True)
+        router._routes = self.thing.router._routes
+        router.adaptInterval = 2
+        self.patch(self.thing, 'router', router)
+        self.render([b'bar'])
+        self.assertThat(
+            router._routeTable().routes[1][0],
+            Equals('foo'))
+        self.render([b'bar'])
+        self.assertThat(
+            router._routeTable().routes[1][0],
+            Equals('bar'))
+
+
+
+class URLForTests(TestCase):
+    """
+    Tests for `txspinneret.route.Router.urlFor`.
+    """
+    def setUp(self):
+        super(URLForTests, self).setUp()
+        self.router = router = Router()
+
+        def handler(self, request, params):
+            pass
+
+        def other(self, request, params):
+            pass
+
+        router.route(b'users', Integer(b'id'), b'friends', Text(b'name'))(
+            handler)
+        router.route(b'users', UUID(b'uuid'))(handler)
+        router.route(b'users')(handler)
+        router.subroute(b'hex', Integer(b'id', base=16))(other)
+        router.route(b'kind', Choice(b'kind', {b'a': 1, b'b': 2}))(other)
+        router.route(b'files', Rest(b'path'))(other)
+        router.route(Regex(b're', b'[a-z]+'), b'odd%/')(other)
+        router.route(lambda request, value: (b'custom', value))(other)
+
+
+    def test_parameters(self):
+        """
+        The URL of the first route whose parameter names match those given is
+        generated, converting the parameter values back to segments.
+        """
+        self.assertThat(
+            self.router.urlFor('handler', id=42, name=u'bob'),
+            Equals(b'users/42/friends/bob'))
+        self.assertThat(
+            self.router.urlFor(
+                'handler',
+                uuid=uuid.UUID('d5bbd6a6-46b7-4ea4-9aa8-d5d2f0b0b4d5')),
+            Equals(b'users/d5bbd6a6-46b7-4ea4-9aa8-d5d2f0b0b4d5'))
+        self.assertThat(
+            self.router.urlFor('handler'),
+            Equals(b'users'))
+        self.assertThat(
+            self.router.urlFor('other', id=255),
+            Equals(b'hex/ff'))
+        self.assertThat(
+            self.router.urlFor('other', kind=2),
+            Equals(b'kind/b'))
+
+
+    def test_quoting(self):
+        """
+        Parameter values and literals are encoded and quoted.
+        """
+        self.assertThat(
+            self.router.urlFor('handler', id=1, name=u'\N{SNOWMAN}/ ?'),
+            Equals(b'users/1/friends/%E2%98%83%2F%20%3F'))
+        self.assertThat(
+            self.router.urlFor('other', re=u'a@b'),
+            Equals(b'a@b/odd%25%2F'))
+
+
+    def test_dotSegments(self):
+        """
+        Parameter values that are dot segments are percent-encoded, instead of
+        being removed or resolved against the preceding segment by clients.
+        """
+        self.assertThat(
+            self.router.urlFor('handler', id=1, name=u'..'),
+            Equals(b'users/1/friends/%2E%2E'))
+        self.assertThat(
+            self.router.urlFor('other', path=[u'.', u'..', u'...']),
+            Equals(b'files/%2E/%2E%2E/...'))
+
+
+    def test_notInteger(self):
+        """
+        Generating a URL with a value, for an `Integer` parameter, that is not
+        an integer, or is out of the parameter's range, raises `ValueError`.
+        """
+        self.router.route(b'ranged', Integer(b'n', minimum=1))(
+            lambda self, request, params: None)
+        for value in [u'42', b'42', 4.2, None, True]:
+            self.assertThat(
+                lambda: self.router.urlFor('handler', id=value, name=u'bob'),
+                raises(ValueError))
+        self.assertThat(
+            lambda: self.router.urlFor('<lambda>', n=0),
+            raises(ValueError))
+        self.assertThat(
+            self.router.urlFor('<lambda>', n=1L),
+            Equals(b'ranged/1'))
+
+
+    def test_rest(self):
+        """
+        `Rest` parameters generate a segment for each value.
+        """
+        self.assertThat(
+            self.router.urlFor('other', path=[u'a', u'b c']),
+            Equals(b'files/a/b%20c'))
+        self.assertThat(
+            self.router.urlFor('other', path=[]),
+            Equals(b'files'))
+
+
+    def test_noRoute(self):
+        """
+        Generating a URL for an unknown handler, unknown parameters or a route
+        that cannot be reversed raises `ValueError`.
+        """
+        self.assertThat(
+            lambda: self.router.urlFor('unknown'),
+            raises(ValueError))
+        self.assertThat(
+            lambda: self.router.urlFor('handler', id=1),
+            raises(ValueError))
+        self.assertThat(
+            lambda: self.router.urlFor('other', custom=u'x'),
+            raises(ValueError))
+
+
+    def test_bound(self):
+        """
+        Bound routers generate URLs for their router, including routes added
+        after URLs have been generated.
+        """
+        self.assertThat(
+            _RoutedThing().router.urlFor('foo'),
+            Equals(b'foo2'))
+        self.assertThat(
+            _RoutedThing().router.urlFor('null'),
+            Equals(b''))
+        self.router.urlFor('handler')
+        self.router.route(b'late')(lambda self, request, params: None)
+        self.assertThat(
+            self.router.urlFor('<lambda>'),
+            Equals(b'late'))
+
+
+
+class LoadTests(TestCase):
+    """
+    Tests for `txspinneret.route.Load`.
+    """
+    def setUp(self):
+        super(LoadTests, self).setUp()
+        self.clock = Clock()
+        self.batches = []
+        users = {1: u'alice', 2: u'bob'}
+
+        def _batchLoad(keys):
+            self.batches.append(keys)
+            return succeed([users.get(key) for key in keys])
+
+        loader = Loader(_batchLoad, self.clock)
+
+        class _Users(object):
+            router = Router()
+
+            @router.route(b'users', Load(Integer(b'id'), loader))
+            def user(zelf, request, params):
+                return Data(params[b'id'].encode('utf-8'), b'text/plain')
+
+            @router.subroute(b'groups', Load(Integer(b'id'), loader))
+            def group(zelf, request, params):
+                return _Users().router.resource()
+        self.resource = _Users().router.resource()
+
+
+    def test_resolved(self):
+        """
+        Route handlers are only invoked once the objects for the route
+        parameters have been loaded, and receive them in ``params``.
+        """
+        request = renderRoute(self.resource, [b'users', b'2'])
+        self.assertThat(request.written, Equals([]))
+        self.clock.advance(0)
+        self.assertThat(request.written, Equals([b'bob']))
+
+
+    def test_batched(self):
+        """
+        Concurrent requests have their objects loaded in a single batch.
+        """
+        requests = [
+            renderRoute(self.resource, [b'users', b'1']),
+            renderRoute(self.resource, [b'users', b'2']),
+            renderRoute(self.resource, [b'users', b'1']),
+            ]
+        self.clock.advance(0)
+        self.assertThat(self.batches, Equals([[1, 2]]))
+        self.assertThat(
+            [request.written for request in requests],
+            Equals([[b'alice'], [b'bob'], [b'alice']]))
+
+
+    def test_nested(self):
+        """
+        Nested routes are located once the objects for the parent route have
+        been loaded.
+        """
+        request = renderRoute(self.resource, [b'groups', b'1', b'users', b'2'])
+        self.clock.advance(0)
+        self.clock.advance(0)
+        self.assertThat(self.batches, Equals([[1], [2]]))
+        self.assertThat(request.written, Equals([b'bob']))
+
+
+    def test_notFound(self):
+        """
+        If no object is loaded for a route parameter the route does not match
+        and a ``404 Not Found`` results.
+        """
+        request = renderRoute(self.resource, [b'users', b'3'])
+        self.clock.advance(0)
+        self.assertThat(request.responseCode, Equals(http.NOT_FOUND))
+
+
+    def test_noMatch(self):
+        """
+        If the key matcher does not match no object is loaded.
+        """
+        request = renderRoute(self.resource, [b'users', b'bob'])
+        self.clock.advance(0)
+        self.assertThat(request.responseCode, Equals(http.NOT_FOUND))
+        self.assertThat(self.batches, Equals([]))
 
 
 
@@ -550,3 +2168,12 @@ class RoutedResourceTests(TestCase):
         self.assertThat(
             renderRoute(resource, [b'bar', b'foo']).responseCode,
             Equals(http.NOT_FOUND))
+
+
+
+class GeneratedRoutedResourceTests(_GeneratedRoutersMixin,
+                                   RoutedResourceTests):
+    """
+    Tests for `txspinneret.resource.routedResource` using generated dispatch
+    code.
+    """
@@ -0,0 +1,293 @@
+from testtools import TestCase
+from testtools.matchers import Equals, Is, IsInstance
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.template import (
+    Element, TagLoader, XMLString, renderElement, renderer, tags)
+
+from txspinneret import resource
+from txspinneret.resource import _RenderableResource
+from txspinneret.template import (
+    FlattenedCache, cacheable, precompile, _PrecompiledLoader)
+from txspinneret.test.util import InMemoryRequest
+
+
+
+_TEMPLATE = XMLString(
+    b'<html xmlns:t="http://twistedmatrix.com/ns/twisted.web.template/0.1">'
+    b'<head><title>Static &amp; stuff</title></head>'
+    b'<body class="page"><h1 t:render="name"><t:slot name="name" /></h1>'
+    b'<p>Static <em>text</em></p><ul><li t:render="items" /></ul>'
+    b'<br /></body></html>')
+
+
+
+class _Element(Element):
+    """
+    Element with static parts and render methods.
+    """
+    def __init__(self, loader, items=None):
+        Element.__init__(self, loader)
+        self._items = items or [u'a', u'b']
+        self.renders = 0
+
+
+    @renderer
+    def name(self, request, tag):
+        self.renders += 1
+        return tag.fillSlots(name=u'Bob <3')
+
+
+    @renderer
+    def items(self, request, tag):
+        for item in self._items:
+            yield tag.clone()(item)
+
+
+
+class _Counting(Element):
+    """
+    Element counting the number of times it is rendered.
+    """
+    loader = TagLoader(tags.p(u'Hello'))
+    renders = 0
+
+    def render(self, request):
+        _Counting.renders += 1
+        return Element.render(self, request)
+
+
+
+def render(renderable):
+    """
+    Render a renderable to an `InMemoryRequest`.
+    """
+    request = InMemoryRequest([])
+    request.render(_RenderableResource(renderable))
+    return request
+
+
+
+class FlattenedCacheTests(TestCase):
+    """
+    Tests for `txspinneret.template.FlattenedCache`.
+    """
+    def setUp(self):
+        super(FlattenedCacheTests, self).setUp()
+        self.clock = Clock()
+
+
+    def test_get(self):
+        """
+        Entries that have been stored can be looked up.
+        """
+        cache = FlattenedCache(clock=self.clock)
+        self.assertThat(cache.get(u'foo'), Is(None))
+        cache.set(u'foo', b'bar')
+        self.assertThat(cache.get(u'foo'), Equals(b'bar'))
+        self.assertThat((cache.hits, cache.misses), Equals((1, 1)))
+
+
+    def test_ttl(self):
+        """
+        Entries are discarded once their time to live expires.
+        """
+        cache = FlattenedCache(clock=self.clock)
+        cache.set(u'foo', b'bar', 10)
+        self.clock.advance(9)
+        self.assertThat(cache.get(u'foo'), Equals(b'bar'))
+        self.clock.advance(1)
+        self.assertThat(cache.get(u'foo'), Is(None))
+
+
+    def test_maxSize(self):
+        """
+        The least recently used entries are discarded once there are more
+        than ``maxSize``.
+        """
+        cache = FlattenedCache(maxSize=1, clock=self.clock)
+        cache.set(u'foo', b'bar')
+        cache.set(u'baz', b'quux')
+        self.assertThat(cache.get(u'foo'), Is(None))
+        self.assertThat(cache.get(u'baz'), Equals(b'quux'))
+
+
+    def test_clear(self):
+        """
+        Clearing the cache discards every entry.
+        """
+        cache = FlattenedCache(clock=self.clock)
+        cache.set(u'foo', b'bar')
+        cache.clear()
+        self.assertThat(cache.get(u'foo'), Is(None))
+
+
+
+class CacheableTests(TestCase):
+    """
+    Tests for `txspinneret.template.cacheable`.
+    """
+    def setUp(self):
+        super(CacheableTests, self).setUp()
+        self.clock = Clock()
+        self.cache = FlattenedCache(clock=self.clock)
+        self.patch(resource, 'flattenedCache', self.cache)
+        self.patch(_Counting, 'renders', 0)
+
+
+    def test_cached(self):
+        """
+        Renderables with the same key are only flattened once.
+        """
+        first = render(cacheable(_Counting(), u'hello'))
+        second = render(cacheable(_Counting(), u'hello'))
+        self.assertThat(
+            first.written,
+            Equals([b'<!DOCTYPE html>\n<p>Hello</p>']))
+        self.assertThat(second.written, Equals(first.written))
+        self.assertThat(second.finished, Equals(1))
+        self.assertThat(_Counting.renders, Equals(1))
+
+
+    def test_keys(self):
+        """
+        Renderables with different keys are flattened separately.
+        """
+        render(cacheable(_Counting(), u'hello'))
+        render(cacheable(_Counting(), u'world'))
+        self.assertThat(_Counting.renders, Equals(2))
+
+
+    def test_ttl(self):
+        """
+        Renderables are flattened again once their time to live expires.
+        """
+        render(cacheable(_Counting(), u'hello', ttl=10))
+        self.clock.advance(10)
+        render(cacheable(_Counting(), u'hello', ttl=10))
+        self.assertThat(_Counting.renders, Equals(2))
+
+
+    def test_asynchronous(self):
+        """
+        Renderables that flatten asynchronously are written once they have
+        been flattened, and cached.
+        """
+        d = Deferred()
+        request = render(cacheable(Element(TagLoader(tags.p(d))), u'async'))
+        self.assertThat(request.written, Equals([]))
+        d.callback(u'Later')
+        self.assertThat(
+            request.written,
+            Equals([b'<!DOCTYPE html>\n<p>Later</p>']))
+        self.assertThat(request.finished, Equals(1))
+        self.assertThat(
+            render(cacheable(Element(), u'async')).written,
+            Equals(request.written))
+
+
+    def test_failure(self):
+        """
+        If flattening fails the request processing fails, and nothing is
+        cached.
+        """
+        failures = []
+        request = InMemoryRequest([])
+        request.processingFailed = failures.append
+        renderable = cacheable(Element(TagLoader(tags.p(object()))), u'fail')
+        request.render(_RenderableResource(renderable))
+        self.assertThat(request.written, Equals([]))
+        self.assertThat(failures, Equals([failures[0]]))
+        self.assertThat(
+            self.cache.get((u'fail', b'<!DOCTYPE html>')),
+            Is(None))
+
+
+
+class PrecompileTests(TestCase):
+    """
+    Tests for `txspinneret.template.precompile`.
+    """
+    def test_sameResult(self):
+        """
+        Rendering an element with a precompiled template produces the same
+        result as rendering it with the original template.
+        """
+        expected = InMemoryRequest([])
+        renderElement(expected, _Element(_TEMPLATE))
+        request = render(_Element(precompile(_TEMPLATE)))
+        self.assertThat(
+            b''.join(request.written),
+            Equals(b''.join(expected.written)))
+        self.assertThat(request.finished, Equals(1))
+
+
+    def test_staticParts(self):
+        """
+        Static parts of the template are flattened in advance, render methods
+        are left to be called for every request.
+        """
+        loader = precompile(_TEMPLATE)
+        self.assertThat(
+            [isinstance(part, bytes) for part in loader.parts],
+            Equals([True, False, True, False, True]))
+        element = _Element(loader)
+        render(element)
+        render(element)
+        self.assertThat(element.renders, Equals(2))
+
+
+    def test_load(self):
+        """
+        Precompiled loaders still load the original template.
+        """
+        self.assertThat(
+            precompile(_TEMPLATE).load(),
+            Equals(_TEMPLATE.load()))
+
+
+    def test_asynchronous(self):
+        """
+        Dynamic parts of the template may be flattened asynchronously.
+        """
+        d = Deferred()
+        element = Element(precompile(TagLoader(tags.div(tags.p(d)))))
+        request = InMemoryRequest([])
+        self.assertThat(
+            _RenderableResource(element).render(request),
+            Is(NOT_DONE_YET))
+        d.callback(u'Later')
+        self.assertThat(
+            request.written,
+            Equals([b'<!DOCTYPE html>\n<div><p>Later</p></div>']))
+        self.assertThat(request.finished, Equals(1))
+
+
+    def test_failure(self):
+        """
+        If flattening a dynamic part fails the request processing fails.
+        """
+        failures = []
+        request = InMemoryRequest([])
+        request.processingFailed = failures.append
+        element = Element(precompile(TagLoader(tags.div(object()))))
+        request.render(_RenderableResource(element))
+        self.assertThat(request.written, Equals([]))
+        self.assertThat(failures, Equals([failures[0]]))
+
+
+    def test_overriddenRender(self):
+        """
+        Elements that override `Element.render` do not use the precompiled
+        template.
+        """
+        class _Overridden(_Counting):
+            loader = precompile(TagLoader(tags.p(u'Hello')))
+
+        self.patch(_Counting, 'renders', 0)
+        self.assertThat(
+            b''.join(render(_Overridden()).written),
+            Equals(b'<!DOCTYPE html>\n<p>Hello</p>'))
+        self.assertThat(_Counting.renders, Equals(1))
+        self.assertThat(_Overridden.loader, IsInstance(_PrecompiledLoader))
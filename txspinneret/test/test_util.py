@@ -1,9 +1,11 @@
 from testtools import TestCase
-from testtools.matchers import Equals, Is
+from testtools.matchers import Equals, HasLength, Is
 from twisted.web.http_headers import Headers
 
+from txspinneret import util
 from txspinneret.util import (
-    _parseAccept, _splitHeaders, maybe, contentEncoding, identity, FixedOffset)
+    _memoizedHeader, _parseAccept, _splitHeaders, maybe, contentEncoding,
+    identity, FixedOffset, LRUCache)
 
 
 
@@ -50,6 +52,16 @@ class ParseAcceptTests(TestCase):
                     ('text/plain', {'q': '0.2'})]))
 
 
+    def test_malformedQ(self):
+        """
+        Content types with a malformed ``q`` parameter are sorted as if it
+        were ``0``.
+        """
+        self.assertThat(
+            _parseAccept(['text/plain;q=x,text/html;q=0.1']).keys(),
+            Equals(['text/html', 'text/plain']))
+
+
 
 class SplitHeadersTests(TestCase):
     """
@@ -197,6 +209,88 @@ class ContentEncodingTests(TestCase):
             Equals(b'utf-32'))
 
 
+    def test_memoized(self):
+        """
+        The ``Content-Type`` header is only parsed once.
+        """
+        calls = []
+        def _parseHeader(value):
+            calls.append(value)
+            return parseHeader(value)
+        parseHeader = util.cgi.parse_header
+        self.patch(util.cgi, 'parse_header', _parseHeader)
+        headers = Headers({b'Content-Type': [b'text/plain;charset=utf-32']})
+        for i in range(3):
+            self.assertThat(
+                contentEncoding(headers),
+                Equals(b'utf-32'))
+        self.assertThat(calls, HasLength(1))
+
+
+
+class MemoizedHeaderTests(TestCase):
+    """
+    Tests for `txspinneret.util._memoizedHeader`.
+    """
+    def setUp(self):
+        super(MemoizedHeaderTests, self).setUp()
+        self.calls = []
+
+
+    def parse(self, values):
+        """
+        Record the values being parsed.
+        """
+        self.calls.append(values)
+        return list(reversed(values))
+
+
+    def test_memoized(self):
+        """
+        Header values are only parsed once.
+        """
+        headers = Headers({b'Accept': [b'a', b'b']})
+        for name in [b'Accept', b'accept', b'ACCEPT']:
+            self.assertThat(
+                _memoizedHeader(headers, name, self.parse),
+                Equals([b'b', b'a']))
+        self.assertThat(self.calls, Equals([[b'a', b'b']]))
+
+
+    def test_missing(self):
+        """
+        A missing header is parsed as no values.
+        """
+        headers = Headers()
+        self.assertThat(
+            _memoizedHeader(headers, b'Accept', self.parse),
+            Equals([]))
+
+
+    def test_changed(self):
+        """
+        Header values are parsed again if they have changed.
+        """
+        headers = Headers({b'Accept': [b'a']})
+        _memoizedHeader(headers, b'Accept', self.parse)
+        headers.setRawHeaders(b'Accept', [b'b'])
+        self.assertThat(
+            _memoizedHeader(headers, b'Accept', self.parse),
+            Equals([b'b']))
+        self.assertThat(self.calls, Equals([[b'a'], [b'b']]))
+
+
+    def test_parsers(self):
+        """
+        Results are memoized separately for different parsers.
+        """
+        headers = Headers({b'Accept': [b'a']})
+        _memoizedHeader(headers, b'Accept', self.parse)
+        self.assertThat(
+            _memoizedHeader(headers, b'Accept', len),
+            Equals(1))
+
+
 
 class FixedOffsetTests(TestCase):
     """
@@ -215,3 +309,48 @@ class FixedOffsetTests(TestCase):
         self.assertThat(
             repr(FixedOffset(5, 30)),
             Equals(b'FixedOffset(5, 30)'))
+
+
+
+class LRUCacheTests(TestCase):
+    """
+    Tests for `txspinneret.util.LRUCache`.
+    """
+    def test_get(self):
+        """
+        Stored items can be retrieved, lookups are counted as hits or misses.
+        """
+        cache = LRUCache(2)
+        cache.set(b'a', 1)
+        self.assertThat(cache.get(b'a'), Equals(1))
+        self.assertThat(cache.get(b'b'), Is(None))
+        self.assertThat(cache.get(b'b', 2), Equals(2))
+        self.assertThat(
+            (cache.hits, cache.misses),
+            Equals((1, 2)))
+
+
+    def test_leastRecentlyUsed(self):
+        """
+        The least recently used items are discarded once there are too many
+        items.
+        """
+        cache = LRUCache(2)
+        cache.set(b'a', 1)
+        cache.set(b'b', 2)
+        cache.get(b'a')
+        cache.set(b'c', 3)
+        self.assertThat(len(cache), Equals(2))
+        self.assertThat(b'a' in cache, Equals(True))
+        self.assertThat(b'b' in cache, Equals(False))
+        self.assertThat(b'c' in cache, Equals(True))
+
+
+    def test_clear(self):
+        """
+        All items can be discarded.
+        """
+        cache = LRUCache(2)
+        cache.set(b'a', 1)
+        cache.clear()
+        self.assertThat(len(cache), Equals(0))
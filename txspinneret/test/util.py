@@ -1,8 +1,15 @@
 from testtools.matchers import (
     AfterPreprocessing, Raises, MatchesAll, IsInstance)
+from twisted.internet.defer import Deferred
+from twisted.python import log
+from twisted.python.failure import Failure
 from twisted.web import http
 from twisted.web.http_headers import Headers
 from twisted.web.test.requesthelper import DummyRequest
+from zope.interface import implementer
+
+from txspinneret.interfaces import ISpinneretResource
+from txspinneret.resource import SpinneretResource
 
 
 
@@ -16,6 +23,14 @@ class InMemoryRequest(DummyRequest):
         # this so our tests pass on older versions of Twisted.
         self.requestHeaders = Headers()
         self.responseHeaders = Headers()
+        self.producer = None
+        self.connectionLost = False
+
+
+    @property
+    def code(self):
+        # `twisted.web.http.Request` has this rather than ``responseCode``.
+        return self.responseCode or http.OK
 
 
     def setHeader(self, name, value):
@@ -29,6 +44,21 @@ class InMemoryRequest(DummyRequest):
         self.setHeader(b'location', url)
 
 
+    def registerProducer(self, producer, streaming):
+        # `DummyRequest` calls ``resumeProducing`` in a loop until the
+        # producer unregisters, instead leave it up to the tests.
+        self.producer = producer
+        self.streaming = streaming
+
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+    def loseConnection(self):
+        self.connectionLost = True
+
+
 def MatchesException(exc_type, matcher):
     """
     Match an exception type and a user-provided matcher against the exception
@@ -38,3 +68,130 @@ def MatchesException(exc_type, matcher):
         AfterPreprocessing(
             lambda x: x[1],
             MatchesAll(IsInstance(exc_type), matcher)))
+
+
+
+def captureLoggedErrors(testCase):
+    """
+    Capture errors logged, with ``log.err``, for the duration of a test instead
+    of logging them.
+
+    :type  testCase: `testtools.TestCase`
+    :param testCase: Test case to capture logged errors for.
+
+    :rtype: `list` of `Failure <twisted:twisted.python.failure.Failure>`
+    :return: Failures logged so far, added to as more are logged.
+    """
+    failures = []
+    def _err(_stuff=None, _why=None, **kw):
+        if not isinstance(_stuff, Failure):
+            _stuff = Failure(_stuff)
+        failures.append(_stuff)
+    testCase.patch(log, 'err', _err)
+    return failures
+
+
+
+def renderRequest(resource, uri=b'/foo', method=b'GET', headers=None):
+    """
+    Render an `InMemoryRequest` for ``uri``.
+
+    :type  headers: `dict` mapping `bytes` to `bytes`
+    :param headers: Request headers.
+
+    :rtype: `InMemoryRequest`
+    """
+    path, _, _ = uri.partition(b'?')
+    request = InMemoryRequest(path.split(b'/')[1:])
+    request.uri = uri
+    request.method = method
+    for name, value in (headers or {}).items():
+        request.requestHeaders.setRawHeaders(name, [value])
+    request.render(resource)
+    return request
+
+
+
+@implementer(ISpinneretResource)
+class Handler(object):
+    """
+    Spinneret resource rendering a body with some headers, counting the number
+    of times it is rendered.
+
+    :ivar body: Result to render, or a ``callable`` taking the request and
+        returning one.
+    """
+    def __init__(self, body=b'hello', headers=None, code=http.OK,
+                 contentType=b'text/plain'):
+        self.body = body
+        self.headers = {b'Content-Type': contentType}
+        self.headers.update(headers or {})
+        self.code = code
+        self.renders = 0
+
+
+    def locateChild(self, request, segments):
+        return self, []
+
+
+    def render_GET(self, request):
+        self.renders += 1
+        request.setResponseCode(self.code)
+        for name, value in self.headers.items():
+            request.setHeader(name, value)
+        if callable(self.body):
+            return self.body(request)
+        return self.body
+
+
+    render_HEAD = render_POST = render_GET
+
+
+
+@implementer(ISpinneretResource)
+class DeferredChild(object):
+    """
+    Spinneret resource locating its child asynchronously, once `locate` is
+    called.
+    """
+    def __init__(self):
+        self._waiting = []
+
+
+    def locateChild(self, request, segments):
+        d = Deferred()
+        self._waiting.append(d)
+        return d
+
+
+    def locate(self, child):
+        """
+        Locate ``child`` for every request waiting for it.
+        """
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback((child, []))
+
+
+
+def renderDeferredChild(wrapper, child, headers=None):
+    """
+    Render a request for a child, located asynchronously, of a spinneret
+    resource wrapped by ``wrapper``.
+
+    :type  wrapper: ``callable`` taking and returning an `IResource`
+    :param wrapper: Resource wrapper, such as `CachingResource
+        <txspinneret.cache.CachingResource>`.
+
+    :param child: Child to locate once the request has been rendered.
+
+    :type  headers: `dict` mapping `bytes` to `bytes`
+    :param headers: Request headers.
+
+    :rtype: `InMemoryRequest`
+    """
+    parent = DeferredChild()
+    request = renderRequest(
+        wrapper(SpinneretResource(parent)), b'/child', headers=headers)
+    parent.locate(child)
+    return request
@@ -4,12 +4,36 @@ from collections import OrderedDict
 from functools import wraps
 from itertools import chain
 
+from twisted.web.server import Request
+
 
 # Why does Python not have this built-in?
 identity = lambda x: x
 
 
 
+def _qValue(params):
+    """
+    Get the ``q`` parameter of an ``Accept`` header value.
+
+    Malformed values, which are not a number between 0 and 1, are treated as
+    ``0``, meaning not acceptable, rather than failing the request.
+
+    @type  params: `dict`
+    @param params: Header parameters.
+
+    @rtype: `float`
+    """
+    try:
+        q = float(params.get('q', 1))
+    except ValueError:
+        return 0.0
+    if not 0 <= q <= 1:
+        return 0.0
+    return q
+
+
+
 def _parseAccept(headers):
     """
     Parse and sort an ``Accept`` header.
@@ -20,7 +44,7 @@ def _parseAccept(headers):
     @return: Mapping of media types to header parameters.
     """
     def sort(value):
-        return float(value[1].get('q', 1))
+        return _qValue(value[1])
     return OrderedDict(sorted(_splitHeaders(headers), key=sort, reverse=True))
 
 
@@ -43,6 +67,41 @@ def _splitHeaders(headers):
 
 
 
+def _memoizedHeader(requestHeaders, name, parse):
+    """
+    Parse the values of a request header, memoizing the result on the request
+    headers.
+
+    Parsing is only repeated if the raw header values have changed, meaning the
+    same header is parsed once per request no matter how many times its parsed
+    values are needed.
+
+    @type  requestHeaders: `twisted.web.http_headers.Headers`
+    @param requestHeaders: Request headers.
+
+    @type  name: `bytes`
+    @param name: Header name.
+
+    @type  parse: `callable`
+    @param parse: Callable taking a `list` of raw header values and producing
+        the parsed result, such as `_splitHeaders`.
+
+    @return: Result of ``parse``.
+    """
+    raw = requestHeaders.getRawHeaders(name, [])
+    memo = getattr(requestHeaders, '_spinneretParsedHeaders', None)
+    if memo is None:
+        memo = requestHeaders._spinneretParsedHeaders = {}
+    key = name.lower(), parse
+    cached = memo.get(key)
+    if cached is not None and cached[0] == raw:
+        return cached[1]
+    result = parse(raw)
+    memo[key] = list(raw), result
+    return result
+
+
+
 def contentEncoding(requestHeaders, encoding=None):
     """
     Extract an encoding from a ``Content-Type`` header.
@@ -59,8 +118,7 @@ def contentEncoding(requestHeaders, encoding=None):
     """
     if encoding is None:
         encoding = b'utf-8'
-    headers = _splitHeaders(
-        requestHeaders.getRawHeaders(b'Content-Type', []))
+    headers = _memoizedHeader(requestHeaders, b'Content-Type', _splitHeaders)
     if headers:
         return headers[0][1].get(b'charset', encoding)
     return encoding
@@ -83,6 +141,83 @@ def maybe(f, default=None):
 
 
 
+def _renderProxied(request, resource):
+    """
+    Render a resource to a request proxy, the way `twisted.web.server.Request`
+    renders a resource to itself.
+
+    Proxies that intercept how a response is written must render through
+    themselves, otherwise a child located asynchronously, which Twisted Web
+    renders by calling ``request.render``, is written to the proxied request
+    instead.
+
+    :param request: Request proxy to render to.
+
+    :type  resource: `IResource <twisted:twisted.web.resource.IResource>`
+    :param resource: Resource to render.
+    """
+    Request.render.__func__(request, resource)
+
+
+
+class LRUCache(object):
+    """
+    Bounded mapping that discards the least recently used items.
+
+    :ivar maxSize: Maximum number of items to keep.
+
+    :ivar hits: Number of lookups that found an item.
+
+    :ivar misses: Number of lookups that did not find an item.
+    """
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+
+    def __len__(self):
+        return len(self._items)
+
+
+    def __contains__(self, key):
+        return key in self._items
+
+
+    def get(self, key, default=None):
+        """
+        Look up an item, marking it as the most recently used.
+        """
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items[key] = value
+        self.hits += 1
+        return value
+
+
+    def set(self, key, value):
+        """
+        Store an item, discarding the least recently used items if there are
+        too many.
+        """
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxSize:
+            self._items.popitem(last=False)
+
+
+    def clear(self):
+        """
+        Discard all items.
+        """
+        self._items.clear()
+
+
+
 # Thank you epsilon.extime.
 class FixedOffset(datetime.tzinfo):
     """